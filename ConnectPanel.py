@@ -4,20 +4,26 @@ from PyQt5.QtCore import Qt
 from PyQt5 import QtGui
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QWidget
-from PyQt5 import uic
 
-from LabJackPython import deviceCount, listAll
-from labjack import MyU3
+from uicache import loadUiType
+from devicemonitor import DeviceMonitor
 
-Form, Base = uic.loadUiType('connect.ui')
+Form, Base = loadUiType('connect.ui')
 
 class ConnectPanel(Base, Form):
+    '''
+    device selection and properties
+    the LabJack driver stack (labjack, u3, LabJackPython) is imported by the
+    monitor thread and by the methods needing it, so the window can appear first;
+    devices are opened on the monitor thread, with a busy indicator meanwhile
+    '''
     childNames = ['deviceComboBox', 'propertyViewer']
 
-    deviceType = 3
+    firstDeviceIndex = 7 # combo box entries before the device list
+    brokerAddress = '5556' # see publisher.parseAddress
 
-    deviceOpened = QtCore.pyqtSignal(MyU3)
-    deviceDisconnected = QtCore.pyqtSignal()
+    deviceOpened = QtCore.pyqtSignal(object) # MyU3
+    deviceUnplugged = QtCore.pyqtSignal(int) # serial number of a device gone from the bus
 
     def __init__(self, *args, **kwargs):
 
@@ -29,6 +35,8 @@ class ConnectPanel(Base, Form):
         self.gatherChildren()
 
         self.setupComboBox()
+        self.setupProgress()
+        self.setupMonitor()
 
         self.propertyViewer.setColumnCount(2)
         self.propertyViewer.setHorizontalHeaderItem(0, QtWidgets.QTableWidgetItem('Property'))
@@ -49,10 +57,46 @@ class ConnectPanel(Base, Form):
         self.deviceComboBox.addItem('Select a device...')
         self.deviceComboBox.insertSeparator(1)
         self.deviceComboBox.addItem('Refresh list')
-        self.deviceComboBox.insertSeparator(3)
+        self.deviceComboBox.addItem('Replay recording...')
+        self.deviceComboBox.addItem('Simulated U3')
+        self.deviceComboBox.addItem('Connect to broker...')
+        self.deviceComboBox.insertSeparator(6)
 
         self.deviceComboBox.currentIndexChanged.connect(self.comboBoxCallback)
-        self.comboBoxCallback(2)
+        self.deviceList = [] # device info of the combo box entries from firstDeviceIndex on
+
+    def setupMonitor(self):
+        # the device list follows the monitor; its first scan fills it in
+        self.monitorThread = QtCore.QThread()
+        self.monitor = DeviceMonitor()
+        self.monitor.moveToThread(self.monitorThread)
+        self.monitor.deviceAdded.connect(self.deviceAdded)
+        self.monitor.deviceRemoved.connect(self.deviceRemoved)
+        self.monitor.deviceReady.connect(self.deviceReady)
+        self.monitor.openFailed.connect(self.openFailed)
+        self.monitorThread.started.connect(self.monitor.work)
+        self.monitorThread.start()
+
+    def setupProgress(self):
+        self.progressLabel = QtWidgets.QLabel()
+        self.progressBar = QtWidgets.QProgressBar()
+        self.progressBar.setRange(0, 0) # busy, no percentage
+        layout = self.deviceComboBox.parentWidget().layout()
+        layout.addWidget(self.progressLabel)
+        layout.addWidget(self.progressBar)
+        self.showProgress(None)
+
+    def showProgress(self, message):
+        # None hides the indicator and allows picking a device again
+        self.progressLabel.setText(message or '')
+        self.progressLabel.setVisible(message is not None)
+        self.progressBar.setVisible(message is not None)
+        self.deviceComboBox.setEnabled(message is None)
+
+    def stopMonitor(self):
+        self.monitor.stop()
+        self.monitorThread.quit()
+        self.monitorThread.wait()
 
     def comboBoxCallback(self, newIndex):
         if newIndex == 0:
@@ -60,41 +104,113 @@ class ConnectPanel(Base, Form):
         elif newIndex == 2:
             self.refreshDeviceList()
             self.deviceComboBox.setCurrentIndex(0)
-        elif newIndex >= 4:
-            self.selectDevice(newIndex - 4)
-
-    def clearDevices(self):
-        self.propertyViewer.clearContents()
-        self.propertyViewer.setRowCount(0)
-        MyU3.close_all()
-        self.deviceDisconnected.emit()
-        for i in range(self.deviceComboBox.count(), 3, -1):
-            self.deviceComboBox.removeItem(i)
+        elif newIndex == 3:
+            self.deviceComboBox.setCurrentIndex(0)
+            self.openRecording()
+        elif newIndex == 4:
+            self.deviceComboBox.setCurrentIndex(0)
+            self.openSimulator()
+        elif newIndex == 5:
+            self.deviceComboBox.setCurrentIndex(0)
+            self.openBroker()
+        elif newIndex >= self.firstDeviceIndex:
+            self.deviceComboBox.setCurrentIndex(0) # so any device can be picked next, including this one
+            self.selectDevice(newIndex - self.firstDeviceIndex)
 
     def refreshDeviceList(self):
-        self.clearDevices()
-        devices = listAll(self.deviceType)
-        self.deviceList = []
-        for key in devices.keys():
-            self.deviceComboBox.addItem(devices[key]['deviceName'])
-            self.deviceList.append(devices[key])
+        # answered by deviceAdded/deviceRemoved; open devices are left alone
+        self.monitor.refresh()
+
+    @QtCore.pyqtSlot(dict)
+    def deviceAdded(self, info):
+        serials = [dev['serialNumber'] for dev in self.deviceList]
+        i = sum(serial < info['serialNumber'] for serial in serials) # kept sorted by serial
+        self.deviceList.insert(i, info)
+        self.deviceComboBox.insertItem(self.firstDeviceIndex + i,
+            '{0} ({1})'.format(info['deviceName'], info['serialNumber']))
+
+    @QtCore.pyqtSlot(int)
+    def deviceRemoved(self, serial):
+        for i, dev in enumerate(self.deviceList):
+            if dev['serialNumber'] == serial:
+                del self.deviceList[i]
+                self.deviceComboBox.removeItem(self.firstDeviceIndex + i)
+                break
+        self.deviceUnplugged.emit(serial) # it may have been open
 
     def selectDevice(self, index):
+        from labjack import MyU3 # loaded by the monitor before it lists any device
         dev = self.deviceList[index]
         sn = dev['serialNumber']
+        if sn in MyU3.open_serials():
+            print('Device {} is already open.'.format(sn))
+            return
+
+        # open, calibration and channel configuration reads happen on the monitor thread
+        self.showProgress('Opening {0} ({1})...'.format(dev['deviceName'], sn))
+        self.monitor.openDevice(sn)
+
+    @QtCore.pyqtSlot(object)
+    def deviceReady(self, instance):
+        self.showProgress(None)
+        self.myu3instance = instance
+        self.displayProperties()
+
+    @QtCore.pyqtSlot(int, str)
+    def openFailed(self, serial, message):
+        self.showProgress(None)
+        print('Unable to open device {0}: {1}'.format(serial, message))
 
-        self.myu3instance = MyU3(False, sn)
+    def openRecording(self):
+        from replay import ReplayDevice
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(self, 'Replay recording', '', 'Recordings (*.ljr)')
+        if not path:
+            return
+
+        self.myu3instance = ReplayDevice(path)
+        self.displayProperties()
+
+    def openSimulator(self):
+        from labjack import MyU3
+        from simulator import SimulatedU3
+        serial = SimulatedU3.firstSerial
+        while serial in MyU3.open_serials():
+            serial += 1
+        self.myu3instance = SimulatedU3(serialNumber=serial)
+        self.displayProperties()
+
+    def openBroker(self):
+        from broker import RemoteU3
+        from publisher import parseAddress
+        text, ok = QtWidgets.QInputDialog.getText(self, 'Connect to broker',
+            'Port ([host:]port) or Unix socket path:', text=self.brokerAddress)
+        if not ok:
+            return
+
+        try:
+            self.myu3instance = RemoteU3(parseAddress(text))
+        except (ValueError, OSError) as e: # e.g. no broker there
+            print('Unable to connect to the broker at {0}: {1}'.format(text, e))
+            return
+        self.brokerAddress = text
         self.displayProperties()
 
     def displayProperties(self):
         self.updatePropertyViewer()
         self.deviceOpened.emit(self.myu3instance)
 
+    def showProperties(self, instance):
+        # None clears the viewer
+        self.myu3instance = instance
+        if instance is None:
+            self.propertyViewer.clearContents()
+            self.propertyViewer.setRowCount(0)
+        else:
+            self.updatePropertyViewer()
+
     def updatePropertyViewer(self):
-        prop = self.myu3instance.configU3()
-        ioprops = self.myu3instance.configIO()
-        prop['FIOAnalog'] = ioprops['FIOAnalog']
-        prop['EIOAnalog'] = ioprops['EIOAnalog']
+        prop = dict(self.myu3instance.properties)
+        prop.update(self.myu3instance.ioProperties())
         self.propertyViewer.setRowCount(len(prop))
         for i, (key, val) in enumerate(prop.items()):
             self.propertyViewer.setItem(i, 0, QtWidgets.QTableWidgetItem(key))
@@ -119,6 +235,7 @@ class ConnectPanel(Base, Form):
 if __name__ == '__main__':
     app = QtWidgets.QApplication([])
     panel = ConnectPanel()
+    app.aboutToQuit.connect(panel.stopMonitor)
     panel.show()
     app.exec_()
 
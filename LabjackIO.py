@@ -4,9 +4,10 @@ from PyQt5.QtCore import Qt
 from PyQt5 import QtGui
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QWidget
-from PyQt5 import uic
 
-Form, Base = uic.loadUiType('channel.ui')
+from uicache import loadUiType
+
+Form, Base = loadUiType('channel.ui')
 
 class LabjackIO(Base, Form):
     childNames = ['outerGroupBox',
@@ -15,8 +16,11 @@ class LabjackIO(Base, Form):
         'directionGroupBox', 'inputButton', 'outputButton', 'directionStack',
         'inputGroupBox', 'inputLabelWidget', 'inputHighLabel', 'inputLowLabel', 'led',
         'outputGroupBox', 'outputLabelWidget', 'outputHighLabel', 'outputLowLabel', 'outputSwitch']
-    ONSS = 'color: rgb(0, 0, 0);'
-    OFFSS = 'color: rgba(0, 0, 0, 63);'
+    ONCOLOR = QtGui.QColor(0, 0, 0)
+    OFFCOLOR = QtGui.QColor(0, 0, 0, 63)
+    palettes = None # (on, off) label palettes, shared by every instance
+    icons = {} # image file -> QIcon, shared by every instance
+    buttonStyle = None # button.css, read once
 
     typeChanged = QtCore.pyqtSignal(int, bool)
     directionChanged = QtCore.pyqtSignal(int, bool)
@@ -31,6 +35,7 @@ class LabjackIO(Base, Form):
 
         self.setupUi(self)
         self.gatherChildren()
+        self.setupPalettes()
 
         self.addIcons()
 
@@ -38,8 +43,7 @@ class LabjackIO(Base, Form):
         self.groupButtons((self.inputButton, self.outputButton), 'direction')
 
         self.connectButtons()
-
-        self.setStyleSheet(open('button.css').read())
+        self.inputStateChanged(False)
 
         if self.exclusiveType == 'analog':
             self.analogButton.click()
@@ -67,6 +71,20 @@ class LabjackIO(Base, Form):
             else:
                 print("Child '{}' not found!".format(name))
 
+    def setupPalettes(self):
+        # high/low labels are dimmed by swapping palettes: setStyleSheet re-parses the style on every call
+        if LabjackIO.palettes is None:
+            on = QtGui.QPalette(self.inputHighLabel.palette())
+            on.setColor(QtGui.QPalette.WindowText, self.ONCOLOR)
+            off = QtGui.QPalette(on)
+            off.setColor(QtGui.QPalette.WindowText, self.OFFCOLOR)
+            LabjackIO.palettes = (on, off)
+
+    def setLabelStates(self, highLabel, lowLabel, isHigh):
+        on, off = self.palettes
+        highLabel.setPalette(on if isHigh else off)
+        lowLabel.setPalette(off if isHigh else on)
+
     def addIcons(self):
         typeIconHgt = 16
         dirIconHgt = 12
@@ -76,11 +94,21 @@ class LabjackIO(Base, Form):
         self.setButtonIcon(self.inputButton, 'icons/input.svg', (1.5*dirIconHgt, dirIconHgt))
         self.setButtonIcon(self.outputButton, 'icons/output.svg', (1.5*dirIconHgt, dirIconHgt))
 
+    @classmethod
+    def loadStyleSheet(cls):
+        # button.css applies to LabjackIO descendants only: set it once on a container of
+        # the channel widgets rather than on each one, which re-parses it every time
+        if cls.buttonStyle is None:
+            with open('button.css') as f:
+                cls.buttonStyle = f.read()
+        return cls.buttonStyle
+
     def setButtonIcon(self, button, imagefile, size):
         margins = QtCore.QMargins(5, 10, 5, 10)
 
-        p = QtGui.QPixmap(imagefile)
-        ic = QtGui.QIcon(p)
+        ic = self.icons.get(imagefile)
+        if ic is None:
+            ic = self.icons[imagefile] = QtGui.QIcon(QtGui.QPixmap(imagefile))
         button.setIcon(ic)
         size = [int(s) for s in size]
         iconSize = QtCore.QSize(*size)
@@ -125,22 +153,16 @@ class LabjackIO(Base, Form):
     def doOutputStateChanged(self):
         newState = self.outputSwitch.isChecked()
         self.outputStateChanged.emit(self.ioNumber, newState)
-        if newState:
-            self.outputHighLabel.setStyleSheet(self.ONSS)
-            self.outputLowLabel.setStyleSheet(self.OFFSS)
-        else:
-            self.outputHighLabel.setStyleSheet(self.OFFSS)
-            self.outputLowLabel.setStyleSheet(self.ONSS)
+        self.setLabelStates(self.outputHighLabel, self.outputLowLabel, newState)
 
     @QtCore.pyqtSlot(bool)
     def inputStateChanged(self, newState):
         self.led.state = newState
-        if newState:
-            self.inputHighLabel.setStyleSheet(self.ONSS)
-            self.inputLowLabel.setStyleSheet(self.OFFSS)
-        else:
-            self.inputHighLabel.setStyleSheet(self.OFFSS)
-            self.inputLowLabel.setStyleSheet(self.ONSS)
+        self.setLabelStates(self.inputHighLabel, self.inputLowLabel, newState)
+
+    def edgeCountsChanged(self, rising, falling):
+        # edges seen on the input while streaming, including pulses too short for the LED
+        self.inputGroupBox.setToolTip('{0:,} rising, {1:,} falling edges'.format(rising, falling))
 
     @QtCore.pyqtSlot(float)
     def analogInputChanged(self, newValue):
@@ -149,6 +171,7 @@ class LabjackIO(Base, Form):
 if __name__ == '__main__':
     app = QtWidgets.QApplication([])
     w = LabjackIO()
+    w.setStyleSheet(LabjackIO.loadStyleSheet())
     w.show()
     app.exec_()
 
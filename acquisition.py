@@ -0,0 +1,451 @@
+# standard imports
+import threading
+import time
+from time import perf_counter
+from collections import deque
+
+# third party imports
+import numpy as np
+from PyQt5 import QtCore
+
+from stream import StreamReader
+from ringbuffer import RingBuffer
+from recording import Recorder
+from publisher import SamplePublisher, channelMask
+from trigger import TriggeredCapture, StreamColumns, PollColumns
+from edges import EdgeDetector, eventsPath
+from channels import NUM_CHANNELS
+
+# origin of the host timeline shared by every worker in the process, so samples
+# from several devices line up (see hostTime)
+EPOCH = perf_counter()
+
+def hostTime():
+    return perf_counter() - EPOCH
+
+class AcquisitionWorker(QtCore.QObject):
+    '''
+    long-lived acquisition loop, moved to its own QThread once and never restarted
+        - polling: scans every input at targetRate (Hz) with MyU3.scanInputs
+        - streaming: reads stream blocks as they arrive and emits the newest
+          scan at most targetRate times per second
+    results are only emitted once the GUI has acknowledge()d the previous ones;
+    cycles finishing while the GUI is still busy are counted as dropped instead
+    of queueing up behind it
+    writes queued on the device (MyU3.queueChannel*) are flushed by the loop,
+    in the same feedback packet as the next scan when polling
+    a device error stops acquisition (see fail) but not the loop
+    '''
+    inputsReady = QtCore.pyqtSignal(dict)
+    writesFlushed = QtCore.pyqtSignal()
+    recordingStopped = QtCore.pyqtSignal(str)
+    captureStopped = QtCore.pyqtSignal()
+    edgesCounted = QtCore.pyqtSignal(object) # (rising, falling) per channel, while streaming
+    acquisitionFailed = QtCore.pyqtSignal(str) # the error that stopped acquisition
+
+    ledInterval = 0.5 # s, heartbeat blink while polling
+    historyLength = 100000 # polled scans kept for plotting
+
+    def __init__(self, targetRate=2.0):
+        QtCore.QObject.__init__(self)
+        self.targetRate = targetRate
+
+        self.instance = None
+        self.streamReader = None
+        self.scanPackets = None
+        self.pollHistory = None
+        self.recorder = None
+        self.publisher = None
+        self.capture = None
+        self.edges = None # EdgeDetector of the digital inputs while streaming
+        self.edgesEmitted = 0
+        self.streamMask = 0 # channels acquired by the stream, as published
+
+        self.pendingConfig = None
+        self.quitting = False
+        self.wake = threading.Event()
+        self.applied = threading.Event()
+        self.delivered = threading.Event()
+        self.delivered.set()
+
+        # held for every device transaction made by the loop
+        self.lock = threading.RLock()
+
+        self.resetCounters()
+
+    def resetCounters(self):
+        self.cycles = 0 # scans (polling) or blocks (streaming) completed
+        self.overruns = 0 # cycles that finished after their deadline
+        self.dropped = 0 # results not emitted because the GUI was behind
+        self.cycleTimes = deque(maxlen=100)
+
+    # -------------------- CALLED FROM OTHER THREADS --------------------
+
+    def configure(self, instance, streamRate=None, wait=True):
+        '''
+        poll instance (or stream it at streamRate scans/s); None stops acquiring
+        applied by the loop at its next cycle; with wait, blocks until then, after
+        which the previous device is no longer in use
+        '''
+        self.applied.clear()
+        self.pendingConfig = (instance, streamRate)
+        self.wake.set()
+        if wait:
+            self.applied.wait()
+
+    def invalidate(self):
+        # channel configuration changed: recompile the scan before the next poll
+        self.scanPackets = None
+
+    def writesQueued(self):
+        # flush now rather than at the next scheduled cycle
+        self.wake.set()
+
+    def setTargetRate(self, rate):
+        self.targetRate = rate
+        self.wake.set()
+
+    def acknowledge(self):
+        self.delivered.set()
+
+    def stop(self):
+        self.quitting = True
+        self.wake.set()
+
+    def achievedRate(self):
+        if len(self.cycleTimes) < 2:
+            return 0.0
+        span = self.cycleTimes[-1] - self.cycleTimes[0]
+        return (len(self.cycleTimes) - 1) / span if span > 0 else 0.0
+
+    def startRecording(self, path):
+        '''
+        record everything acquired from now on to path (see recording.Recorder)
+            - streaming: raw codes, one column per stream channel, with calibration in the header
+            - polling: a time column (host timeline, see hostTime) then one column per channel
+        the recording stops by itself if the acquired columns change
+        '''
+        with self.lock:
+            if self.instance is None:
+                raise Exception('No device instance open.')
+            self.stopRecording()
+
+            recorder = Recorder(path, *self.columns())
+            recorder.start()
+            self.recorder = recorder
+            if self.edges is not None:
+                self.edges.startRecording(eventsPath(path), {'startTime': time.time() - hostTime(),
+                    'device': self.instance.properties, 'recording': path})
+
+    def stopRecording(self):
+        with self.lock:
+            recorder, self.recorder = self.recorder, None
+            edges = self.edges
+        if edges is not None:
+            edges.stopRecording()
+        if recorder is not None:
+            recorder.close()
+            self.recordingStopped.emit(recorder.path)
+
+    def startCapture(self, trigger, directory, preScans, postScans, continuous=True):
+        '''
+        save preScans scans before and postScans from each firing of trigger (a
+        trigger.Trigger) on, as recordings in directory (see trigger.TriggeredCapture)
+        raises ValueError if the trigger needs a channel that is not acquired
+        the capture stops by itself if the acquired columns change
+        '''
+        with self.lock:
+            if self.instance is None:
+                raise Exception('No device instance open.')
+            self.stopCapture()
+
+            width, dtype, metadata = self.columns()
+            if self.streamReader is not None:
+                columns = StreamColumns(self.streamReader.channels, self.streamReader.calibration)
+            else:
+                columns = PollColumns()
+            self.capture = TriggeredCapture(trigger, columns, width, dtype, metadata, directory,
+                preScans, postScans, continuous)
+
+    def stopCapture(self):
+        with self.lock:
+            capture, self.capture = self.capture, None
+        if capture is not None:
+            capture.stop()
+            self.captureStopped.emit()
+
+    def startPublishing(self, address):
+        '''
+        serve everything acquired from now on to local subscribers at address
+        (see publisher.SamplePublisher), in the same columns as a recording;
+        unlike a recording, publishing carries on across mode and channel table
+        changes, announcing the new columns to the subscribers
+        '''
+        self.stopPublishing()
+        publisher = SamplePublisher(address)
+        publisher.start()
+        with self.lock:
+            if self.instance is not None:
+                self.announce(publisher) # before the loop can publish to it
+            self.publisher = publisher
+
+    def stopPublishing(self):
+        with self.lock:
+            publisher, self.publisher = self.publisher, None
+        if publisher is not None:
+            publisher.close()
+
+    def columns(self):
+        # (width, dtype, metadata) of what is being acquired, as a recording stores it
+        metadata = {'device': self.instance.properties, 'io': self.instance.ioProperties()}
+        if self.streamReader is not None:
+            metadata.update(self.streamReader.metadata())
+            return len(self.streamReader.channels), 'uint16', metadata
+        metadata.update({'mode': 'poll', 'startTime': time.time() - hostTime()})
+        return NUM_CHANNELS + 1, 'float64', metadata
+
+    def announce(self, publisher=None):
+        # describe the acquired columns to the subscribers; called whenever they change
+        publisher = publisher or self.publisher
+        if publisher is None:
+            return
+        width, dtype, metadata = self.columns()
+        publisher.announce(metadata, width, dtype)
+        if self.streamReader is not None:
+            states = self.streamReader.states
+            self.streamMask = channelMask(i for i, state in enumerate(states) if not state[1])
+
+    def history(self, channels, seconds):
+        '''
+        the last seconds of acquired data as (times, {channelNum: values}), with
+        times on the common host timeline (see hostTime), from the stream buffer
+        when streaming or the poll history otherwise
+        (see StreamReader.channelHistory); safe to call while acquiring
+        '''
+        reader = self.streamReader
+        if reader is not None:
+            times, values = reader.channelHistory(channels, int(seconds * reader.scanFrequency))
+            return times + (reader.startTime - EPOCH), values
+
+        history = self.pollHistory
+        if history is None:
+            return np.zeros(0), {}
+
+        # enough rows to cover the window at the current rate, then trim to it
+        rate = max(self.targetRate, self.achievedRate())
+        columns = [0] + [channelNum + 1 for channelNum in channels]
+        rows = history.latest(int(1.5 * seconds * rate) + 2, columns)
+        rows = rows[rows[:, 0] >= rows[-1, 0] - seconds] if len(rows) else rows
+
+        values = {}
+        for k, channelNum in enumerate(channels):
+            col = rows[:, k + 1]
+            if len(col) and not np.isnan(col[-1]):
+                values[channelNum] = col
+        return rows[:, 0], values
+
+    # -------------------- ACQUISITION LOOP --------------------
+
+    def addToHistory(self, data, timestamp):
+        row = np.full(NUM_CHANNELS + 1, np.nan)
+        row[0] = timestamp
+        for channelNum, val in data.items():
+            row[channelNum + 1] = val
+        self.pollHistory.write(row)
+
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.write(row)
+        publisher = self.publisher
+        if publisher is not None:
+            publisher.publish(row, channelMask(data))
+        capture = self.capture
+        if capture is not None:
+            capture.write(row)
+
+    def applyConfig(self):
+        instance, streamRate = self.pendingConfig
+        self.pendingConfig = None
+
+        with self.lock:
+            self.stopRecording()
+            self.stopCapture()
+            if self.streamReader is not None:
+                self.streamReader.stopStream()
+                self.streamReader = None
+                self.edges = None
+
+            self.instance = instance
+            self.scanPackets = None
+            self.resetCounters()
+            self.pollHistory = RingBuffer(self.historyLength, NUM_CHANNELS + 1)
+
+            if instance is not None and streamRate:
+                self.startStream(streamRate)
+            elif instance is not None:
+                self.announce()
+
+        self.applied.set()
+
+    def startStream(self, streamRate):
+        self.streamReader = StreamReader(self.instance, streamRate)
+        self.streamReader.start()
+        reader = self.streamReader
+        if EdgeDetector.hasDigitalInputs(reader.channels):
+            self.edges = EdgeDetector(reader.channels, reader.states, reader.scanFrequency,
+                reader.startTime - EPOCH)
+        else:
+            self.edges = None
+        self.edgesEmitted = -1 # the first counts reset those shown for the last stream
+        self.announce()
+
+    def flushStreamWrites(self):
+        '''
+        output states can be written mid-stream; type/direction changes rebuild the
+        stream table, and the stream is stopped before they are sent (the U3 rejects
+        configuration commands while streaming)
+        '''
+        with self.lock:
+            streamRate = self.streamReader.scanFrequency
+            restart = self.instance.hasPendingConfigChanges()
+            if restart:
+                self.stopStreamForConfig()
+            writes, configChanged = self.instance.commitWrites()
+            if writes:
+                self.instance.getFeedback(*writes)
+            if configChanged and not restart: # e.g. a broker's stream changed by another client
+                self.stopStreamForConfig()
+                restart = True
+            if restart:
+                self.startStream(streamRate)
+        self.writesFlushed.emit()
+
+    def stopStreamForConfig(self):
+        self.stopRecording() # the stream channels are about to change
+        self.stopCapture()
+        self.streamReader.stopStream()
+
+    def emit(self, data):
+        if self.delivered.is_set():
+            self.delivered.clear()
+            self.inputsReady.emit(data)
+        else:
+            self.dropped += 1
+
+    def emitEdges(self, edges):
+        # edge counters, only when there are new edges
+        if edges is None:
+            return
+        rising, falling = edges.counts()
+        total = int(rising.sum() + falling.sum())
+        if total != self.edgesEmitted:
+            self.edgesEmitted = total
+            self.edgesCounted.emit((rising, falling))
+
+    def fail(self, error):
+        '''
+        stop acquiring after a device error: release the stream and everything
+        fed by it, then report the error (acquisitionFailed) rather than let it end
+        the thread; the next configure() starts over
+        '''
+        with self.lock:
+            reader, self.streamReader = self.streamReader, None
+            self.instance = None
+            self.scanPackets = None
+            self.edges = None
+        if reader is not None:
+            try:
+                reader.stopStream()
+            except Exception:
+                pass # the device is likely gone already
+        self.stopRecording()
+        self.stopCapture()
+        self.stopPublishing()
+        self.applied.set()
+        self.acquisitionFailed.emit('{0}: {1}'.format(type(error).__name__, error))
+
+    @QtCore.pyqtSlot()
+    def work(self):
+        nextTime = perf_counter()
+        lastEmit = lastLED = 0.0
+
+        while not self.quitting:
+            try:
+                if self.pendingConfig is not None:
+                    self.applyConfig()
+                    nextTime = perf_counter()
+
+                if self.instance is None:
+                    self.wake.wait()
+                    self.wake.clear()
+                    continue
+
+                if self.streamReader is not None:
+                    if self.instance.hasPendingWrites():
+                        self.flushStreamWrites()
+
+                    # the device paces the loop; just throttle what goes to the GUI
+                    with self.lock:
+                        scans = self.streamReader.readBlock()
+                    recorder = self.recorder
+                    if recorder is not None and len(scans):
+                        recorder.write(scans)
+                    publisher = self.publisher
+                    if publisher is not None and len(scans):
+                        publisher.publish(scans, self.streamMask)
+                    capture = self.capture
+                    if capture is not None:
+                        capture.write(scans)
+                    edges = self.edges
+                    if edges is not None and len(scans):
+                        edges.write(scans, self.streamReader.nextScan - len(scans))
+                    now = perf_counter()
+                    self.cycles += 1
+                    self.cycleTimes.append(now)
+                    if now - lastEmit >= 1.0 / self.targetRate:
+                        lastEmit = now
+                        self.emit(self.streamReader.latestInputs())
+                        self.emitEdges(edges)
+                    continue
+
+                flushed = self.instance.hasPendingWrites()
+                with self.lock:
+                    if flushed:
+                        writes, configChanged = self.instance.commitWrites()
+                        if configChanged:
+                            self.scanPackets = None
+                        data = self.instance.scanInputs(self.instance.compileScan(writes=writes))
+                    else:
+                        if self.scanPackets is None:
+                            self.scanPackets = self.instance.compileScan()
+                        data = self.instance.scanInputs(self.scanPackets)
+                    if nextTime - lastLED >= self.ledInterval:
+                        lastLED = nextTime
+                        self.instance.toggleLED()
+
+                now = perf_counter()
+                self.cycles += 1
+                self.cycleTimes.append(now)
+                self.addToHistory(data, now - EPOCH)
+                self.emit(data)
+                if flushed:
+                    self.writesFlushed.emit()
+
+                nextTime += 1.0 / self.targetRate
+                delay = nextTime - perf_counter()
+                if delay < 0:
+                    # late: count it and start over rather than bursting to catch up
+                    self.overruns += 1
+                    nextTime = perf_counter()
+                elif self.wake.wait(delay):
+                    self.wake.clear()
+                    nextTime = perf_counter()
+            except Exception as e: # e.g. the device was unplugged
+                self.fail(e)
+                nextTime = perf_counter()
+
+        self.stopRecording()
+        self.stopCapture()
+        self.stopPublishing()
+        if self.streamReader is not None:
+            self.streamReader.stopStream()
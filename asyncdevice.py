@@ -0,0 +1,305 @@
+'''
+asyncio interface to a MyU3, for scripted test rigs, e.g.
+
+    device = AsyncU3(MyU3(serial=320012345))
+    inputs = await device.readInputs()
+    await device.writeOutputs({8: True, 9: False})
+    async with contextlib.aclosing(device.stream(1000)) as blocks:
+        async for volts in blocks:
+            ...
+    await device.close()
+'''
+# standard imports
+import queue
+import asyncio
+import threading
+
+from stream import StreamReader
+
+# request kinds
+READ, WRITE, CONFIGURE, CALL, STREAM, STOP_STREAM, CLOSE = range(7)
+
+class Request(object):
+    def __init__(self, kind, args, loop, future):
+        self.kind = kind
+        self.args = args
+        self.loop = loop
+        self.future = future
+
+    def resolve(self, result=None, error=None):
+        # from the device thread; the awaiting coroutine resumes on its own loop
+        self.loop.call_soon_threadsafe(self._resolve, result, error)
+
+    def _resolve(self, result, error):
+        if self.future.cancelled():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+class AsyncU3(object):
+    '''
+    awaitable facade over one MyU3, shared by any number of coroutines
+    every device transaction is made by a single thread owned by the facade,
+    so the (blocking, not thread-safe) MyU3 is never used concurrently
+    requests submitted while the thread is busy are served together:
+    consecutive writeOutputs and readInputs go out in one getFeedback packet
+    (writes first, then a single scan answering every read, as
+    MyU3.compileScan), so throughput grows with the number of waiting coroutines
+    while streaming, readInputs is answered from the newest streamed scan
+    (the U3 takes no analog feedback commands while it streams)
+    '''
+    streamQueueBlocks = 1000 # blocks buffered for a slow consumer before they are dropped
+
+    def __init__(self, device):
+        self.device = device
+        self.requests = queue.Queue()
+        self.reader = None # StreamReader while streaming
+        self.lastScan = None # newest streamed scan (raw codes)
+        self.waitingReads = [] # reads waiting for the first streamed scan
+
+        # counters
+        self.transactions = 0 # runs of requests sent to the device
+        self.dropped = 0 # stream blocks discarded because the consumer was behind
+
+        self.thread = threading.Thread(target=self.serve, name='AsyncU3', daemon=True)
+        self.thread.start()
+
+    # -------------------- COROUTINES --------------------
+
+    async def submit(self, kind, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.requests.put(Request(kind, args, loop, future))
+        return await future
+
+    async def readInputs(self, channels=None):
+        '''
+        {channelNum: value} of channels (default: every input), as MyU3.scanInputs
+        raises ValueError if one of channels is not an input
+        '''
+        return await self.submit(READ, None if channels is None else list(channels))
+
+    async def writeOutputs(self, states):
+        '''
+        drive digital channels high (True) or low (False), making them outputs
+        states maps channelNum to the level, as MyU3.setOutputStates
+        '''
+        return await self.submit(WRITE, dict(states))
+
+    async def configure(self, types=None, directions=None):
+        '''
+        set channel types ({channelNum: isAnalog}) and directions ({channelNum: isOutput})
+        '''
+        return await self.submit(CONFIGURE, dict(types or {}), dict(directions or {}))
+
+    async def run(self, method, *args, **kwargs):
+        # any other blocking MyU3 call, e.g. run(MyU3.toggleLED), made on the device thread
+        return await self.submit(CALL, method, args, kwargs)
+
+    async def stream(self, scanFrequency, raw=False):
+        '''
+        async iterator of blocks of scans in volts (digital port columns as raw port
+        words), or of raw codes with raw, one column per stream channel
+        streamChannels and streamMetadata (as StreamReader.metadata) are set once started
+        the stream stops when the iterator is closed: break out of it inside
+        contextlib.aclosing to stop at once
+        '''
+        blocks = asyncio.Queue(self.streamQueueBlocks)
+        self.streamMetadata = await self.submit(STREAM, scanFrequency, raw, blocks)
+        self.streamChannels = self.streamMetadata['streamChannels']
+        try:
+            while True:
+                block = await blocks.get()
+                if isinstance(block, Exception):
+                    raise block
+                yield block
+        finally:
+            await self.submit(STOP_STREAM)
+
+    async def close(self, closeDevice=True):
+        # stop the device thread (and streaming); further requests are never answered
+        await self.submit(CLOSE, closeDevice)
+        self.thread.join()
+
+    # -------------------- DEVICE THREAD --------------------
+
+    def serve(self):
+        while True:
+            if self.reader is None:
+                batch = [self.requests.get()]
+            else:
+                batch = []
+                self.readStream()
+            while True:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            for run in self.runs(batch):
+                if run[0].kind == CLOSE:
+                    self.finish(run[0])
+                    return
+                self.process(run)
+
+    @staticmethod
+    def runs(batch):
+        '''
+        split a batch into runs served by one transaction each: writes followed by
+        reads (a write after a read starts a new run, so every read sees exactly
+        the writes submitted before it), or any other request on its own
+        '''
+        runs = []
+        for request in batch:
+            run = runs[-1] if runs else None
+            if run is not None and request.kind == READ and run[-1].kind in (READ, WRITE):
+                run.append(request)
+            elif run is not None and request.kind == WRITE and run[-1].kind == WRITE:
+                run.append(request)
+            else:
+                runs.append([request])
+        return runs
+
+    def process(self, run):
+        kind = run[0].kind
+        try:
+            if kind in (READ, WRITE):
+                self.readWrite(run)
+                return
+            elif kind == CONFIGURE:
+                result = self.configureChannels(*run[0].args)
+            elif kind == CALL:
+                method, args, kwargs = run[0].args
+                result = method(self.device, *args, **kwargs)
+            elif kind == STREAM:
+                result = self.startStream(run[0].loop, *run[0].args)
+            else:
+                result = self.stopStream()
+        except Exception as e:
+            run[0].resolve(error=e)
+        else:
+            run[0].resolve(result)
+
+    def readWrite(self, run):
+        device = self.device
+        writes = [request for request in run if request.kind == WRITE]
+        reads = [request for request in run if request.kind == READ]
+
+        for request in list(writes):
+            states = request.args[0]
+            try:
+                device._check_digital(states)
+            except ValueError as e:
+                request.resolve(error=e)
+                writes.remove(request)
+                continue
+            for channelNum, isHigh in states.items():
+                device.queueChannelOutputState(channelNum, isHigh)
+
+        try:
+            commands, _ = device.commitWrites()
+            if reads and self.reader is None:
+                inputs = device.scanInputs(device.compileScan(writes=commands))
+                self.transactions += 1
+            elif commands:
+                device.getFeedback(*commands)
+                self.transactions += 1
+        except Exception as e:
+            for request in writes + reads:
+                request.resolve(error=e)
+            return
+
+        for request in writes:
+            request.resolve()
+        if self.reader is not None:
+            if self.lastScan is None:
+                self.waitingReads.extend(reads)
+                return
+            inputs = self.streamedInputs()
+        for request in reads:
+            self.answerRead(request, inputs)
+
+    def answerRead(self, request, inputs):
+        channels = request.args[0]
+        if channels is None:
+            request.resolve(dict(inputs))
+            return
+        missing = [channelNum for channelNum in channels if channelNum not in inputs]
+        if missing:
+            request.resolve(error=ValueError('Channels {} are not inputs.'.format(missing)))
+        else:
+            request.resolve({channelNum: inputs[channelNum] for channelNum in channels})
+
+    def configureChannels(self, types, directions):
+        # as one commitWrites: at most one configIO and one feedback packet
+        for channelNum, isAnalog in types.items():
+            self.device.queueChannelType(channelNum, isAnalog)
+        for channelNum, isOutput in directions.items():
+            self.device.queueChannelDir(channelNum, isOutput)
+        commands, _ = self.device.commitWrites()
+        if commands:
+            self.device.getFeedback(*commands)
+            self.transactions += 1
+
+    # -------------------- STREAMING (DEVICE THREAD) --------------------
+
+    def startStream(self, loop, scanFrequency, raw, blocks):
+        if self.reader is not None:
+            raise RuntimeError('The device is already streaming.')
+        reader = StreamReader(self.device, scanFrequency)
+        reader.start()
+        self.reader, self.lastScan = reader, None
+        self.streamLoop, self.blocks, self.raw = loop, blocks, raw
+        return reader.metadata()
+
+    def readStream(self):
+        reader = self.reader
+        try:
+            scans = reader.readBlock()
+        except Exception as e:
+            self.deliver(e)
+            self.stopStream()
+            return
+        if not len(scans):
+            return
+
+        self.lastScan = scans[-1].copy()
+        self.deliver(scans if self.raw else reader.calibration.toVolts(scans))
+        if self.waitingReads:
+            inputs = self.streamedInputs()
+            for request in self.waitingReads:
+                self.answerRead(request, inputs)
+            self.waitingReads = []
+
+    def deliver(self, block):
+        self.streamLoop.call_soon_threadsafe(self._put, self.blocks, block)
+
+    def _put(self, blocks, block):
+        try:
+            blocks.put_nowait(block)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def streamedInputs(self):
+        return self.device.decodeScan(self.reader.channels, self.lastScan, self.reader.states)
+
+    def stopStream(self):
+        if self.reader is not None:
+            self.reader.stopStream()
+            self.reader = None
+        error = RuntimeError('The stream stopped before the first scan.')
+        for request in self.waitingReads:
+            request.resolve(error=error)
+        self.waitingReads = []
+
+    def finish(self, request):
+        try:
+            self.stopStream()
+            if request.args[0]:
+                self.device.close()
+        except Exception as e:
+            request.resolve(error=e)
+            return
+        request.resolve()
@@ -0,0 +1,58 @@
+'''
+samples/second converting raw AIN codes to volts: scalar u3 path vs. Calibration
+run from the repository root (no device needed):
+    python -m benchmarks.conversion
+'''
+# standard imports
+import time
+
+# third party imports
+import numpy as np
+import u3
+
+from calibration import Calibration
+from simulator import CALDATA
+
+def makeDevice():
+    device = u3.U3(False, False)
+    device.calData = dict(CALDATA)
+    device.isHV = True
+    return device
+
+def scalar(device, channels, codes):
+    # what a per-sample Python loop over binaryToCalibratedAnalogVoltage costs
+    volts = np.empty(codes.shape)
+    for k, ch in enumerate(channels):
+        lv = not (device.isHV and ch < 4)
+        for n in range(len(codes)):
+            volts[n, k] = device.binaryToCalibratedAnalogVoltage(int(codes[n, k]), isLowVoltage=lv, channelNumber=ch)
+    return volts
+
+def vectorized(calibration, codes):
+    return calibration.toVolts(codes)
+
+def rate(fcn, samples, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fcn()
+        best = min(best, time.perf_counter() - t0)
+    return samples / best
+
+def main(scans=20000, channels=(0, 1, 2, 3, 4, 5, 6, 7)):
+    device = makeDevice()
+    calibration = Calibration(device, channels)
+    codes = np.random.default_rng(0).integers(0, 2**16, size=(scans, len(channels)), dtype=np.uint16)
+
+    assert np.allclose(scalar(device, channels, codes[:100]), vectorized(calibration, codes[:100]))
+
+    samples = codes.size
+    scalarRate = rate(lambda: scalar(device, channels, codes), samples)
+    vectorRate = rate(lambda: vectorized(calibration, codes), samples, repeat=20)
+
+    print('{0} channels x {1} scans'.format(len(channels), scans))
+    print('  scalar:     {0:14,.0f} samples/s'.format(scalarRate))
+    print('  vectorized: {0:14,.0f} samples/s ({1:.0f}x)'.format(vectorRate, vectorRate / scalarRate))
+
+if __name__ == '__main__':
+    main()
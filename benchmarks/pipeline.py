@@ -0,0 +1,238 @@
+'''
+end-to-end numbers for the poll, stream and display pipeline on a SimulatedU3
+runs headless (offscreen Qt platform, no device needed) from the repository root:
+    python -m benchmarks.pipeline [--seconds 2] [--output benchmarks/results.jsonl]
+each run is appended to the output file, tagged with the commit it ran on,
+and printed next to the previous run stored there
+'''
+# standard imports
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+import threading
+import datetime
+from time import perf_counter
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+# third party imports
+import numpy as np
+from PyQt5 import QtCore
+
+from simulator import SimulatedU3, LatencyModel
+from stream import StreamReader
+from acquisition import AcquisitionWorker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT = os.path.join(ROOT, 'benchmarks', 'results.jsonl')
+
+def percentiles(samples, prefix):
+    ms = 1000 * np.asarray(samples)
+    return {'{0} p{1} (ms)'.format(prefix, p): float(np.percentile(ms, p)) for p in (50, 90, 99)}
+
+def runFor(seconds, fcn):
+    # call fcn repeatedly for about seconds; returns the duration of each call
+    times = []
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        t0 = perf_counter()
+        fcn()
+        times.append(perf_counter() - t0)
+    return times
+
+def benchScan(seconds):
+    '''
+    one scanInputs of every input, with the default latency model and with
+    none at all (the host-side cost alone)
+    '''
+    results = {}
+    for name, latency in [('scan', None), ('scan overhead', LatencyModel(0, 0, 0))]:
+        device = SimulatedU3(latency=latency)
+        packets = device.compileScan()
+        numInputs = len(device.allInputs())
+
+        first = device.transactions
+        times = runFor(seconds, lambda: device.scanInputs(packets))
+        results.update(percentiles(times, name))
+        if latency is None:
+            results['transactions/scan'] = (device.transactions - first) / len(times)
+            results['poll samples/s'] = numInputs * len(times) / sum(times)
+        device.close()
+    return results
+
+def benchWorker(seconds, targetRate=1000.0):
+    '''
+    the acquisition loop polling as fast as targetRate allows, results
+    acknowledged immediately (as by an idle GUI)
+    '''
+    device = SimulatedU3()
+    worker = AcquisitionWorker(targetRate)
+    worker.inputsReady.connect(worker.acknowledge, QtCore.Qt.DirectConnection)
+    thread = threading.Thread(target=worker.work)
+    thread.start()
+
+    worker.configure(device)
+    first = device.transactions
+    t0 = perf_counter()
+    threading.Event().wait(seconds)
+    cycles, elapsed = worker.cycles, perf_counter() - t0
+    transactions = device.transactions - first
+    overruns = worker.overruns
+
+    worker.stop()
+    thread.join()
+    device.close()
+    return {
+        'worker cycles/s': cycles / elapsed,
+        'worker transactions/cycle': transactions / max(cycles, 1),
+        'worker overruns': overruns,
+    }
+
+def benchStream(seconds, scanFrequency=8000):
+    # every input streamed (4 AIN + the two digital ports): decode, buffer and convert each block
+    device = SimulatedU3()
+    reader = StreamReader(device, scanFrequency)
+    reader.start()
+    reader.readBlock() # first block includes the start-up wait
+    first = reader.buffer.written
+
+    blockTimes = []
+    t0 = perf_counter()
+    while perf_counter() - t0 < seconds:
+        scans = reader.readBlock()
+        t1 = perf_counter()
+        reader.calibration.toVolts(scans)
+        blockTimes.append(perf_counter() - t1)
+    elapsed = perf_counter() - t0
+    reader.stopStream()
+    device.close()
+
+    samples = (reader.buffer.written - first) * len(reader.channels)
+    return {
+        'stream samples/s': samples / elapsed,
+        'stream missed': reader.missed,
+        'stream convert ms/block': 1000 * float(np.mean(blockTimes)),
+    }
+
+def benchGui(frames=300):
+    '''
+    DevicePage.inputHandler updating every channel widget, alone and with the
+    repaint it causes
+    '''
+    import main
+
+    app, window = main.app, main.lj
+    device = SimulatedU3(latency=LatencyModel(0, 0, 0))
+    window.openFunction(device)
+    window.stopAcquisition()
+    page = window.currentPage()
+    app.processEvents()
+
+    # alternate between two full sets of inputs so every widget changes each frame
+    inputs = [device.scanInputs(), {}]
+    for channelNum, val in inputs[0].items():
+        inputs[1][channelNum] = (not val) if isinstance(val, bool) else val + 1.0
+
+    handler, frame = [], []
+    for k in range(frames):
+        t0 = perf_counter()
+        page.inputHandler(inputs[k % 2])
+        t1 = perf_counter()
+        app.processEvents()
+        t2 = perf_counter()
+        handler.append(t1 - t0)
+        frame.append(t2 - t0)
+
+    window.disconnectFunction()
+
+    results = percentiles(handler, 'inputHandler')
+    results.update(percentiles(frame, 'frame'))
+    return results
+
+STARTUP = '''
+from time import perf_counter
+t0 = perf_counter()
+import main
+t1 = perf_counter()
+window = main.lj.windowHandle()
+while not window.isExposed() and perf_counter() - t0 < 10:
+    main.app.processEvents()
+main.app.processEvents() # first paint
+print(t1 - t0, perf_counter() - t0)
+main.lj.stopThreading()
+'''
+
+def benchStartup(repeat=3):
+    '''
+    fresh interpreters: time to import main (modules, forms and window construction)
+    and to the first paint of the window, best of repeat
+    '''
+    built = shown = wall = float('inf')
+    for _ in range(repeat):
+        t0 = perf_counter()
+        out = subprocess.run([sys.executable, '-c', STARTUP], cwd=ROOT, capture_output=True, text=True)
+        wall = min(wall, perf_counter() - t0)
+        times = [float(t) for t in out.stdout.strip().splitlines()[-1].split()]
+        built, shown = min(built, times[0]), min(shown, times[1])
+    return {'startup import (s)': built, 'startup (s)': shown, 'startup incl. interpreter (s)': wall}
+
+def commit():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+            capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+    return rev + ('-dirty' if dirty else '') if rev else None
+
+def previousRun(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+def report(results, previous):
+    width = max([len(name) for name in results])
+    if previous is not None:
+        print('compared with {0} ({1})'.format(previous['commit'], previous['date']))
+    for name, value in results.items():
+        line = '  {0:<{1}} {2:14,.3f}'.format(name, width, value)
+        old = previous['results'].get(name) if previous is not None else None
+        if old:
+            line += '  ({0:+.1f}%)'.format(100 * (value - old) / old)
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the acquisition and display pipeline.')
+    parser.add_argument('--seconds', type=float, default=2.0, help='duration of each timed section')
+    parser.add_argument('--output', default=OUTPUT, help='results file (JSON lines)')
+    parser.add_argument('--no-save', action='store_true', help="don't append this run to the results file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    results.update(benchScan(args.seconds))
+    results.update(benchWorker(args.seconds))
+    results.update(benchStream(args.seconds))
+    results.update(benchGui())
+    results.update(benchStartup())
+
+    report(results, previousRun(args.output))
+
+    if not args.no_save:
+        record = {
+            'commit': commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+if __name__ == '__main__':
+    main()
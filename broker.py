@@ -0,0 +1,453 @@
+'''
+one process owning a U3, shared by any number of local programs, e.g.
+    python -m labjack broker --serial 320012345 --listen 5556
+then, in the GUI ('Connect to broker...'), a logger and a test script alike:
+    device = RemoteU3(('localhost', 5556)) # in place of MyU3(serial=320012345)
+
+requests and replies are JSON messages, each preceded by its uint32 length
+(little-endian): {'id', 'op', args...} answered by {'id', 'result'} or
+{'id', 'error', 'type'}; the broker serves them through an AsyncU3, so reads
+waiting at the same time are answered by one shared scan and writes go out
+one transaction at a time, in order
+streaming is shared too: the first client to stream starts it, every client
+streaming at the same rate receives the scans from the broker's SamplePublisher
+'''
+# standard imports
+import os
+import json
+import signal
+import struct
+import socket
+import asyncio
+import weakref
+import threading
+import contextlib
+
+from labjack import MyU3, DeviceAccessError
+from asyncdevice import AsyncU3
+from publisher import SamplePublisher, SampleClient, formatAddress, channelMask
+from channels import NUM_CHANNELS
+
+LENGTH_FORMAT = '<I'
+LENGTH_SIZE = struct.calcsize(LENGTH_FORMAT)
+
+def encodeMessage(message):
+    data = json.dumps(message).encode('utf-8')
+    return struct.pack(LENGTH_FORMAT, len(data)) + data
+
+def channelKeys(values):
+    # JSON object keys are strings; channel numbers are ints
+    return {int(channelNum): value for channelNum, value in values.items()}
+
+def deviceState(device):
+    return {'properties': device.properties, 'io': device.ioProperties(), 'calData': device.calData}
+
+class DeviceBroker(object):
+    '''
+    serves requests for device (an open MyU3) from clients connecting to address:
+    a (host, port) tuple for TCP or a path for a Unix-domain socket
+    the operations are those of RemoteU3:
+        - state: properties, shadowed io configuration and calibration
+        - read: every input, as MyU3.scanInputs
+        - configure: types, directions and output states, as queued MyU3 writes
+        - led: toggle the LED
+        - stream, stopStream: join or leave the shared stream
+    '''
+    def __init__(self, device, address):
+        self.device = device
+        self.address = address
+
+        self.streamTask = None
+        self.streamRate = None
+        self.streamStarted = None # asyncio.Future of the stream metadata
+        self.streamClients = set()
+        self.streamLock = asyncio.Lock() # one client starts or restarts the stream at a time
+
+        # counters
+        self.clients = 0
+        self.requests = 0
+
+        self.handlers = {
+            'state': self.state,
+            'read': self.read,
+            'configure': self.configure,
+            'led': self.led,
+            'stream': self.stream,
+            'stopStream': self.stopStream,
+        }
+
+    def run(self):
+        # serve until SIGINT/SIGTERM
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.asyncDevice = AsyncU3(self.device)
+        if isinstance(self.address, tuple):
+            server = await asyncio.start_server(self.handleClient, *self.address)
+            self.address = server.sockets[0].getsockname()[:2]
+            publishAddress = (self.address[0], 0)
+        else:
+            if os.path.exists(self.address):
+                os.unlink(self.address) # left behind by a broker that died
+            server = await asyncio.start_unix_server(self.handleClient, self.address)
+            publishAddress = self.address + '.stream'
+        self.publisher = SamplePublisher(publishAddress)
+        self.publisher.start()
+
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stopped.set)
+            except NotImplementedError: # Windows: Ctrl-C raises KeyboardInterrupt instead
+                pass
+
+        print('{0} {1} brokered on {2}'.format(self.device.properties.get('DeviceName', 'U3'),
+            self.device.properties.get('SerialNumber', ''), formatAddress(self.address)), flush=True)
+        try:
+            async with server:
+                await stopped.wait()
+        finally:
+            await self.endStream()
+            await self.asyncDevice.close(closeDevice=False)
+            self.publisher.close()
+            if not isinstance(self.address, tuple):
+                with contextlib.suppress(OSError):
+                    os.unlink(self.address)
+        print('{0} requests from {1} clients'.format(self.requests, self.clients), flush=True)
+
+    async def handleClient(self, reader, writer):
+        self.clients += 1
+        tasks = set() # requests being answered; concurrent ones share scans
+        try:
+            while True:
+                size, = struct.unpack(LENGTH_FORMAT, await reader.readexactly(LENGTH_SIZE))
+                request = json.loads((await reader.readexactly(size)).decode('utf-8'))
+                task = asyncio.ensure_future(self.answer(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass # disconnected
+        finally:
+            if tasks:
+                await asyncio.wait(tasks)
+            await self.leaveStream(writer)
+            writer.close()
+
+    async def answer(self, request, writer):
+        self.requests += 1
+        args = dict(request)
+        requestId, op = args.pop('id', None), args.pop('op', None)
+        try:
+            handler = self.handlers.get(op)
+            if handler is None:
+                raise ValueError('Unknown operation {}.'.format(op))
+            reply = {'id': requestId, 'result': await handler(writer, **args)}
+        except Exception as e:
+            reply = {'id': requestId, 'error': str(e), 'type': type(e).__name__}
+        if not writer.is_closing():
+            writer.write(encodeMessage(reply))
+
+    # -------------------- OPERATIONS --------------------
+
+    async def state(self, client):
+        return await self.asyncDevice.run(deviceState)
+
+    async def read(self, client, channels=None):
+        inputs = await self.asyncDevice.readInputs(channels)
+        return {str(channelNum): value for channelNum, value in inputs.items()}
+
+    async def configure(self, client, types=None, directions=None, states=None):
+        '''
+        types and directions first (one configIO at most), then output levels
+        type and direction changes rebuild the stream's channel table: a running
+        stream restarts at its rate for the same clients, and subscribers get its
+        new METADATA (output levels are written mid-stream)
+        '''
+        if types or directions:
+            async with self.streamLock:
+                restart = self.streamTask is not None
+                if restart:
+                    scanFrequency, clients = self.streamRate, set(self.streamClients)
+                    await self.endStream()
+                try:
+                    await self.asyncDevice.configure(channelKeys(types or {}), channelKeys(directions or {}))
+                finally:
+                    if restart:
+                        self.startStream(scanFrequency)
+                if restart:
+                    await asyncio.shield(self.streamStarted)
+                    self.streamClients |= clients
+        if states:
+            await self.asyncDevice.writeOutputs(channelKeys(states))
+        return await self.asyncDevice.run(lambda device: device.ioProperties())
+
+    async def led(self, client):
+        await self.asyncDevice.run(lambda device: device.toggleLED())
+
+    async def stream(self, client, scanFrequency):
+        '''
+        join the stream at scanFrequency (starting it if nobody streams yet) and
+        return where to subscribe to it, with its stream channels
+        '''
+        async with self.streamLock:
+            if self.streamTask is None:
+                self.startStream(scanFrequency)
+            elif scanFrequency != self.streamRate:
+                raise ValueError('The device is already streaming at {} Hz.'.format(self.streamRate))
+            metadata = await asyncio.shield(self.streamStarted)
+            self.streamClients.add(client)
+        return {'address': self.publisher.address, 'streamChannels': metadata['streamChannels'],
+            'io': await self.asyncDevice.run(lambda device: device.ioProperties())}
+
+    def startStream(self, scanFrequency):
+        self.streamRate = scanFrequency
+        self.streamStarted = asyncio.get_running_loop().create_future()
+        self.streamTask = asyncio.ensure_future(self.publishStream(scanFrequency))
+
+    async def stopStream(self, client):
+        await self.leaveStream(client)
+
+    async def leaveStream(self, client):
+        if client in self.streamClients:
+            self.streamClients.discard(client)
+            if not self.streamClients:
+                await self.endStream()
+
+    async def endStream(self):
+        task, self.streamTask = self.streamTask, None
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    async def publishStream(self, scanFrequency):
+        # raw codes, as a recording stores them (calibration in the METADATA frame)
+        blocks = self.asyncDevice.stream(scanFrequency, raw=True)
+        try:
+            async with contextlib.aclosing(blocks):
+                block = await blocks.__anext__()
+                metadata = dict(self.asyncDevice.streamMetadata)
+                metadata.update(deviceState(self.device))
+                self.publisher.announce(metadata, len(metadata['streamChannels']), 'uint16')
+                mask = channelMask(i for i, state in enumerate(metadata['states']) if not state[1])
+                self.streamStarted.set_result(metadata)
+
+                while True:
+                    self.publisher.publish(block, mask)
+                    block = await blocks.__anext__()
+        except Exception as e: # e.g. a rate the device can't stream at
+            if not self.streamStarted.done():
+                self.streamStarted.set_exception(e)
+            else:
+                print('Stream stopped: {}'.format(e), flush=True)
+            self.streamTask = None
+            self.streamClients.clear()
+
+def serveDevice(device, address):
+    DeviceBroker(device, address).run()
+
+class RemoteU3(MyU3):
+    '''
+    a device owned by a DeviceBroker, with the same surface as an open MyU3, so it
+    can be handed to LabjackApp, AcquisitionWorker and StreamReader in place of one
+        - queued writes (queueChannel*) are committed with one configure request
+        - scanInputs reads every input with one read request (shared with the
+          other clients' reads)
+        - streaming joins the broker's stream (see DeviceBroker.stream)
+    the shadow registers follow the broker's on every configure and resync
+    '''
+    def __init__(self, address):
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.address = address
+        self.requestLock = threading.Lock()
+        self.nextId = 0
+
+        self.pendingWrites = {}
+        self.writeLock = threading.Lock()
+        self.handle = None
+        self.streamClient = None
+        self.streamStarted = False
+        self.streamChannels = None # as joined; the broker restarts the stream when they change
+        self.streamChanged = False
+
+        state = self.request('state')
+        self.properties = dict(state['properties'])
+        self.properties['Broker'] = formatAddress(address)
+        self.serial = self.properties.get('SerialNumber')
+        self.isHV = self.properties.get('DeviceName', 'U3-HV').endswith('HV')
+        self.calData = state['calData']
+        self.analogBits = self.dirBits = self.stateBits = 0
+        self.setShadow(state['io'])
+
+        self.instances.append(weakref.ref(self))
+
+    def request(self, op, **args):
+        with self.requestLock:
+            if self.sock is None:
+                raise DeviceAccessError('The broker connection is closed.')
+            self.nextId += 1
+            self.sock.sendall(encodeMessage(dict(args, id=self.nextId, op=op)))
+            size, = struct.unpack(LENGTH_FORMAT, self.recvExactly(LENGTH_SIZE))
+            reply = json.loads(self.recvExactly(size).decode('utf-8'))
+        if 'error' in reply:
+            raise (ValueError if reply['type'] == 'ValueError' else DeviceAccessError)(reply['error'])
+        return reply['result']
+
+    def recvExactly(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise DeviceAccessError('The broker closed the connection.')
+            data += chunk
+        return data
+
+    def setShadow(self, io):
+        # shadow registers from ioProperties; returns the channels that changed
+        analogBits = io['FIOAnalog'] | io['EIOAnalog'] << 8
+        dirBits = io['FIODirection'] | io['EIODirection'] << 8 | io['CIODirection'] << 16
+        stateBits = io['FIOState'] | io['EIOState'] << 8 | io['CIOState'] << 16
+
+        wrongBits = (analogBits ^ self.analogBits) | (dirBits ^ self.dirBits)
+        wrongBits |= (stateBits ^ self.stateBits) & dirBits
+        self.analogBits, self.dirBits, self.stateBits = analogBits, dirBits, stateBits
+        return [i for i in range(NUM_CHANNELS) if (wrongBits >> i) & 1]
+
+    # -------------------- DEVICE OPEN/CLOSE METHODS --------------------
+
+    def open(self):
+        pass
+
+    def close(self):
+        if self.is_open():
+            self.streamStop()
+            self.sock.close()
+            self.sock = None
+
+    def is_open(self):
+        return self.sock is not None
+
+    # -------------------- DEVICE COMMUNICATION --------------------
+
+    def getFeedback(self, *commandlist):
+        raise DeviceAccessError('Feedback commands cannot be sent through the broker.')
+
+    def configIO(self, **kwargs):
+        raise DeviceAccessError('configIO cannot be sent through the broker.')
+
+    def resync(self):
+        return self.setShadow(self.request('state')['io'])
+
+    def toggleLED(self):
+        self.request('led')
+
+    def setChannelType(self, channelNum, isAnalog):
+        self.queueChannelType(channelNum, isAnalog)
+        self.commitWrites()
+
+    def setChannelDir(self, channelNum, isOutput):
+        self.queueChannelDir(channelNum, isOutput)
+        self.commitWrites()
+
+    def setChannelOutputState(self, channelNum, isHigh):
+        self.queueChannelOutputState(channelNum, isHigh)
+        self.commitWrites()
+
+    def setOutputStates(self, states):
+        self._check_digital(states)
+        for channelNum, isHigh in states.items():
+            self.queueChannelOutputState(channelNum, isHigh)
+        self.commitWrites()
+
+    def compileScan(self, states=None, writes=()):
+        # the channels to read (None: every input); writes were sent by commitWrites
+        if states is None:
+            return None
+        return [i for i, (isAnalog, isOutput, _) in enumerate(states) if isAnalog or not isOutput]
+
+    def scanInputs(self, packets=None):
+        '''
+        inputs dict (as MyU3.scanInputs) of the channels compiled by compileScan
+        '''
+        inputs = channelKeys(self.request('read', channels=packets))
+        for channelNum, val in inputs.items():
+            if isinstance(val, bool):
+                self.stateBits = self.set_bit(self.stateBits, channelNum, val)
+        return inputs
+
+    def commitWrites(self):
+        '''
+        send all queued writes in one configure request; returns ([], configChanged)
+        as MyU3.commitWrites (the broker has already sent the commands)
+        '''
+        with self.writeLock:
+            writes, self.pendingWrites = self.pendingWrites, {}
+        streamChanged, self.streamChanged = self.streamChanged, False
+        if not writes:
+            return [], streamChanged
+
+        types, directions, states = {}, {}, {}
+        for channelNum, (isAnalog, isOutput, isHigh) in writes.items():
+            if isAnalog is not None and channelNum < 16:
+                types[channelNum] = isAnalog
+            if isOutput is not None:
+                directions[channelNum] = isOutput
+            if isHigh is not None and isOutput is not False: # the broker makes written channels outputs
+                states[channelNum] = isHigh
+
+        analogBits, dirBits = self.analogBits, self.dirBits
+        self.setShadow(self.request('configure', types=types, directions=directions, states=states))
+        return [], streamChanged or analogBits != self.analogBits or dirBits != self.dirBits
+
+    def hasPendingWrites(self):
+        # a stream changed by another client is flushed like a type change, rejoining it
+        return bool(self.pendingWrites) or self.streamChanged
+
+    # -------------------- STREAM COMMANDS --------------------
+
+    def configStream(self, scanFrequency, states=None):
+        '''
+        join the broker's stream (of every input: states is ignored) at scanFrequency
+        '''
+        reply = self.request('stream', scanFrequency=scanFrequency)
+        self.setShadow(reply['io'])
+        address = reply['address']
+        self.streamClient = SampleClient(tuple(address) if isinstance(address, list) else address)
+        self.streamChannels = reply['streamChannels']
+        self.streamChanged = False
+        return self.streamChannels
+
+    def streamStart(self):
+        self.streamStarted = True
+
+    def streamStop(self):
+        if self.streamClient is not None:
+            self.streamStarted = False
+            self.streamClient.close()
+            self.streamClient = None
+            self.request('stopStream')
+
+    def streamData(self, convert=False):
+        '''
+        blocks of the shared stream as they are published, like the device's
+        streamData(convert=False) but with result holding the scans themselves
+        once another client has changed the stream's channels, yields None until
+        the stream is rejoined (hasPendingWrites, then commitWrites reports a config change)
+        '''
+        client = self.streamClient
+        while self.streamStarted:
+            lost = client.lost
+            firstScan, timestamp, mask, scans = client.read()
+            if client.metadata['streamChannels'] != self.streamChannels:
+                self.setShadow(client.metadata['io'])
+                self.streamChanged = True
+                yield None
+                continue
+            yield dict(numPackets=1, result=scans, errors=0, firstPacket=0,
+                missed=(client.lost - lost) * scans.shape[1])
+
+    def streamSamples(self, result):
+        return result.ravel()
@@ -0,0 +1,48 @@
+# third party imports
+import numpy as np
+
+from channels import STREAM_FIO_EIO, STREAM_CIO
+
+class Calibration(object):
+    '''
+    per-channel slope/offset vectors for converting blocks of raw 16-bit codes
+    (one row per scan, one column per channel) to calibrated volts in one operation
+
+    constants come from the device's calData (see getCalibrationData), with the
+    same low/high-voltage selection as getAIN: on a U3-HV, AIN0-3 use their own
+    hvAIN slopes/offsets. digital port channels pass through unchanged (slope 1,
+    offset 0) so mixed blocks can be converted as a whole.
+    '''
+    def __init__(self, device, channels, negChannels=None):
+        if negChannels is None:
+            negChannels = [31] * len(channels)
+
+        self.channels = list(channels)
+        self.slopes = np.ones(len(channels))
+        self.offsets = np.zeros(len(channels))
+        self.isAnalog = np.zeros(len(channels), dtype=bool)
+
+        isHV = getattr(device, 'isHV', False)
+        for k, (pos, neg) in enumerate(zip(channels, negChannels)):
+            if pos in (STREAM_FIO_EIO, STREAM_CIO):
+                continue
+            slope, offset = device.getCalibratedSlopeOffset(
+                isLowVoltage=not (isHV and pos < 4),
+                isSingleEnded=neg == 31,
+                isSpecialSetting=neg == 32,
+                channelNumber=pos)
+            self.slopes[k] = slope
+            self.offsets[k] = offset
+            self.isAnalog[k] = True
+
+    def toVolts(self, codes, out=None):
+        '''
+        codes: array of shape (scans, channels), or (channels,) for a single scan
+        returns a float64 array of the same shape
+        '''
+        codes = np.asarray(codes)
+        if out is None:
+            out = np.empty(codes.shape)
+        np.multiply(codes, self.slopes, out=out)
+        out += self.offsets
+        return out
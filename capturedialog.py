@@ -0,0 +1,89 @@
+'''
+settings of a triggered capture (see trigger.py)
+'''
+# standard imports
+import os
+
+# third party imports
+from PyQt5 import QtWidgets
+
+from trigger import parseTrigger
+
+class CaptureDialog(QtWidgets.QDialog):
+    '''
+    trigger, pre/post-trigger scans and the directory captures are saved to;
+    keeps its values between captures
+    '''
+    maxScans = 10000000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Triggered capture')
+        self.trigger = None
+
+        self.triggerEdit = QtWidgets.QLineEdit()
+        self.triggerEdit.setPlaceholderText('e.g. FIO4 rising, AIN0 falling 1.5 & EIO1 high')
+        self.triggerEdit.setToolTip('FIO/EIO/CIOn rising|falling|either|high|low, '
+            'AINn rising|falling|either LEVEL or AINn >|< LEVEL, combined with & and |')
+        self.preBox = self.scanBox(1000)
+        self.postBox = self.scanBox(1000, minimum=1) # the firing scan is always saved
+        self.continuousBox = QtWidgets.QCheckBox('Re-arm after each capture')
+        self.continuousBox.setChecked(True)
+
+        self.directoryEdit = QtWidgets.QLineEdit()
+        browseButton = QtWidgets.QPushButton('Browse...')
+        browseButton.clicked.connect(self.browse)
+        directoryLayout = QtWidgets.QHBoxLayout()
+        directoryLayout.addWidget(self.directoryEdit)
+        directoryLayout.addWidget(browseButton)
+
+        self.errorLabel = QtWidgets.QLabel()
+        self.errorLabel.setStyleSheet('color: red')
+        self.errorLabel.hide()
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        layout = QtWidgets.QFormLayout(self)
+        layout.addRow('Trigger', self.triggerEdit)
+        layout.addRow('Before trigger', self.preBox)
+        layout.addRow('After trigger', self.postBox)
+        layout.addRow('', self.continuousBox)
+        layout.addRow('Save to', directoryLayout)
+        layout.addRow(self.errorLabel)
+        layout.addRow(buttons)
+
+    def scanBox(self, value, minimum=0):
+        box = QtWidgets.QSpinBox()
+        box.setRange(minimum, self.maxScans)
+        box.setSuffix(' scans')
+        box.setValue(value)
+        return box
+
+    def browse(self):
+        directory = QtWidgets.QFileDialog.getExistingDirectory(self, 'Save captures to', self.directoryEdit.text())
+        if directory:
+            self.directoryEdit.setText(directory)
+
+    def showError(self, message):
+        self.errorLabel.setText(message)
+        self.errorLabel.show()
+
+    def accept(self):
+        # only close with a valid trigger and an existing directory
+        try:
+            self.trigger = parseTrigger(self.triggerEdit.text())
+        except ValueError as e:
+            self.showError(str(e))
+            return
+        if not os.path.isdir(self.directoryEdit.text()):
+            self.showError('Choose a directory to save the captures to.')
+            return
+        self.errorLabel.hide()
+        super().accept()
+
+    def settings(self):
+        # startCapture arguments after the dialog was accepted
+        return (self.trigger, self.directoryEdit.text(), self.preBox.value(), self.postBox.value(),
+            self.continuousBox.isChecked())
@@ -0,0 +1,61 @@
+'''
+U3 channel layout and constants, importable without the LabJack driver stack
+(labjack.py re-exports them), so the window can be built before it loads
+'''
+
+# The LabJack vendor ID is 0x0CD5. The product ID for the U3 is 0x0003.
+VENDOR_ID = 0x0CD5
+PRODUCT_ID = 0x0003
+DEVICE_TYPE = 3
+
+# FIO0-7, EIO0-7, CIO0-3 (bit i of a port bitfield is channel i)
+NUM_CHANNELS = 20
+
+# special stream channels returning digital port states
+STREAM_FIO_EIO = 193 # FIO in low byte, EIO in high byte
+STREAM_CIO = 194 # CIO in low byte
+
+def channelList(isHV=True):
+    '''
+    [name, exclusive type] of each channel; the first four are analog-only on a U3-HV
+    '''
+    channels = []
+    if isHV:
+        channels.extend([['AIN{}'.format(i), 'analog'] for i in range(4)])
+    else:
+        channels.extend([['FIO{}'.format(i), None] for i in range(4)])
+    channels.extend([['FIO{}'.format(i), None] for i in range(4,8)])
+    channels.extend([['EIO{}'.format(i), None] for i in range(8)])
+    channels.extend([['CIO{}'.format(i), 'digital'] for i in range(4)])
+
+    return channels
+
+def parseChannels(text):
+    '''
+    channel numbers of a list like 'AIN0-3,FIO4,EIO0-7,CIO1' as {channelNum: isAnalog}
+        - AINn: channel n as an analog input (n < 16: FIO0-7 are 0-7, EIO0-7 are 8-15)
+        - FIOn, EIOn, CIOn: that channel as a digital input
+    '''
+    offsets = {'AIN': 0, 'FIO': 0, 'EIO': 8, 'CIO': 16}
+    sizes = {'AIN': 16, 'FIO': 8, 'EIO': 8, 'CIO': 4}
+    selected = {}
+    for item in text.replace(' ', '').upper().split(','):
+        if not item:
+            continue
+        port, numbers = item[:3], item[3:]
+        if port not in offsets or not numbers:
+            raise ValueError('Unknown channel {}.'.format(item))
+        first, _, last = numbers.partition('-')
+        first, last = int(first), int(last or first)
+        if not 0 <= first <= last < sizes[port]:
+            raise ValueError('No channel {}.'.format(item))
+        for n in range(first, last + 1):
+            selected[offsets[port] + n] = port == 'AIN'
+    return selected
+
+def acquiredStates(states, inputs):
+    '''
+    states (as MyU3.getIOstates) with every channel not in inputs shown as an
+    output, so scans built from them (compileScan, streamChannelList) leave it out
+    '''
+    return [state if i in inputs else (False, True, state[2]) for i, state in enumerate(states)]
@@ -0,0 +1,122 @@
+'''
+background enumeration and opening of attached U3s, so the GUI never waits on the USB bus
+'''
+# standard imports
+import threading
+
+# third party imports
+from PyQt5 import QtCore
+
+from channels import DEVICE_TYPE
+
+class DeviceMonitor(QtCore.QObject):
+    '''
+    keeps a cached list of attached U3s up to date from its own QThread
+        - every interval, counts the attached devices (cheap: no device is opened)
+        - lists them (listAll, which opens each one briefly) only when the count
+          changes or refresh() is called, and emits the serials added or removed
+    devices open in this process can't be listed, so they stay in the cache while open
+    openDevice() opens a MyU3 on the same thread, so opening and listing never race
+    the driver stack is imported by the thread, not at import, so the GUI can start first
+    '''
+    deviceAdded = QtCore.pyqtSignal(dict) # {'serialNumber', 'deviceName', 'isHV'}
+    deviceRemoved = QtCore.pyqtSignal(int) # serial number
+    deviceReady = QtCore.pyqtSignal(object) # MyU3 opened by openDevice
+    openFailed = QtCore.pyqtSignal(int, str) # serial number, reason
+
+    interval = 1.0 # s between device counts
+
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        self.cache = {} # serial -> device info
+        self.lock = threading.Lock()
+        self.count = None
+        self.quitting = False
+        self.rescan = True
+        self.toOpen = [] # serials
+        self.wake = threading.Event()
+
+    # -------------------- CALLED FROM OTHER THREADS --------------------
+
+    def refresh(self):
+        # list the devices again now, even if their number hasn't changed
+        self.rescan = True
+        self.wake.set()
+
+    def openDevice(self, serial):
+        # answered by deviceReady or openFailed
+        with self.lock:
+            self.toOpen.append(serial)
+        self.wake.set()
+
+    def stop(self):
+        self.quitting = True
+        self.wake.set()
+
+    def devices(self):
+        with self.lock:
+            return sorted(self.cache.values(), key=lambda info: info['serialNumber'])
+
+    # -------------------- MONITOR THREAD --------------------
+
+    def work(self):
+        from LabJackPython import deviceCount
+
+        while not self.quitting:
+            with self.lock:
+                toOpen, self.toOpen = self.toOpen, []
+            for serial in toOpen:
+                self.open(serial)
+
+            try:
+                count = deviceCount(DEVICE_TYPE)
+            except Exception: # e.g. no USB driver installed
+                count = 0
+            if self.rescan or count != self.count:
+                self.rescan = False
+                self.count = count
+                self.scan()
+
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def open(self, serial):
+        from labjack import MyU3
+        try:
+            instance = MyU3(False, serial)
+        except Exception as e:
+            self.openFailed.emit(serial, str(e))
+            return
+        if instance.is_open():
+            self.deviceReady.emit(instance)
+        else:
+            self.openFailed.emit(serial, 'the device could not be opened')
+
+    def scan(self):
+        from LabJackPython import listAll
+        from labjack import MyU3
+        try:
+            listed = listAll(DEVICE_TYPE) if self.count else {}
+        except Exception as e:
+            print('Unable to list devices: {}'.format(e))
+            return
+
+        found = {}
+        for dev in listed.values():
+            serial = int(dev['serialNumber'])
+            name = dev.get('deviceName', 'U3')
+            found[serial] = {'serialNumber': serial, 'deviceName': name, 'isHV': name.endswith('HV')}
+
+        with self.lock:
+            for serial in MyU3.open_serials():
+                if serial in self.cache and serial not in found:
+                    found[serial] = self.cache[serial]
+            added = [found[serial] for serial in found if serial not in self.cache]
+            removed = [serial for serial in self.cache if serial not in found]
+            self.cache = found
+            MyU3.attached = set(found)
+
+        for serial in removed:
+            self.deviceRemoved.emit(serial)
+        for info in added:
+            self.deviceAdded.emit(info)
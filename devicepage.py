@@ -0,0 +1,210 @@
+from math import floor
+
+import numpy as np
+from PyQt5 import QtCore, QtWidgets
+
+from LabjackIO import LabjackIO
+from channels import NUM_CHANNELS, channelList
+from acquisition import AcquisitionWorker
+
+def channelGrid(Nrows=8):
+    '''
+    grid of LabjackIO widgets, one per channel: (layout, list of widgets by channel number)
+    '''
+    controlGrid = QtWidgets.QGridLayout()
+    channels = channelList()
+
+    IOs = []
+    for i, ch in enumerate(channels):
+        row = i % Nrows
+        col = floor(i / Nrows)
+
+        f = QtWidgets.QFrame()
+        f.setFrameShape(QtWidgets.QFrame.Panel)
+        f.setFrameShadow(QtWidgets.QFrame.Raised)
+        hl = QtWidgets.QHBoxLayout()
+        hl.setContentsMargins(5, 0, 0, 0)
+        hl.setSpacing(0)
+        l = QtWidgets.QLabel(ch[0])
+        l.setAlignment(QtCore.Qt.AlignCenter)
+        hl.addWidget(l)
+        io = LabjackIO(exclusiveType=ch[1], ioNumber=i)
+        IOs.append(io)
+        hl.addWidget(io)
+        f.setLayout(hl)
+        controlGrid.addWidget(f, row, col)
+
+    return controlGrid, IOs
+
+class DevicePage(QtWidgets.QWidget):
+    '''
+    channel page of one open device, acquired by its own AcquisitionWorker on its
+    own QThread, so a slow device never holds up the others
+    readouts are only touched when what they show changes (see inputHandler)
+    '''
+    analogDecimals = 3 # V, resolution of the analog readouts
+
+    def __init__(self, instance, pollRate, *args, **kwargs):
+        QtWidgets.QWidget.__init__(self, *args, **kwargs)
+        self.instance = instance
+        self.flushScheduled = False
+        self.rendered = {} # channelNum -> (type, value) last shown
+        self.failure = None # the error that stopped acquisition, until it is restarted
+
+        layout, self.IOs = channelGrid()
+        self.setLayout(layout)
+
+        self.setupThreading(pollRate)
+        self.updateChannels()
+        self.connectIOcallbacks()
+
+    def title(self):
+        properties = self.instance.properties
+        if self.instance.isReplay:
+            return 'Replay {}'.format(properties.get('SerialNumber', ''))
+        return '{0} {1}'.format(properties.get('DeviceName', 'U3'), properties.get('SerialNumber', ''))
+
+    def setupThreading(self, pollRate):
+        self.bkgThread = QtCore.QThread()
+        self.acqWorker = AcquisitionWorker(pollRate)
+        self.acqWorker.moveToThread(self.bkgThread)
+        self.acqWorker.inputsReady.connect(self.inputHandler)
+        self.acqWorker.edgesCounted.connect(self.edgeHandler)
+        self.acqWorker.acquisitionFailed.connect(self.failureHandler)
+        self.bkgThread.started.connect(self.acqWorker.work)
+        self.bkgThread.start()
+
+    def stopThreading(self):
+        self.acqWorker.stop()
+        self.bkgThread.quit()
+        self.bkgThread.wait()
+
+    def startAcquisition(self, streamRate=None, targetRate=2.0):
+        '''
+        poll at targetRate, or stream at streamRate and refresh the readouts at targetRate
+        replays always play in the mode and at the rate they were recorded
+        '''
+        if self.instance.isReplay:
+            streamRate = self.instance.scanFrequency
+        self.failure = None
+        self.acqWorker.setTargetRate(targetRate)
+        self.acqWorker.configure(self.instance, streamRate)
+
+    def stopAcquisition(self):
+        self.acqWorker.configure(None)
+
+    def failureHandler(self, message):
+        self.failure = message
+
+    def statsMessage(self):
+        if self.failure is not None:
+            return 'Acquisition stopped: {}'.format(self.failure)
+        worker = self.acqWorker
+        reader = worker.streamReader
+        if reader is None:
+            message = 'Polling: {0:.1f} of {1:.1f} scans/s, {2} overruns, {3} dropped'.format(
+                worker.achievedRate(), worker.targetRate, worker.overruns, worker.dropped)
+        else:
+            message = 'Streaming {0} Hz: {1:.1f} blocks/s, {2} packets, {3} missed, {4} errors, {5} overflows, {6} dropped'.format(
+                reader.scanFrequency, worker.achievedRate(), reader.packets, reader.missed,
+                reader.errors, reader.overflows, worker.dropped)
+        recorder = worker.recorder
+        if recorder is not None:
+            message += ' | Recording: {0:.1f} MB, {1} blocks dropped'.format(
+                recorder.bytesWritten / 2**20, recorder.dropped)
+        capture = worker.capture
+        if capture is not None:
+            message += ' | ' + capture.statsMessage()
+        edges = worker.edges
+        if reader is not None and edges is not None:
+            message += ' | ' + edges.statsMessage()
+        publisher = worker.publisher
+        if publisher is not None:
+            message += ' | ' + publisher.statsMessage()
+        return message
+
+    def connectIOcallbacks(self):
+        for i, io in enumerate(self.IOs):
+            io.typeChanged.connect(self.typeSetFcn)
+            io.directionChanged.connect(self.dirSetFcn)
+            io.outputStateChanged.connect(self.outputStateSetFcn)
+
+    def removeIOcallbacks(self):
+        for i, io in enumerate(self.IOs):
+            io.typeChanged.disconnect()
+            io.directionChanged.disconnect()
+            io.outputStateChanged.disconnect()
+
+    def scheduleFlush(self):
+        # wake the worker once all edits from the current GUI event are queued, so they share one flush
+        if not self.flushScheduled:
+            self.flushScheduled = True
+            QtCore.QTimer.singleShot(0, self.flushWrites)
+
+    def flushWrites(self):
+        self.flushScheduled = False
+        self.rendered = {}
+        self.acqWorker.writesQueued()
+
+    def typeSetFcn(self, ionum, state):
+        self.instance.queueChannelType(ionum, state)
+        self.scheduleFlush()
+
+    def dirSetFcn(self, ionum, state):
+        self.instance.queueChannelDir(ionum, state)
+        self.scheduleFlush()
+
+    def outputStateSetFcn(self, ionum, state):
+        self.instance.queueChannelOutputState(ionum, state)
+        self.scheduleFlush()
+
+    @QtCore.pyqtSlot(dict)
+    def inputHandler(self, inputs: dict):
+        rendered = self.rendered
+        for key, val in inputs.items():
+            isDigital = isinstance(val, bool)
+            if not isDigital:
+                val = round(val, self.analogDecimals)
+            shown = (isDigital, val) # a digital True and an analog 1.0 differ
+            if rendered.get(key) == shown:
+                continue
+            rendered[key] = shown
+
+            if isDigital:
+                self.IOs[key].inputStateChanged(val)
+            else:
+                self.IOs[key].analogInputChanged(val)
+
+        self.acqWorker.acknowledge()
+
+    def edgeHandler(self, counts):
+        rising, falling = counts
+        shown = self.edgeCounts
+        for channelNum in np.flatnonzero((rising != shown[0]) | (falling != shown[1])):
+            self.IOs[channelNum].edgeCountsChanged(int(rising[channelNum]), int(falling[channelNum]))
+        self.edgeCounts = counts
+
+    def updateChannels(self):
+        self.states = self.instance.getIOstates()
+        self.rendered = {}
+        self.edgeCounts = (np.zeros(NUM_CHANNELS, dtype=np.int64),) * 2
+        for (io, state) in zip(self.IOs, self.states):
+            isAnalog, isOutput, isHigh = state
+            if isAnalog:
+                io.analogButton.click()
+            else:
+                io.digitalButton.click()
+
+            if isOutput:
+                io.outputButton.click()
+                io.outputSwitch.setCheckState(isHigh)
+            else:
+                io.inputButton.click()
+                io.inputStateChanged(isHigh)
+
+    def shutdown(self):
+        # stop acquiring and release the device
+        self.stopAcquisition()
+        self.removeIOcallbacks()
+        self.stopThreading()
+        self.instance.close()
@@ -0,0 +1,102 @@
+# third party imports
+from PyQt5 import QtCore
+from PyQt5.QtCore import Qt
+from PyQt5 import QtWidgets
+from PyQt5.QtWidgets import QWidget
+
+class DiagnosticsPanel(QWidget):
+    '''
+    diagnostics tab: turns transaction instrumentation on the open device on
+    and off (MyU3.enableInstrumentation) and shows its stats, grouped by
+    command or by caller, refreshed every refreshInterval while visible
+    '''
+    refreshInterval = 500 # ms
+    COLUMNS = ['', 'Count', 'Per s', 'Sent (B)', 'Received (B)', 'Mean (ms)', 'p50 (ms)', 'p99 (ms)', 'Max (ms)']
+
+    def __init__(self, *args, **kwargs):
+        QWidget.__init__(self, *args, **kwargs)
+        self.device = None
+
+        self.enableCheckBox = QtWidgets.QCheckBox('Time device transactions')
+        self.enableCheckBox.setEnabled(False)
+        self.groupBox = QtWidgets.QComboBox()
+        self.groupBox.addItems(['By command', 'By caller'])
+        self.resetButton = QtWidgets.QPushButton('Reset')
+
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+
+        hl = QtWidgets.QHBoxLayout()
+        hl.addWidget(self.enableCheckBox)
+        hl.addWidget(self.groupBox)
+        hl.addWidget(self.resetButton)
+        hl.addStretch()
+        vl = QtWidgets.QVBoxLayout()
+        vl.addLayout(hl)
+        vl.addWidget(self.table)
+        self.setLayout(vl)
+
+        self.refreshTimer = QtCore.QTimer(self)
+        self.refreshTimer.setInterval(self.refreshInterval)
+        self.refreshTimer.timeout.connect(self.refresh)
+
+        self.enableCheckBox.toggled.connect(self.enableToggled)
+        self.groupBox.currentIndexChanged.connect(self.refresh)
+        self.resetButton.clicked.connect(self.reset)
+
+    def setDevice(self, device):
+        # None when the device is disconnected
+        self.device = device
+        self.enableCheckBox.blockSignals(True)
+        self.enableCheckBox.setChecked(device is not None and device.stats is not None)
+        self.enableCheckBox.blockSignals(False)
+        self.enableCheckBox.setEnabled(device is not None)
+        self.refresh()
+
+    def enableToggled(self, checked):
+        if self.device is None:
+            return
+        if checked:
+            self.device.enableInstrumentation()
+        else:
+            self.device.disableInstrumentation()
+        self.refresh()
+
+    def reset(self):
+        if self.device is not None and self.device.stats is not None:
+            self.device.stats.reset()
+        self.refresh()
+
+    def showEvent(self, e):
+        self.refreshTimer.start()
+        QWidget.showEvent(self, e)
+
+    def hideEvent(self, e):
+        self.refreshTimer.stop()
+        QWidget.hideEvent(self, e)
+
+    def refresh(self):
+        stats = self.device.stats if self.device is not None else None
+        if stats is None:
+            self.table.setRowCount(0)
+            return
+
+        elapsed, byCommand, byCaller = stats.snapshot()
+        table = byCommand if self.groupBox.currentIndex() == 0 else byCaller
+        rows = sorted(table.items(), key=lambda item: item[1].total, reverse=True)
+
+        self.table.setRowCount(len(rows))
+        for i, (key, h) in enumerate(rows):
+            values = [key, str(h.count), '{:.1f}'.format(h.count / elapsed), str(h.sent), str(h.received)]
+            values += ['{:.3f}'.format(1000 * v) for v in (h.mean(), h.percentile(50), h.percentile(99), h.max)]
+            for j, text in enumerate(values):
+                item = self.table.item(i, j)
+                if item is None:
+                    item = QtWidgets.QTableWidgetItem()
+                    if j:
+                        item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                    self.table.setItem(i, j, item)
+                item.setText(text)
@@ -0,0 +1,134 @@
+'''
+digital edges from the stream: every scan's FIO/EIO/CIO levels as one 20-bit
+port word, with the edges of all channels found at once by XOR-ing each word
+with the one before it, block by block
+
+edges are reported as event rows (host time in s, channel number, direction:
++1 rising, -1 falling), counted per channel, and optionally recorded (see
+recording.py; the events are a recording of width 3)
+'''
+# standard imports
+import os
+
+# third party imports
+import numpy as np
+
+from ringbuffer import RingBuffer
+from recording import Recorder
+from channels import NUM_CHANNELS, STREAM_FIO_EIO, STREAM_CIO, channelList
+
+EVENT_COLUMNS = ['time', 'channel', 'direction']
+CHANNEL_NAMES = [name for name, _ in channelList(isHV=False)] # as digital channels
+CHANNEL_BITS = np.arange(NUM_CHANNELS, dtype=np.uint32)
+
+def portWords(scans, channels):
+    '''
+    the digital levels of each scan (raw stream codes) as one word, bit i being
+    channel i: FIO/EIO from the FIO_EIO stream channel, CIO from the CIO one
+    '''
+    words = np.zeros(len(scans), dtype=np.uint32)
+    if STREAM_FIO_EIO in channels:
+        words |= scans[:, channels.index(STREAM_FIO_EIO)]
+    if STREAM_CIO in channels:
+        words |= (scans[:, channels.index(STREAM_CIO)].astype(np.uint32) & 0x0f) << 16
+    return words
+
+def eventsPath(path):
+    # where the edges of the recording at path are recorded, e.g. run.edges.ljr for run.ljr
+    return os.path.splitext(path)[0] + '.edges.ljr'
+
+class EdgeDetector(object):
+    '''
+    edges of the digital inputs (as states) in blocks of scans streamed on
+    channels at scanFrequency, the first scan being acquired at startTime
+    (on the timeline event times are given in)
+        - rising, falling: edges counted per channel number
+        - events: the latest historyLength events (a RingBuffer)
+    '''
+    historyLength = 10000
+
+    def __init__(self, channels, states, scanFrequency, startTime=0.0):
+        self.channels = list(channels)
+        self.scanFrequency = scanFrequency
+        self.startTime = startTime
+        self.mask = np.uint32(sum(1 << i for i, (isAnalog, isOutput, _) in enumerate(states)
+            if not isAnalog and not isOutput))
+
+        self.previous = None # port word of the last scan written
+        self.scans = 0
+        self.rising = np.zeros(NUM_CHANNELS, dtype=np.int64)
+        self.falling = np.zeros(NUM_CHANNELS, dtype=np.int64)
+        self.events = RingBuffer(self.historyLength, len(EVENT_COLUMNS))
+        self.recorder = None
+
+    @staticmethod
+    def hasDigitalInputs(channels):
+        return STREAM_FIO_EIO in channels or STREAM_CIO in channels
+
+    def write(self, scans, firstScan=None):
+        '''
+        find the edges in a block of scans; returns their event rows
+        firstScan is the index of the block's first scan in the stream, counting
+        scans the device missed (see StreamReader.nextScan); by default the block
+        follows the previous one
+        '''
+        words = portWords(scans, self.channels)
+        if not len(words):
+            return np.zeros((0, len(EVENT_COLUMNS)))
+        previous = words[0] if self.previous is None else self.previous
+        changed = (words ^ np.concatenate(([previous], words[:-1]))) & self.mask
+        self.previous = words[-1]
+        if firstScan is None:
+            firstScan = self.scans
+        self.scans = firstScan + len(words)
+
+        scanIndex = np.flatnonzero(changed)
+        if not len(scanIndex):
+            return np.zeros((0, len(EVENT_COLUMNS)))
+
+        # one event per set bit of the changed words, in scan then channel order
+        bits = (changed[scanIndex, None] >> CHANNEL_BITS) & 1
+        rows, channelNums = np.nonzero(bits)
+        scanIndex = scanIndex[rows]
+        rising = ((words[scanIndex] >> channelNums.astype(np.uint32)) & 1).astype(bool)
+
+        events = np.empty((len(rows), len(EVENT_COLUMNS)))
+        events[:, 0] = self.startTime + (firstScan + scanIndex) / self.scanFrequency
+        events[:, 1] = channelNums
+        events[:, 2] = np.where(rising, 1, -1)
+
+        self.rising += np.bincount(channelNums[rising], minlength=NUM_CHANNELS)
+        self.falling += np.bincount(channelNums[~rising], minlength=NUM_CHANNELS)
+        self.events.write(events)
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.write(events)
+        return events
+
+    def counts(self):
+        # (rising, falling) edges per channel so far
+        return self.rising.copy(), self.falling.copy()
+
+    def startRecording(self, path, metadata=None):
+        '''
+        record every event from now on to path, with times converted to time.time()
+        by adding the metadata's startTime
+        '''
+        self.stopRecording()
+        metadata = dict(metadata or {})
+        metadata.update({'mode': 'edges', 'columns': EVENT_COLUMNS, 'scanFrequency': self.scanFrequency})
+        recorder = Recorder(path, len(EVENT_COLUMNS), 'float64', metadata)
+        recorder.start()
+        self.recorder = recorder
+
+    def stopRecording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+
+    def statsMessage(self):
+        message = 'Edges: {0:,} rising, {1:,} falling'.format(int(self.rising.sum()), int(self.falling.sum()))
+        if len(self.events):
+            t, channelNum, direction = self.events.latest(1)[0]
+            message += ', last {0} {1}'.format(CHANNEL_NAMES[int(channelNum)], 'rising' if direction > 0 else 'falling')
+        return message
@@ -0,0 +1,368 @@
+'''
+acquisition without the GUI (or Qt at all), for unattended logging, e.g.
+    python -m labjack acquire --serial 320012345 --channels AIN0-3,FIO4 --rate 5000 --out run.ljr --duration 8h
+streams the channels (or polls them, with --poll) at --rate scans/s, writes them
+to a recording (see recording.py; it replays in the GUI) from a background
+thread, optionally serves them to other local programs (--publish, see
+publisher.py), optionally saves the scans around each --trigger (see trigger.py),
+counts the edges of streamed digital inputs (recorded to <out>.edges.ljr, see
+edges.py), and prints throughput, overrun, edge, capture and subscriber lag
+counters every --stats seconds
+stops at the end of --duration, on Ctrl-C or on SIGTERM
+    python -m labjack broker --serial 320012345 --listen 5556
+keeps the device open for several programs at once (see broker.py); acquire
+from it with --broker 5556
+'''
+# standard imports
+import os
+import sys
+import time
+import signal
+import argparse
+from time import perf_counter
+
+# third party imports
+import numpy as np
+
+from channels import NUM_CHANNELS, channelList, parseChannels, acquiredStates
+from publisher import SamplePublisher, parseAddress, formatAddress, channelMask
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parseDuration(text):
+    # seconds in e.g. '8h', '30m', '1.5h' or '90' (seconds)
+    text = text.strip().lower()
+    scale = DURATION_UNITS.get(text[-1:])
+    if scale is not None:
+        text = text[:-1]
+    return float(text) * (scale or 1)
+
+def formatDuration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{0:02d}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+
+def configureChannels(device, selected):
+    '''
+    make the selected channels ({channelNum: isAnalog}) analog or digital inputs
+    other channels are left as they are (they may be driving the rig)
+    '''
+    names = channelList(device.isHV)
+    for channelNum, isAnalog in selected.items():
+        name, exclusiveType = names[channelNum]
+        if exclusiveType is not None and (exclusiveType == 'analog') != isAnalog:
+            raise ValueError('{0} can only be an {1} input on this device.'.format(name, exclusiveType))
+        device.queueChannelType(channelNum, isAnalog)
+        if not isAnalog:
+            device.queueChannelDir(channelNum, False)
+    commands, _ = device.commitWrites()
+    if commands:
+        device.getFeedback(*commands)
+
+class HeadlessAcquisition(object):
+    '''
+    one acquisition run of the selected inputs of an open device, streamed or
+    polled at rate (scans/s), optionally recorded to path
+    '''
+    pollWriteInterval = 0.1 # s, polled rows are handed to the recorder in blocks this long
+
+    def __init__(self, device, inputs, rate, path=None, poll=False, statsInterval=10.0, publisher=None,
+            capture=None):
+        self.device = device
+        self.inputs = inputs
+        self.rate = rate
+        self.path = path
+        self.poll = poll
+        self.statsInterval = statsInterval
+        self.publisher = publisher # a started publisher.SamplePublisher
+        self.mask = channelMask(inputs)
+        self.captureSettings = capture # (trigger, directory, preScans, postScans)
+        self.capture = None
+        self.edges = None # edges.EdgeDetector of streamed digital inputs
+
+        self.running = False
+        self.recorder = None
+        self.reader = None
+
+        # counters
+        self.scans = 0
+        self.overruns = 0 # polls that started late
+
+    def stop(self, *args):
+        # also the SIGINT/SIGTERM handler
+        self.running = False
+
+    def startOutputs(self, metadata):
+        # the recording and subscribers get the same columns
+        metadata.update({'device': self.device.properties, 'io': self.device.ioProperties()})
+        if self.poll:
+            width, dtype = NUM_CHANNELS + 1, 'float64'
+        else:
+            width, dtype = len(self.reader.channels), 'uint16'
+        if self.publisher is not None:
+            self.publisher.announce(metadata, width, dtype)
+        if self.path is not None:
+            from recording import Recorder
+            self.recorder = Recorder(self.path, width, dtype, metadata)
+            self.recorder.start()
+        if self.captureSettings is not None:
+            from trigger import TriggeredCapture, StreamColumns, PollColumns
+            if self.poll:
+                columns = PollColumns()
+            else:
+                columns = StreamColumns(self.reader.channels, self.reader.calibration)
+            self.capture = TriggeredCapture(self.captureSettings[0], columns, width, dtype, metadata,
+                *self.captureSettings[1:])
+        if not self.poll:
+            from edges import EdgeDetector, eventsPath
+            reader = self.reader
+            if EdgeDetector.hasDigitalInputs(reader.channels):
+                # event times in s since the run started
+                self.edges = EdgeDetector(reader.channels, reader.states, reader.scanFrequency,
+                    reader.startTime - self.started)
+                if self.path is not None:
+                    self.edges.startRecording(eventsPath(self.path), {'device': self.device.properties,
+                        'startTime': time.time() - (perf_counter() - self.started), 'recording': self.path})
+
+    def write(self, scans):
+        if self.recorder is not None:
+            self.recorder.write(scans)
+        if self.publisher is not None:
+            self.publisher.publish(scans, self.mask)
+        if self.capture is not None:
+            self.capture.write(scans)
+        if self.edges is not None:
+            self.edges.write(scans, self.reader.nextScan - len(scans))
+
+    def run(self, duration=None):
+        self.running = True
+        self.started = perf_counter()
+        self.lastStats = (self.started, 0)
+        end = self.started + duration if duration is not None else float('inf')
+        try:
+            if self.poll:
+                self.pollLoop(end)
+            else:
+                self.streamLoop(end)
+        finally:
+            if self.reader is not None:
+                self.reader.stopStream()
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.capture is not None:
+                self.capture.stop()
+            if self.edges is not None:
+                self.edges.stopRecording()
+            self.printStats(perf_counter(), final=True)
+
+    def streamLoop(self, end):
+        from stream import StreamReader
+        reader = StreamReader(self.device, self.rate, bufferSeconds=1, inputs=self.inputs)
+        reader.start()
+        self.reader = reader # only stopped (see run) once started
+        self.startOutputs(self.reader.metadata())
+
+        nextStats = self.started + self.statsInterval
+        while self.running:
+            scans = self.reader.readBlock()
+            if self.device.hasPendingWrites():
+                # only from a broker: another client changed the streamed channels
+                raise RuntimeError('The broker restarted the stream with other channels.')
+            if len(scans):
+                self.scans += len(scans)
+                self.write(scans)
+
+            now = perf_counter()
+            if now >= nextStats:
+                nextStats += self.statsInterval
+                self.printStats(now)
+            if now >= end:
+                break
+
+    def pollLoop(self, end):
+        states = acquiredStates(self.device.getIOstates(), self.inputs)
+        packets = self.device.compileScan(states)
+        epoch = perf_counter()
+        self.startOutputs({'mode': 'poll', 'startTime': time.time() - (perf_counter() - epoch)})
+
+        rows = np.full((max(1, int(self.pollWriteInterval * self.rate)), NUM_CHANNELS + 1), np.nan)
+        numRows = 0
+        nextStats = self.started + self.statsInterval
+        nextTime = perf_counter()
+        while self.running:
+            data = self.device.scanInputs(packets)
+            now = perf_counter()
+            self.scans += 1
+
+            row = rows[numRows]
+            row[0] = now - epoch
+            for channelNum, val in data.items():
+                row[channelNum + 1] = val
+            numRows += 1
+            if numRows == len(rows):
+                self.write(rows)
+                rows = np.full(rows.shape, np.nan)
+                numRows = 0
+
+            if now >= nextStats:
+                nextStats += self.statsInterval
+                self.printStats(now)
+            if now >= end:
+                break
+
+            nextTime += 1.0 / self.rate
+            delay = nextTime - perf_counter()
+            if delay < 0:
+                # late: count it and start over rather than bursting to catch up
+                self.overruns += 1
+                nextTime = perf_counter()
+            else:
+                time.sleep(delay)
+
+        if numRows:
+            self.write(rows[:numRows])
+
+    def printStats(self, now, final=False):
+        # rate since the previous line, or over the whole run for the final one
+        lastTime, lastScans = (self.started, 0) if final else self.lastStats
+        self.lastStats = (now, self.scans)
+        rate = (self.scans - lastScans) / (now - lastTime) if now > lastTime else 0.0
+
+        message = '[{0}] {1}{2:,.1f} scans/s, {3:,} scans'.format(formatDuration(now - self.started),
+            'done: ' if final else '', rate, self.scans)
+        if self.reader is not None:
+            message += ', {0} missed, {1} errors, {2} overflows'.format(
+                self.reader.missed, self.reader.errors, self.reader.overflows)
+        else:
+            message += ', {} overruns'.format(self.overruns)
+        if self.recorder is not None:
+            message += ', {0:,.1f} MB written, {1} blocks dropped'.format(
+                self.recorder.bytesWritten / 2**20, self.recorder.dropped)
+        if self.edges is not None:
+            message += ' | ' + self.edges.statsMessage()
+        if self.capture is not None:
+            message += ' | ' + self.capture.statsMessage()
+        if self.publisher is not None:
+            message += ' | ' + self.publisher.statsMessage()
+        print(message, flush=True)
+
+def openDevice(serial, simulate=False, broker=None):
+    if broker is not None:
+        from broker import RemoteU3
+        return RemoteU3(broker)
+    if simulate:
+        from simulator import SimulatedU3
+        return SimulatedU3(serialNumber=serial or SimulatedU3.firstSerial)
+    from labjack import MyU3
+    device = MyU3(False, serial)
+    if not device.is_open():
+        raise RuntimeError('Unable to open device {}.'.format(serial or ''))
+    return device
+
+def acquire(args):
+    t0 = perf_counter()
+    try:
+        selected = parseChannels(args.channels)
+        duration = parseDuration(args.duration) if args.duration else None
+        address = parseAddress(args.publish) if args.publish else None
+        brokerAddress = parseAddress(args.broker) if args.broker else None
+        capture = None
+        if args.trigger:
+            from trigger import parseTrigger
+            capture = (parseTrigger(args.trigger), args.captures, args.pre, args.post)
+            if args.pre < 0:
+                raise ValueError('--pre cannot be negative.')
+            if args.post < 1:
+                raise ValueError('--post must be at least 1 (the scan that fired).')
+            if not os.path.isdir(args.captures):
+                raise ValueError('No directory {}.'.format(args.captures))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    try:
+        device = openDevice(args.serial, args.simulate, brokerAddress)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    publisher = None
+    try:
+        configureChannels(device, selected)
+        if address is not None:
+            publisher = SamplePublisher(address)
+            publisher.start()
+        acquisition = HeadlessAcquisition(device, set(selected), args.rate, args.out, args.poll,
+            args.stats, publisher, capture)
+        signal.signal(signal.SIGINT, acquisition.stop)
+        signal.signal(signal.SIGTERM, acquisition.stop)
+
+        print('{0} {1}: {2} {3} at {4:g} scans/s{5} (ready in {6:.2f} s)'.format(
+            device.properties.get('DeviceName', 'U3'), device.properties.get('SerialNumber', ''),
+            'polling' if args.poll else 'streaming', args.channels, args.rate,
+            ' to {}'.format(args.out) if args.out else '', perf_counter() - t0), flush=True)
+        if publisher is not None:
+            print('publishing on {}'.format(formatAddress(publisher.address)), flush=True)
+        acquisition.run(duration)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    except Exception as e: # e.g. a rate the device can't stream at
+        print('{0}: {1}'.format(type(e).__name__, e), file=sys.stderr)
+        return 1
+    finally:
+        if publisher is not None:
+            publisher.close()
+        device.close()
+    return 0
+
+def broker(args):
+    try:
+        address = parseAddress(args.listen)
+        device = openDevice(args.serial, args.simulate)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    from broker import serveDevice
+    try:
+        serveDevice(device, address)
+    except OSError as e: # e.g. the port is taken
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        device.close()
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m labjack', description='Headless U3 acquisition.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('acquire', help='stream or poll inputs to a recording')
+    p.add_argument('--serial', type=int, default=None, help='device serial number (default: the first found)')
+    p.add_argument('--channels', required=True, help='inputs, e.g. AIN0-3,FIO4,EIO0-7 (AIN analog, FIO/EIO/CIO digital)')
+    p.add_argument('--rate', type=float, default=1000.0, help='scans/s')
+    p.add_argument('--out', default=None, help='recording file (default: acquire without recording)')
+    p.add_argument('--duration', default=None, help="e.g. 90s, 30m, 8h (default: until interrupted)")
+    p.add_argument('--poll', action='store_true', help='poll with feedback commands instead of streaming')
+    p.add_argument('--stats', type=float, default=10.0, help='seconds between status lines')
+    p.add_argument('--publish', default=None, metavar='ADDRESS',
+        help='serve the scans to local subscribers on [host:]port or a Unix socket path')
+    p.add_argument('--simulate', action='store_true', help='acquire from a SimulatedU3')
+    p.add_argument('--trigger', default=None,
+        help="save the scans around each trigger, e.g. 'FIO4 rising' or 'AIN0 falling 1.5 & EIO1 high'")
+    p.add_argument('--pre', type=int, default=1000, help='scans saved before each trigger')
+    p.add_argument('--post', type=int, default=1000, help='scans saved from each trigger on (at least 1)')
+    p.add_argument('--captures', default='.', metavar='DIRECTORY', help='where captures are saved')
+    p.add_argument('--broker', default=None, metavar='ADDRESS', help='acquire from the device shared by a broker')
+
+    p = commands.add_parser('broker', help='share a device with other local programs (see broker.py)')
+    p.add_argument('--serial', type=int, default=None, help='device serial number (default: the first found)')
+    p.add_argument('--listen', default='5556', metavar='ADDRESS', help='[host:]port or a Unix socket path')
+    p.add_argument('--simulate', action='store_true', help='broker a SimulatedU3')
+
+    args = parser.parse_args(argv)
+    return acquire(args) if args.command == 'acquire' else broker(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+'''
+opt-in timing of device transactions (see MyU3.enableInstrumentation)
+'''
+# standard imports
+import os
+import sys
+import bisect
+import threading
+from time import perf_counter
+
+# latency histogram bin edges: 10 us to 10 s, four bins per decade
+BIN_EDGES = [10 ** (k / 4.0) for k in range(-20, 5)]
+
+# (bytes sent, bytes received) of the fixed-size control commands
+CONTROL_BYTES = {
+    'configIO': (12, 12),
+    'configU3': (26, 38),
+    'streamStart': (2, 4),
+    'streamStop': (2, 4),
+}
+
+class LatencyHistogram(object):
+    '''
+    count, bytes and a log-binned latency histogram for one kind of transaction
+    '''
+    def __init__(self):
+        self.count = 0
+        self.sent = 0
+        self.received = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bins = [0] * (len(BIN_EDGES) + 1)
+
+    def add(self, seconds, sent, received):
+        self.count += 1
+        self.sent += sent
+        self.received += received
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.bins[bisect.bisect(BIN_EDGES, seconds)] += 1
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        # upper edge of the bin holding the p-th percentile (within a factor of 10**0.25), at most max
+        target = p / 100.0 * self.count
+        seen = 0
+        for k, n in enumerate(self.bins):
+            seen += n
+            if n and seen >= target:
+                return min(BIN_EDGES[k], self.max) if k < len(BIN_EDGES) else self.max
+        return 0.0
+
+class TransactionStats(object):
+    '''
+    LatencyHistograms of device transactions by command and by caller
+        - command: the method called, with the feedback command types of a getFeedback
+          (e.g. 'getFeedback: AIN, PortStateRead')
+        - caller: the function that called it (e.g. 'labjack.py:scanInputs')
+    safe to record from the acquisition thread while another thread reads
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = perf_counter()
+            self.byCommand = {}
+            self.byCaller = {}
+
+    def record(self, command, caller, seconds, sent, received):
+        with self.lock:
+            for table, key in ((self.byCommand, command), (self.byCaller, caller)):
+                histogram = table.get(key)
+                if histogram is None:
+                    histogram = table[key] = LatencyHistogram()
+                histogram.add(seconds, sent, received)
+
+    def snapshot(self):
+        '''
+        (seconds recorded, {command: histogram}, {caller: histogram}), copied
+        '''
+        with self.lock:
+            copy = lambda table: {key: self.copyHistogram(h) for key, h in table.items()}
+            return perf_counter() - self.started, copy(self.byCommand), copy(self.byCaller)
+
+    @staticmethod
+    def copyHistogram(histogram):
+        copy = LatencyHistogram()
+        copy.__dict__.update(histogram.__dict__)
+        copy.bins = list(histogram.bins)
+        return copy
+
+    def wrap(self, name, method, packetLengths):
+        '''
+        method (a bound device method called name) timed into these stats
+        packetLengths(commands) gives the (sent, received) bytes of a getFeedback
+        '''
+        def timed(*args, **kwargs):
+            t0 = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds = perf_counter() - t0
+                frame = sys._getframe(1)
+                caller = '{0}:{1}'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+
+                if name == 'getFeedback':
+                    sent, received = packetLengths(args)
+                    kinds = []
+                    for cmd in args:
+                        kind = type(cmd).__name__
+                        if kind not in kinds:
+                            kinds.append(kind)
+                    command = '{0}: {1}'.format(name, ', '.join(kinds))
+                elif name == 'streamConfig':
+                    sent, received = 12 + 2 * kwargs.get('NumChannels', 1), 8
+                    command = name
+                else:
+                    sent, received = CONTROL_BYTES.get(name, (0, 0))
+                    command = name
+                self.record(command, caller, seconds, sent, received)
+
+        timed.__name__ = name
+        return timed
@@ -1,15 +1,17 @@
 # standard imports
 import weakref
 import time
+import threading
 
 # third party imports
+import numpy as np
 import u3
+from instrumentation import TransactionStats
 from LabJackPython import deviceCount, listAll, isHandleValid, NullHandleException
+from LabJackPython import MAX_USB_PACKET_LENGTH
 
-# The LabJack vendor ID is 0x0CD5. The product ID for the U3 is 0x0003.
-VENDOR_ID = 0x0CD5
-PRODUCT_ID = 0x0003
-DEVICE_TYPE = 3
+import channels
+from channels import VENDOR_ID, PRODUCT_ID, DEVICE_TYPE, NUM_CHANNELS, STREAM_FIO_EIO, STREAM_CIO
 
 '''
 DEFINITIONS:
@@ -37,11 +39,27 @@ class MyU3(u3.U3):
     instances = []
     verbose = True
     isHV = True
+    isReplay = False # see replay.ReplayDevice
+    stats = None # TransactionStats while instrumented
+    attached = set() # serials known to be attached (kept up to date by DeviceMonitor)
 
-    def __init__(self, *args, **kwargs):
+    # device transactions timed by enableInstrumentation
+    INSTRUMENTED = ['getFeedback', 'configIO', 'configU3', 'streamConfig', 'streamStart', 'streamStop']
+
+    def __init__(self, debug=False, serial=None, **kwargs):
+        self.serial = serial # None opens the first device found
         self.check_connected()
 
-        u3.U3.__init__(self, False, False, **kwargs)
+        # shadow registers: bitfields over channel number, written through on every set
+        self.analogBits = 0
+        self.dirBits = 0
+        self.stateBits = 0
+
+        # queued writes: channelNum -> [isAnalog, isOutput, isHigh] (None = unchanged)
+        self.pendingWrites = {}
+        self.writeLock = threading.Lock()
+
+        u3.U3.__init__(self, debug, False, **kwargs)
         self.instances.append(weakref.ref(self))
         self.open()
 
@@ -50,18 +68,22 @@ class MyU3(u3.U3):
             self.properties = self.configU3()
 
             self.isHV = self.properties['DeviceName'].endswith('HV')
+            self.resync()
 
     def open(self):
-        if not self.is_open():
-            if not self.any_open():
-                try:
-                    u3.U3.open(self) # "super()" needed to avoid recursion
-                except NullHandleException:
-                    self.alert('Unable to open device, possibly because it is open in another process.')
-            else:
-                self.alert('Another open instance already exists. Device not opened.')
-        else:
+        # several devices can be open at once, as long as each is opened by serial number
+        if self.is_open():
             self.alert('Device is already open.')
+        elif self.serial is None and self.any_open():
+            self.alert('Another open instance already exists. Open devices by serial number to use several.')
+        elif self.serial is not None and self.serial in self.open_serials():
+            self.alert('Device {} is already open.'.format(self.serial))
+        else:
+            try:
+                u3.U3.open(self, firstFound=self.serial is None, serial=self.serial) # "super()" needed to avoid recursion
+            except NullHandleException:
+                self.alert('Unable to open device, possibly because it is open in another process. '
+                    'To share a device, run python -m labjack broker and connect to it instead.')
 
     def alert(self, message):
         if self.verbose:
@@ -86,6 +108,9 @@ class MyU3(u3.U3):
         return bool(isHandleValid(self.handle))
 
     def check_connected(self):
+        # skip counting the devices on the bus when the monitor has just seen this one
+        if self.serial in self.attached:
+            return
         if not self.is_connected():
             raise(DeviceNotPresentError('No U3 device detected over USB.'))
 
@@ -95,8 +120,14 @@ class MyU3(u3.U3):
 
     @classmethod
     def any_open(cls):
+        cls.cleanup_instances()
         return any([ref().is_open() for ref in cls.instances])
 
+    @classmethod
+    def open_serials(cls):
+        cls.cleanup_instances()
+        return [ref().serial for ref in cls.instances if ref().is_open()]
+
     @classmethod
     def cleanup_instances(cls):
         cls.instances = list(filter(lambda ref: ref() != None, cls.instances))
@@ -104,6 +135,23 @@ class MyU3(u3.U3):
 
     # -------------------- GENERAL DEVICE COMMUNICATION --------------------
 
+    def enableInstrumentation(self):
+        '''
+        time every device transaction into self.stats (a TransactionStats)
+        the timed wrappers are instance attributes shadowing the methods, so
+        nothing is added to transactions while disabled
+        '''
+        if self.stats is None:
+            self.stats = TransactionStats()
+            for name in self.INSTRUMENTED:
+                setattr(self, name, self.stats.wrap(name, getattr(self, name), self._packet_lengths))
+        return self.stats
+
+    def disableInstrumentation(self):
+        for name in self.INSTRUMENTED:
+            self.__dict__.pop(name, None)
+        self.stats = None
+
     def _feedback_command(self, command):
         resp, = self.getFeedback(command)
         return resp
@@ -120,6 +168,23 @@ class MyU3(u3.U3):
         self.toggleLED()
                 
 
+    @staticmethod
+    def set_bit(bitfield, bit, value):
+        if value:
+            return bitfield | (1 << bit)
+        else:
+            return bitfield & ~(1 << bit)
+
+    @staticmethod
+    def port_bits(portDict):
+        # combine a {'FIO', 'EIO', 'CIO'} feedback result into one bitfield over channels
+        return portDict['FIO'] | (portDict['EIO'] << 8) | (portDict['CIO'] << 16)
+
+    @staticmethod
+    def port_bytes(bitfield):
+        # inverse of port_bits, as the [FIO, EIO, CIO] list used by Port feedback commands
+        return [bitfield & 0xff, (bitfield >> 8) & 0xff, (bitfield >> 16) & 0xff]
+
     @staticmethod
     def int_to_bitarray(uint, bits=8):
         # this is for unsigned ints of course
@@ -134,50 +199,59 @@ class MyU3(u3.U3):
 
     @classmethod
     def channelList(cls):
-        channels = []
-        if cls.isHV:
-            channels.extend([['AIN{}'.format(i), 'analog'] for i in range(4)])
-        else:
-            channels.extend([['FIO{}'.format(i), None] for i in range(4)])
-        channels.extend([['FIO{}'.format(i), None] for i in range(4,8)])
-        channels.extend([['EIO{}'.format(i), None] for i in range(8)])
-        channels.extend([['CIO{}'.format(i), 'digital'] for i in range(4)])
+        return channels.channelList(cls.isHV)
 
-        return channels
-
-    def getIOstates(self):
+    def resync(self):
         '''
-        return a tuple of 3 booleans for each channel, which represent:
-            - type: analog (in) (True) or digital (False)
-            - digital direction: output (True) or input (False)
-            - digital state: high (True) or low (False)
+        re-read analog/direction/state configuration from the device into the shadow registers
+        returns a list of channels whose shadowed type, direction or output state was wrong
+        (only meaningful once the shadow has been populated, i.e. after __init__)
         '''
         adprops = self.configIO()
-        dirs = self._feedback_command(u3.PortDirRead())
-        states = self._feedback_command(u3.PortStateRead())
+        dirs, states = self.getFeedback(u3.PortDirRead(), u3.PortStateRead())
 
-        channelSettings = []
+        analogBits = adprops['FIOAnalog'] | (adprops['EIOAnalog'] << 8)
+        dirBits = self.port_bits(dirs)
+        stateBits = self.port_bits(states)
 
-        fiotypes = self.int_to_bitarray(adprops['FIOAnalog'])
-        fiodirs = self.int_to_bitarray(dirs['FIO'])
-        fiostates = self.int_to_bitarray(states['FIO'])
-        
-        for tup in zip(fiotypes, fiodirs, fiostates):
-            channelSettings.append(tup)
+        wrongBits = (analogBits ^ self.analogBits) | (dirBits ^ self.dirBits)
+        wrongBits |= (stateBits ^ self.stateBits) & dirBits
+        mismatched = [i for i in range(NUM_CHANNELS) if (wrongBits >> i) & 1]
 
-        eiotypes = self.int_to_bitarray(adprops['EIOAnalog'])
-        eiodirs = self.int_to_bitarray(dirs['EIO'])
-        eiostates = self.int_to_bitarray(states['EIO'])
+        self.analogBits, self.dirBits, self.stateBits = analogBits, dirBits, stateBits
 
-        for tup in zip(eiotypes, eiodirs, eiostates):
-            channelSettings.append(tup)
+        return mismatched
 
-        ciotypes = 4 * [False] # these cannot be analog
-        ciodirs = self.int_to_bitarray(dirs['CIO'], bits=4)
-        ciostates = self.int_to_bitarray(states['CIO'], bits=4)
+    def ioProperties(self):
+        '''
+        shadowed configuration in the same format as the configU3 properties
+        '''
+        return {
+            'FIOAnalog': self.analogBits & 0xff,
+            'EIOAnalog': (self.analogBits >> 8) & 0xff,
+            'FIODirection': self.dirBits & 0xff,
+            'EIODirection': (self.dirBits >> 8) & 0xff,
+            'CIODirection': (self.dirBits >> 16) & 0x0f,
+            'FIOState': self.stateBits & 0xff,
+            'EIOState': (self.stateBits >> 8) & 0xff,
+            'CIOState': (self.stateBits >> 16) & 0x0f
+        }
 
-        for tup in zip(ciotypes, ciodirs, ciostates):
-            channelSettings.append(tup)
+    def getIOstates(self):
+        '''
+        return a tuple of 3 booleans for each channel, which represent:
+            - type: analog (in) (True) or digital (False)
+            - digital direction: output (True) or input (False)
+            - digital state: high (True) or low (False)
+        answered from the shadow registers (no device communication)
+        '''
+        channelSettings = []
+        for i in range(NUM_CHANNELS):
+            channelSettings.append((
+                bool((self.analogBits >> i) & 1),
+                bool((self.dirBits >> i) & 1),
+                bool((self.stateBits >> i) & 1)
+            ))
 
         return channelSettings
 
@@ -195,20 +269,298 @@ class MyU3(u3.U3):
 
     def setChannelType(self, channelNum, isAnalog):
         # print('Setting channel {0} to analog state {1}'.format(channelNum, isAnalog))
-        if isAnalog:
-            self.configAnalog(channelNum)
-        else:
-            self.configDigital(channelNum)
+        if channelNum >= 16:
+            return # CIO channels cannot be analog
+
+        analogBits = self.set_bit(self.analogBits, channelNum, isAnalog)
+        adprops = self.configIO(FIOAnalog=analogBits & 0xff, EIOAnalog=(analogBits >> 8) & 0xff)
+        self.analogBits = adprops['FIOAnalog'] | (adprops['EIOAnalog'] << 8)
 
     def setChannelDir(self, channelNum, isOutput):
         # print('Channel {0} set to output: {1}'.format(channelNum, isOutput))
         if isOutput:
-            self.setDOState(channelNum, self.getFIOState(channelNum))
+            isHigh = (self.stateBits >> channelNum) & 1
+            self.getFeedback(u3.BitDirWrite(channelNum, 1), u3.BitStateWrite(channelNum, isHigh))
         else:
-            self.getDIState(channelNum)
+            _, isHigh = self.getFeedback(u3.BitDirWrite(channelNum, 0), u3.BitStateRead(channelNum))
+            self.stateBits = self.set_bit(self.stateBits, channelNum, isHigh)
+        self.dirBits = self.set_bit(self.dirBits, channelNum, isOutput)
 
     def setChannelOutputState(self, channelNum, isHigh):
         self.setDOState(channelNum, int(bool(isHigh)))
+        self.dirBits = self.set_bit(self.dirBits, channelNum, True)
+        self.stateBits = self.set_bit(self.stateBits, channelNum, isHigh)
+
+    # -------------------- INPUT SCAN COMMANDS --------------------
+
+    @staticmethod
+    def _packet_lengths(commands):
+        # request/response sizes as built by getFeedback (header + commands, padded to even)
+        sendLen = 7 + sum([len(cmd.cmdBytes) for cmd in commands])
+        readLen = 9 + sum([cmd.readLen for cmd in commands])
+        return sendLen + sendLen % 2, readLen + readLen % 2
+
+    def compileScan(self, states=None, writes=()):
+        '''
+        build the feedback packets needed to read every input channel
+        returns a list of packets, each a list of (channels, command) pairs
+            - analog inputs each get their own AIN command (channels is an int)
+            - all digital inputs share a single PortStateRead (channels is a tuple)
+            - write commands (e.g. from commitWrites) go first (channels is None)
+        commands are split across packets only if they exceed the USB packet size
+        '''
+        if states is None:
+            states = self.getIOstates()
+
+        commands = [(None, cmd) for cmd in writes]
+        digitalInputs = []
+        for i, (isAnalog, isOutput, isHigh) in enumerate(states):
+            if isAnalog:
+                commands.append((i, u3.AIN(i, 31)))
+            elif not isOutput:
+                digitalInputs.append(i)
+
+        if digitalInputs:
+            commands.append((tuple(digitalInputs), u3.PortStateRead()))
+
+        packets = []
+        current = []
+        for pair in commands:
+            lengths = self._packet_lengths([cmd for _, cmd in current + [pair]])
+            if current and max(lengths) > MAX_USB_PACKET_LENGTH:
+                packets.append(current)
+                current = []
+            current.append(pair)
+        if current:
+            packets.append(current)
+
+        return packets
+
+    def scanInputs(self, packets=None):
+        '''
+        read all input channels with one getFeedback transaction per packet
+        (a single transaction for any U3 channel configuration)
+        returns a dict of channelNum: value, float for analog and bool for digital
+        '''
+        if packets is None:
+            packets = self.compileScan()
+
+        inputs = {}
+        for packet in packets:
+            results = self.getFeedback(*[cmd for _, cmd in packet])
+            for (channels, cmd), result in zip(packet, results):
+                if channels is None:
+                    continue
+                elif isinstance(channels, tuple):
+                    portBits = self.port_bits(result)
+                    inputMask = 0
+                    for i in channels:
+                        inputs[i] = bool((portBits >> i) & 1)
+                        inputMask |= 1 << i
+                    self.stateBits = (self.stateBits & ~inputMask) | (portBits & inputMask)
+                else:
+                    inputs[channels] = self.binaryToCalibratedAnalogVoltage(result,
+                        isLowVoltage=not (self.isHV and channels < 4), channelNumber=channels)
+
+        return inputs
+
+    # -------------------- QUEUED WRITES --------------------
+
+    def queueChannelType(self, channelNum, isAnalog):
+        self._queue_write(channelNum, 0, isAnalog)
+
+    def queueChannelDir(self, channelNum, isOutput):
+        self._queue_write(channelNum, 1, isOutput)
+
+    def queueChannelOutputState(self, channelNum, isHigh):
+        self._queue_write(channelNum, 2, isHigh)
+
+    def _queue_write(self, channelNum, field, value):
+        # later writes to the same channel and field replace earlier ones
+        with self.writeLock:
+            self.pendingWrites.setdefault(channelNum, [None, None, None])[field] = bool(value)
+
+    def hasPendingWrites(self):
+        return bool(self.pendingWrites)
+
+    def commitWrites(self):
+        '''
+        apply all queued writes to the shadow registers and return
+        (commands, configChanged), where commands are the feedback commands
+        (at most one PortDirWrite and one PortStateWrite) that put them on the device,
+        to be sent on their own or ahead of a scan (see compileScan)
+        type changes cannot be sent as feedback commands, so if any are queued
+        they are written here with a single configIO
+        configChanged is True if any channel's type or direction changed
+        '''
+        with self.writeLock:
+            writes, self.pendingWrites = self.pendingWrites, {}
+
+        analogBits, dirBits, self.stateBits, dirMask, stateMask = self._written_bits(writes)
+        configChanged = analogBits != self.analogBits or dirBits != self.dirBits
+
+        if analogBits != self.analogBits:
+            adprops = self.configIO(FIOAnalog=analogBits & 0xff, EIOAnalog=(analogBits >> 8) & 0xff)
+            self.analogBits = adprops['FIOAnalog'] | (adprops['EIOAnalog'] << 8)
+        self.dirBits = dirBits
+
+        return self._port_write_commands(dirMask, stateMask), configChanged
+
+    def hasPendingConfigChanges(self):
+        '''
+        whether committing the queued writes would change any channel's type or
+        direction, e.g. to stop a stream before commitWrites sends the configIO
+        '''
+        with self.writeLock:
+            writes = dict(self.pendingWrites)
+        analogBits, dirBits, _, _, _ = self._written_bits(writes)
+        return analogBits != self.analogBits or dirBits != self.dirBits
+
+    def _written_bits(self, writes):
+        # (analogBits, dirBits, stateBits, dirMask, stateMask) of the shadow registers with writes applied
+        analogBits, dirBits, stateBits = self.analogBits, self.dirBits, self.stateBits
+        dirMask = stateMask = 0
+        for channelNum, (isAnalog, isOutput, isHigh) in writes.items():
+            if isAnalog is not None and channelNum < 16:
+                analogBits = self.set_bit(analogBits, channelNum, isAnalog)
+            if isHigh is not None:
+                if isOutput is None:
+                    isOutput = True # as setDOState, driving a state makes the channel an output
+                stateBits = self.set_bit(stateBits, channelNum, isHigh)
+            if isOutput is not None:
+                dirMask |= 1 << channelNum
+                dirBits = self.set_bit(dirBits, channelNum, isOutput)
+                if isOutput:
+                    stateMask |= 1 << channelNum # (re)assert the shadowed level
+        return analogBits, dirBits, stateBits, dirMask, stateMask
+
+    def _port_write_commands(self, dirMask, stateMask):
+        # masked writes of the shadowed directions/states of the channels in each mask
+        commands = []
+        if dirMask:
+            commands.append(u3.PortDirWrite(self.port_bytes(self.dirBits), self.port_bytes(dirMask)))
+        if stateMask:
+            commands.append(u3.PortStateWrite(self.port_bytes(self.stateBits), self.port_bytes(stateMask)))
+        return commands
+
+    # -------------------- MULTI-CHANNEL DIGITAL I/O --------------------
+
+    def _check_digital(self, channels):
+        for channelNum in channels:
+            if not 0 <= channelNum < NUM_CHANNELS:
+                raise ValueError('No digital channel {}.'.format(channelNum))
+            if (self.analogBits >> channelNum) & 1:
+                raise ValueError('Channel {} is configured as analog.'.format(channelNum))
+
+    def setOutputStates(self, states):
+        '''
+        drive several digital channels at once
+        states maps channelNum to high (True) or low (False); every channel is made
+        an output and all of them switch together in a single feedback command pair
+        '''
+        self._check_digital(states)
+
+        mask = 0
+        for channelNum, isHigh in states.items():
+            mask |= 1 << channelNum
+            self.stateBits = self.set_bit(self.stateBits, channelNum, isHigh)
+        self.dirBits |= mask
+
+        self.getFeedback(*self._port_write_commands(mask, mask))
+
+    def getInputStates(self, channels):
+        '''
+        read several digital channels with a single PortStateRead (directions unchanged)
+        returns a dict of channelNum: high (True) or low (False)
+        '''
+        self._check_digital(channels)
+        portBits = self.port_bits(self._feedback_command(u3.PortStateRead()))
+        return {channelNum: bool((portBits >> channelNum) & 1) for channelNum in channels}
+
+    def setBus(self, value, width, firstChannel=0):
+        '''
+        write value to the width contiguous channels starting at firstChannel
+        (least significant bit on firstChannel), all bits switching simultaneously
+        '''
+        if not 0 <= value < 2**width:
+            raise ValueError('{0} does not fit in {1} bits.'.format(value, width))
+        self.setOutputStates({firstChannel + k: bool((value >> k) & 1) for k in range(width)})
+
+    def getBus(self, width, firstChannel=0):
+        states = self.getInputStates(range(firstChannel, firstChannel + width))
+        return sum([int(states[firstChannel + k]) << k for k in range(width)])
+
+    # -------------------- STREAM COMMANDS --------------------
+
+    def streamChannelList(self, states=None):
+        '''
+        stream channel numbers needed to acquire every input channel
+            - analog inputs are streamed individually (stream channel = AIN number)
+            - digital inputs are covered by the FIO/EIO and CIO port channels
+        '''
+        if states is None:
+            states = self.getIOstates()
+
+        analogInputs = [i for i, (isAnalog, _, _) in enumerate(states) if isAnalog]
+        digitalInputs = [i for i, (isAnalog, isOutput, _) in enumerate(states)
+            if not isAnalog and not isOutput]
+
+        channels = list(analogInputs)
+        if any([i < 16 for i in digitalInputs]):
+            channels.append(STREAM_FIO_EIO)
+        if any([i >= 16 for i in digitalInputs]):
+            channels.append(STREAM_CIO)
+
+        return channels
+
+    def configStream(self, scanFrequency, states=None):
+        '''
+        configure the stream table for all input channels, scanned at scanFrequency (Hz)
+        returns the list of stream channel numbers (one column per channel in each scan)
+        '''
+        channels = self.streamChannelList(states)
+        self.streamConfig(NumChannels=len(channels), PChannels=channels,
+            NChannels=[31]*len(channels), ScanFrequency=scanFrequency)
+        return channels
+
+    def streamSamples(self, result):
+        '''
+        unpack the raw bytes of a streamData(convert=False) block into
+        a flat array of 16-bit sample codes in acquisition order
+        '''
+        numBytes = 14 + 2 * self.streamSamplesPerPacket
+        numPackets = len(result) // numBytes
+        packets = np.frombuffer(result, dtype=np.uint8, count=numPackets*numBytes)
+        packets = packets.reshape(numPackets, numBytes)
+        return packets[:, 12:-2].copy().view('<u2').ravel()
+
+    def decodeScan(self, channels, scan, states=None):
+        '''
+        convert one scan of raw stream codes into an inputs dict like scanInputs
+        '''
+        if states is None:
+            states = self.getIOstates()
+
+        inputs = {}
+        portBits = 0
+        for channel, code in zip(channels, scan):
+            code = int(code)
+            if channel == STREAM_FIO_EIO:
+                portBits |= code & 0xffff
+            elif channel == STREAM_CIO:
+                portBits |= (code & 0x0f) << 16
+            else:
+                inputs[channel] = self.binaryToCalibratedAnalogVoltage(code,
+                    isLowVoltage=not (self.isHV and channel < 4), channelNumber=channel)
 
+        for i, (isAnalog, isOutput, _) in enumerate(states):
+            if not isAnalog and not isOutput:
+                inputs[i] = bool((portBits >> i) & 1)
 
+        return inputs
 
+if __name__ == '__main__':
+    # python -m labjack acquire|broker ... (see headless.py)
+    import sys
+    import headless
+    sys.exit(headless.main())
@@ -3,13 +3,16 @@ import os
 import re
 import subprocess
 from time import time
-from math import floor
 
-from PyQt5 import QtCore, QtWidgets, uic, QtGui
+from PyQt5 import QtCore, QtWidgets, QtGui
 
-from LabjackIO import LabjackIO
 from ConnectPanel import ConnectPanel
-from labjack import MyU3
+from LabjackIO import LabjackIO
+from channels import channelList
+from devicepage import DevicePage, channelGrid
+from plotting import PlotPanel
+from diagnostics import DiagnosticsPanel
+from publisher import parseAddress
 
 starttime = time()
 
@@ -22,20 +25,27 @@ class LabjackApp(QtWidgets.QMainWindow):
         # get ui
         self.setWindowTitle('Labjack Python')
 
+        self.pages = [] # one DevicePage per open device
+
         self.mainLayout()
 
         self.addIOs()
 
-        self.pollInterval = 500 # ms
+        self.pollRate = 2.0 # Hz
+        self.displayRate = 20.0 # Hz, readout refresh while streaming
+        self.streamRate = 1000 # Hz
+        self.publishAddress = '5555' # see publisher.parseAddress
+        self.statsInterval = 500 # ms
         self.setupTimer()
+        self.addAcquisitionControls()
+        self.addPlotTab()
+        self.addDiagnosticsTab()
 
         self.connectSignals()
 
         screenFrac = [0.8, 0.8]
         self.resizeWindow(screenFrac)
 
-        self.instance = None
-
         self.start()
 
     def start(self):
@@ -59,6 +69,8 @@ class LabjackApp(QtWidgets.QMainWindow):
         hl = QtWidgets.QHBoxLayout()
         self.connectPanel = ConnectPanel()
         self.mainTab = QtWidgets.QTabWidget()
+        self.mainTab.setTabsClosable(True)
+        self.mainTab.setStyleSheet(LabjackIO.loadStyleSheet()) # for the channel widgets of every page
         self.page1 = QtWidgets.QWidget()
         self.mainTab.insertTab(0, self.page1, 'Test Panel')
         self.page1.setEnabled(False)
@@ -68,177 +80,308 @@ class LabjackApp(QtWidgets.QMainWindow):
         self.centralWidget().setLayout(hl)
 
     def addIOs(self):
-        self.controlGrid = QtWidgets.QGridLayout()
-        Nrows = 8
-        channels = MyU3.channelList()
-
-        self.IOs = []
-        for i, ch in enumerate(channels):
-            row = i % Nrows
-            col = floor(i / Nrows)
-
-            f = QtWidgets.QFrame()
-            f.setFrameShape(QtWidgets.QFrame.Panel)
-            f.setFrameShadow(QtWidgets.QFrame.Raised)
-            hl = QtWidgets.QHBoxLayout()
-            hl.setContentsMargins(5, 0, 0, 0)
-            hl.setSpacing(0)
-            l = QtWidgets.QLabel(ch[0])
-            l.setAlignment(QtCore.Qt.AlignCenter)
-            hl.addWidget(l)
-            io = LabjackIO(exclusiveType=ch[1], ioNumber=i)
-            self.IOs.append(io)
-            hl.addWidget(io)
-            f.setLayout(hl)
-            self.controlGrid.addWidget(f, row, col)           
-
+        # placeholder channel page, shown while no device is open
+        self.controlGrid, self.IOs = channelGrid()
         self.page1.setLayout(self.controlGrid)
+        self.hideCloseButton(self.page1)
+
+    def hideCloseButton(self, widget):
+        # only device pages can be closed
+        self.mainTab.tabBar().setTabButton(self.mainTab.indexOf(widget), QtWidgets.QTabBar.RightSide, None)
+
+    def addPlotTab(self):
+        self.plotPanel = PlotPanel(channelList())
+        self.mainTab.addTab(self.plotPanel, 'Plot')
+        self.hideCloseButton(self.plotPanel)
+
+    def addDiagnosticsTab(self):
+        self.diagnosticsPanel = DiagnosticsPanel()
+        self.mainTab.addTab(self.diagnosticsPanel, 'Diagnostics')
+        self.hideCloseButton(self.diagnosticsPanel)
+
+    def addAcquisitionControls(self):
+        toolbar = self.addToolBar('Acquisition')
+
+        self.pollRateBox = QtWidgets.QDoubleSpinBox()
+        self.pollRateBox.setRange(0.1, 1000)
+        self.pollRateBox.setDecimals(1)
+        self.pollRateBox.setSuffix(' Hz')
+        self.pollRateBox.setToolTip('Target poll rate')
+        self.pollRateBox.setValue(self.pollRate)
+        toolbar.addWidget(self.pollRateBox)
+        toolbar.addSeparator()
+
+        self.streamCheckBox = QtWidgets.QCheckBox('Stream')
+        self.streamCheckBox.setToolTip('Hardware-timed acquisition instead of polling')
+        toolbar.addWidget(self.streamCheckBox)
+
+        self.streamRateBox = QtWidgets.QSpinBox()
+        self.streamRateBox.setRange(1, 50000)
+        self.streamRateBox.setSuffix(' Hz')
+        self.streamRateBox.setValue(self.streamRate)
+        toolbar.addWidget(self.streamRateBox)
+        toolbar.addSeparator()
+
+        self.recordAction = toolbar.addAction('Record')
+        self.recordAction.setCheckable(True)
+        self.recordAction.setToolTip('Record the current device to a file')
+
+        self.captureAction = toolbar.addAction('Capture')
+        self.captureAction.setCheckable(True)
+        self.captureAction.setToolTip('Save the scans around each trigger of the current device')
+        self.captureDialog = None
+
+        self.publishAction = toolbar.addAction('Publish')
+        self.publishAction.setCheckable(True)
+        self.publishAction.setToolTip('Serve the current device\'s samples to other programs on this computer')
+
+        self.replaySpeedBox = QtWidgets.QDoubleSpinBox()
+        self.replaySpeedBox.setRange(0.1, 1000)
+        self.replaySpeedBox.setDecimals(1)
+        self.replaySpeedBox.setPrefix('x')
+        self.replaySpeedBox.setToolTip('Replay speed')
+        self.replaySpeedBox.setValue(1.0)
+        self.replaySpeedBox.setEnabled(False)
+        toolbar.addWidget(self.replaySpeedBox)
 
     def connectSignals(self):
         self.connectPanel.deviceOpened.connect(self.openFunction)
-        self.connectPanel.deviceDisconnected.connect(self.disconnectFunction)
+        self.connectPanel.deviceUnplugged.connect(self.deviceUnplugged)
+        self.mainTab.currentChanged.connect(self.currentPageChanged)
+        self.mainTab.tabCloseRequested.connect(self.closePage)
+        self.streamCheckBox.toggled.connect(self.acquisitionModeChanged)
+        self.streamRateBox.editingFinished.connect(self.acquisitionModeChanged)
+        self.pollRateBox.valueChanged.connect(self.pollRateChanged)
+        self.recordAction.toggled.connect(self.recordToggled)
+        self.captureAction.toggled.connect(self.captureToggled)
+        self.publishAction.toggled.connect(self.publishToggled)
+        self.replaySpeedBox.valueChanged.connect(self.replaySpeedChanged)
+        self.statsTimer.timeout.connect(self.showStats)
+        self.parent.aboutToQuit.connect(self.stopThreading)
 
     def setupTimer(self):
-        self.pollTimer = QtCore.QTimer()
-        self.pollTimer.setInterval(self.pollInterval)
+        self.statsTimer = QtCore.QTimer()
+        self.statsTimer.setInterval(self.statsInterval)
+
+    def stopThreading(self):
+        for page in list(self.pages):
+            self.removePage(page)
+        self.connectPanel.stopMonitor()
+
+    # -------------------- DEVICE PAGES --------------------
+
+    def currentPage(self):
+        # the device page shown last (toolbar recording/replay controls, status bar and diagnostics follow it)
+        widget = self.mainTab.currentWidget()
+        if widget in self.pages:
+            self.lastPage = widget
+        elif getattr(self, 'lastPage', None) not in self.pages:
+            self.lastPage = self.pages[0] if self.pages else None
+        return self.lastPage
+
+    @property
+    def instance(self):
+        page = self.currentPage()
+        return page.instance if page is not None else None
 
-    def setupThreading(self):
-        if not hasattr(self, 'bkgThread'):
-            self.bkgThread = QtCore.QThread()
-        else:
-            self.bkgThread.quit()
+    def openFunction(self, instance):
+        page = DevicePage(instance, self.pollRateBox.value())
+        page.acqWorker.writesFlushed.connect(lambda: self.writesFlushed(page))
+        page.acqWorker.recordingStopped.connect(lambda path: self.recordingStopped(page))
+        page.acqWorker.captureStopped.connect(lambda: self.captureStopped(page))
+        page.acqWorker.acquisitionFailed.connect(lambda message: self.acquisitionFailed(page))
+        self.pages.append(page)
+
+        if self.mainTab.indexOf(self.page1) >= 0:
+            self.mainTab.removeTab(self.mainTab.indexOf(self.page1))
+        self.mainTab.insertTab(len(self.pages) - 1, page, page.title())
+        self.mainTab.setCurrentWidget(page)
+        self.plotPanel.setSources([(p.title(), p.acqWorker) for p in self.pages])
+
+        self.startAcquisition(page)
+        self.statsTimer.start()
+
+    def removePage(self, page):
+        page.shutdown()
+        self.pages.remove(page)
+        self.mainTab.removeTab(self.mainTab.indexOf(page))
+        page.deleteLater()
+        self.plotPanel.setSources([(p.title(), p.acqWorker) for p in self.pages])
+
+    def closePage(self, index):
+        page = self.mainTab.widget(index)
+        if page in self.pages:
+            self.removePage(page)
+            if not self.pages:
+                self.showPlaceholder()
 
-        self.inputsWorker = InputQuerier(self.instance)
-        self.inputsWorker.moveToThread(self.bkgThread)
-        self.inputsWorker.inputsReady.connect(self.inputHandler)
-        self.bkgThread.started.connect(self.inputsWorker.work)
+    def disconnectFunction(self):
+        if not self.pages:
+            return # nothing was open
+        for page in list(self.pages):
+            self.removePage(page)
+        self.showPlaceholder()
+
+    def deviceUnplugged(self, serial):
+        # close the page of an open device pulled from the bus (the monitor only
+        # reports it once its handle is no longer valid)
+        for page in list(self.pages):
+            if page.instance.serial == serial and not page.instance.is_open():
+                self.closePage(self.mainTab.indexOf(page))
+
+    def showPlaceholder(self):
+        self.statsTimer.stop()
+        self.statusBar().clearMessage()
+        self.mainTab.insertTab(0, self.page1, 'Test Panel')
+        self.hideCloseButton(self.page1)
+        self.mainTab.setCurrentWidget(self.page1)
+        self.currentPageChanged()
+
+    def currentPageChanged(self, index=None):
+        page = self.currentPage()
+        instance = page.instance if page is not None else None
+        self.connectPanel.showProperties(instance)
+        self.diagnosticsPanel.setDevice(instance)
+        self.setReplayControls(instance)
+
+        self.recordAction.blockSignals(True)
+        self.recordAction.setChecked(page is not None and page.acqWorker.recorder is not None)
+        self.recordAction.blockSignals(False)
+        self.captureAction.blockSignals(True)
+        self.captureAction.setChecked(page is not None and page.acqWorker.capture is not None)
+        self.captureAction.blockSignals(False)
+        self.publishAction.blockSignals(True)
+        self.publishAction.setChecked(page is not None and page.acqWorker.publisher is not None)
+        self.publishAction.blockSignals(False)
+
+    def writesFlushed(self, page):
+        if page is self.currentPage():
+            self.connectPanel.updatePropertyViewer()
+
+    # -------------------- ACQUISITION SETTINGS (ALL DEVICES) --------------------
+
+    def startAcquisition(self, page):
+        if self.streamCheckBox.isChecked():
+            page.startAcquisition(self.streamRateBox.value(), self.displayRate)
+        else:
+            page.startAcquisition(None, self.pollRateBox.value())
+
+    def stopAcquisition(self):
+        self.statsTimer.stop()
+        for page in self.pages:
+            page.stopAcquisition()
+        self.statusBar().clearMessage()
+
+    def acquisitionModeChanged(self):
+        for page in self.pages:
+            self.startAcquisition(page)
+
+    def pollRateChanged(self, rate):
+        for page in self.pages:
+            if page.acqWorker.streamReader is None:
+                page.acqWorker.setTargetRate(rate)
+
+    def showStats(self):
+        page = self.currentPage()
+        if page is not None:
+            self.statusBar().showMessage('{0}: {1}'.format(page.title(), page.statsMessage()))
+
+    # -------------------- CURRENT DEVICE --------------------
+
+    def replaySpeedChanged(self, speed):
+        if self.instance is not None and self.instance.isReplay:
+            self.instance.setSpeed(speed)
+
+    def setReplayControls(self, instance):
+        # a replay plays in its recorded mode and rate; only its speed can be changed
+        replaying = instance is not None and instance.isReplay
+        if replaying:
+            self.replaySpeedBox.blockSignals(True)
+            self.replaySpeedBox.setValue(instance.timebase[2])
+            self.replaySpeedBox.blockSignals(False)
+        self.replaySpeedBox.setEnabled(replaying)
+
+    def recordToggled(self, checked):
+        page = self.currentPage()
+        if not checked:
+            if page is not None:
+                page.acqWorker.stopRecording()
+            return
+
+        path = None
+        if page is not None:
+            path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Record to', '', 'Recordings (*.ljr)')
+        if not path:
+            self.recordAction.setChecked(False)
+            return
+        page.acqWorker.startRecording(path)
+
+    def captureToggled(self, checked):
+        from capturedialog import CaptureDialog
+        page = self.currentPage()
+        if not checked:
+            if page is not None:
+                page.acqWorker.stopCapture()
+            return
+
+        if self.captureDialog is None:
+            self.captureDialog = CaptureDialog(self)
+        if page is not None and self.captureDialog.exec_():
+            try:
+                page.acqWorker.startCapture(*self.captureDialog.settings())
+                return
+            except ValueError as e: # e.g. a trigger channel that is not streamed
+                self.statusBar().showMessage('Unable to capture: {}'.format(e))
+        self.captureStopped(page)
+
+    def captureStopped(self, page):
+        # also sent when the worker ends a capture itself (mode or channel table change)
+        if page is self.currentPage():
+            self.captureAction.blockSignals(True)
+            self.captureAction.setChecked(False)
+            self.captureAction.blockSignals(False)
+
+    def publishToggled(self, checked):
+        page = self.currentPage()
+        if not checked:
+            if page is not None:
+                page.acqWorker.stopPublishing()
+            return
+
+        text, ok = '', False
+        if page is not None:
+            text, ok = QtWidgets.QInputDialog.getText(self, 'Publish on',
+                'Port ([host:]port) or Unix socket path:', text=self.publishAddress)
+        if ok:
+            try:
+                page.acqWorker.startPublishing(parseAddress(text))
+                self.publishAddress = text
+                return
+            except (ValueError, OSError) as e: # e.g. the port is taken
+                self.statusBar().showMessage('Unable to publish on {0}: {1}'.format(text, e))
+        self.publishAction.blockSignals(True)
+        self.publishAction.setChecked(False)
+        self.publishAction.blockSignals(False)
+
+    def recordingStopped(self, page):
+        # also sent when the worker ends a recording itself (mode or channel table change)
+        if page is self.currentPage():
+            self.recordAction.blockSignals(True)
+            self.recordAction.setChecked(False)
+            self.recordAction.blockSignals(False)
+
+    def acquisitionFailed(self, page):
+        # the worker stopped publishing too; recordings and captures report themselves
+        if page is self.currentPage():
+            self.publishAction.blockSignals(True)
+            self.publishAction.setChecked(False)
+            self.publishAction.blockSignals(False)
+            self.showStats()
 
     def checkInstance(self):
         if self.instance == None:
             raise(Exception('No device instance open.'))
 
-    def connectIOcallbacks(self):
-        for i, io in enumerate(self.IOs):
-            io.typeChanged.connect(self.typeSetFcn)
-            io.directionChanged.connect(self.dirSetFcn)
-            io.outputStateChanged.connect(self.outputStateSetFcn)
-
-    def removeIOcallbacks(self):
-        for i, io in enumerate(self.IOs):
-            io.typeChanged.disconnect()
-            io.directionChanged.disconnect()
-            io.outputStateChanged.disconnect()
-
-    def typeSetFcn(self, ionum, state):
-        self.checkInstance()
-        self.pollTimer.stop()
-        self.instance.setChannelType(ionum, state)
-        self.restartTimer()
-        self.connectPanel.updatePropertyViewer()
-
-    def dirSetFcn(self, ionum, state):
-        self.checkInstance()
-        self.pollTimer.stop()
-        self.instance.setChannelDir(ionum, state)
-        self.restartTimer()
-        self.connectPanel.updatePropertyViewer()
-
-    def outputStateSetFcn(self, ionum, state):
-        self.checkInstance()
-        self.pollTimer.stop()
-        self.instance.setChannelOutputState(ionum, state)
-        self.restartTimer()
-        self.connectPanel.updatePropertyViewer()
-
-    def openFunction(self, instance):
-        self.instance = instance
-        self.page1.setEnabled(True)
-        self.updateChannels()
-        self.connectIOcallbacks()
-
-        self.restartTimer()
-
-    def restartTimer(self):
-        self.checkInstance()
-
-        self.setupThreading()
-        # self.inputs = self.instance.allInputs()
-        # self.states = self.instance.getIOstates()
-        # # self.pollTimer.timeout.disconnect()
-        self.pollTimer.timeout.connect(self.pollFunction)
-        self.pollTimer.start()
-
-    def pollFunction(self):
-        self.instance.toggleLED()
-        self.bkgThread.start()
-
-        # for i in self.instance.allInputs():
-        #     # print('{0} isAnalog: {1}'.format(i, self.states[i][0]))
-        #     if self.states[i][0]: # this means analog
-        #         val = self.instance.getAIN(i)
-        #         self.IOs[i].analogReadout.display(val)
-        #     else:
-        #         val = bool(self.instance.getDIState(i))
-        #         self.IOs[i].led.state = val
-        # print('Elapsed: {}'.format(time() - starttime))
-
-    @QtCore.pyqtSlot(dict)
-    def inputHandler(self, inputs: dict):
-        self.bkgThread.quit()
-
-        for key, val in inputs.items():
-            if isinstance(val, bool):
-                self.IOs[key].inputStateChanged(val)
-            else:
-                self.IOs[key].analogInputChanged(val)
-
-    def updateChannels(self):
-        self.checkInstance()
-
-        self.states = self.instance.getIOstates()
-        for (io, state) in zip(self.IOs, self.states):
-            isAnalog, isOutput, isHigh = state
-            if isAnalog:
-                io.analogButton.click()
-            else:
-                io.digitalButton.click()
-
-            if isOutput:
-                io.outputButton.click()
-                io.outputSwitch.setCheckState(isHigh)
-            else:
-                io.inputButton.click()
-                io.inputStateChanged(isHigh)
-
-    def disconnectFunction(self):
-        self.instance = None
-        self.page1.setEnabled(False)
-        self.removeIOcallbacks()
-
-class InputQuerier(QtCore.QObject):
-
-    inputsReady = QtCore.pyqtSignal(dict)
-
-    def __init__(self, myu3instance):
-        QtCore.QObject.__init__(self)
-        self.myu3instance = myu3instance
-
-    @QtCore.pyqtSlot()
-    def work(self):
-
-        dataDict = {}
-
-        states = self.myu3instance.getIOstates()
-        for i in self.myu3instance.allInputs():
-            # print('{0}, isAnalog: {1}, isOutput: {2}'.format(i, states[i][0], states[i][1]))
-            if states[i][0]: # this means analog
-                val = self.myu3instance.getAIN(i)
-            else:
-                val = bool(self.myu3instance.getDIState(i))
-            dataDict[i] = val
-
-        self.inputsReady.emit(dataDict)
-
 
 
 app = QtWidgets.QApplication(sys.argv)
@@ -0,0 +1,209 @@
+# standard imports
+import warnings
+
+# third party imports
+import numpy as np
+from PyQt5 import QtCore
+from PyQt5.QtCore import Qt
+from PyQt5 import QtGui
+from PyQt5 import QtWidgets
+from PyQt5.QtWidgets import QWidget
+
+from acquisition import hostTime
+
+def minMaxDecimate(t, y, bins):
+    '''
+    reduce (t, y) to at most 2*bins points: the min and max of y in each of bins
+    equal slices, at the time of the slice's first sample; drawn as a polyline
+    this is the same envelope as plotting every sample at one bin per pixel
+    '''
+    n = len(y)
+    if n <= 2 * bins:
+        return t, y
+
+    size = n // bins
+    start = n - size * bins # drop the few oldest samples that don't fill a bin
+    blocks = y[start:].reshape(bins, size)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # all-NaN bins stay NaN
+        mins = np.nanmin(blocks, axis=1)
+        maxs = np.nanmax(blocks, axis=1)
+
+    td = np.repeat(t[start::size][:bins], 2)
+    yd = np.empty(2 * bins)
+    yd[0::2] = mins
+    yd[1::2] = maxs
+    return td, yd
+
+class PlotWidget(QWidget):
+    '''
+    painted strip chart of several traces sharing a time axis (seconds before now)
+    traces are expected to be decimated to about one point pair per pixel already
+    '''
+    COLORS = [QtGui.QColor(0, 114, 189), QtGui.QColor(217, 83, 25), QtGui.QColor(237, 177, 32),
+        QtGui.QColor(126, 47, 142), QtGui.QColor(119, 172, 48), QtGui.QColor(77, 190, 238),
+        QtGui.QColor(162, 20, 47), QtGui.QColor(0, 0, 0)]
+    MARGINS = QtCore.QMargins(50, 10, 10, 25)
+
+    def __init__(self, *args, **kwargs):
+        QWidget.__init__(self, *args, **kwargs)
+        self.traces = []
+        self.window = 10.0
+        self.setMinimumSize(QtCore.QSize(200, 150))
+
+    def plotRect(self):
+        return self.rect().marginsRemoved(self.MARGINS)
+
+    def setTraces(self, traces, window):
+        '''
+        traces: list of (label, t, y) with t in seconds relative to now (<= 0)
+        '''
+        self.traces = traces
+        self.window = window
+        self.update()
+
+    def yRange(self):
+        lows = [np.nanmin(y) for _, _, y in self.traces if len(y) and not np.all(np.isnan(y))]
+        highs = [np.nanmax(y) for _, _, y in self.traces if len(y) and not np.all(np.isnan(y))]
+        if not lows:
+            return 0.0, 1.0
+        low, high = min(lows), max(highs)
+        pad = 0.05 * (high - low) if high > low else 0.5
+        return low - pad, high + pad
+
+    def paintEvent(self, e):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+
+        rect = self.plotRect()
+        low, high = self.yRange()
+        xScale = rect.width() / self.window
+        yScale = rect.height() / (high - low)
+
+        # grid and labels
+        painter.setPen(QtGui.QPen(QtGui.QColor(220, 220, 220)))
+        for k in range(5):
+            y = rect.bottom() - k * rect.height() / 4
+            painter.drawLine(QtCore.QPointF(rect.left(), y), QtCore.QPointF(rect.right(), y))
+        painter.setPen(Qt.black)
+        for k in range(5):
+            y = rect.bottom() - k * rect.height() / 4
+            label = '{:.3g}'.format(low + k * (high - low) / 4)
+            painter.drawText(QtCore.QRectF(0, y - 10, self.MARGINS.left() - 5, 20),
+                Qt.AlignRight | Qt.AlignVCenter, label)
+        for k in range(5):
+            x = rect.left() + k * rect.width() / 4
+            label = '{:.3g} s'.format(-self.window + k * self.window / 4)
+            painter.drawText(QtCore.QRectF(x - 40, rect.bottom() + 3, 80, 20), Qt.AlignCenter, label)
+        painter.drawRect(rect)
+
+        # traces
+        painter.setClipRect(rect)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing, False)
+        for i, (label, t, y) in enumerate(self.traces):
+            xs = rect.right() + t * xScale
+            ys = rect.bottom() - (y - low) * yScale
+            polygon = QtGui.QPolygonF([QtCore.QPointF(x, v) for x, v in zip(xs, ys) if v == v])
+            painter.setPen(QtGui.QPen(self.COLORS[i % len(self.COLORS)], 1))
+            painter.drawPolyline(polygon)
+
+        # legend
+        painter.setClipping(False)
+        for i, (label, t, y) in enumerate(self.traces):
+            painter.setPen(self.COLORS[i % len(self.COLORS)])
+            painter.drawText(QtCore.QPointF(rect.left() + 5 + 60 * i, rect.top() + 15), label)
+
+        painter.end()
+
+class PlotPanel(QWidget):
+    '''
+    plot tab: pick channels of any acquiring device, pick a time window, and the
+    newest history from each source (an AcquisitionWorker, see history()) is
+    redrawn at frameRate regardless of the acquisition rates, with every device
+    on the common host timeline
+    '''
+    frameRate = 30 # Hz
+
+    def __init__(self, channels, *args, **kwargs):
+        QWidget.__init__(self, *args, **kwargs)
+        self.channelNames = [ch[0] for ch in channels]
+        self.sources = []
+        self.labels = {}
+
+        self.channelList = QtWidgets.QListWidget()
+        self.channelList.setMaximumWidth(160)
+
+        self.windowBox = QtWidgets.QDoubleSpinBox()
+        self.windowBox.setRange(0.1, 3600)
+        self.windowBox.setSuffix(' s')
+        self.windowBox.setValue(10)
+
+        self.plot = PlotWidget()
+
+        vl = QtWidgets.QVBoxLayout()
+        vl.addWidget(QtWidgets.QLabel('Window'))
+        vl.addWidget(self.windowBox)
+        vl.addWidget(self.channelList)
+        hl = QtWidgets.QHBoxLayout()
+        hl.addLayout(vl)
+        hl.addWidget(self.plot, 1)
+        self.setLayout(hl)
+
+        self.frameTimer = QtCore.QTimer(self)
+        self.frameTimer.setInterval(int(1000 / self.frameRate))
+        self.frameTimer.timeout.connect(self.refresh)
+
+    def setSources(self, sources):
+        '''
+        sources: list of (name, worker); channels are prefixed with the name once
+        there are several, and stay checked across changes
+        '''
+        checked = set([self.channelList.item(i).text() for i in range(self.channelList.count())
+            if self.channelList.item(i).checkState() == Qt.Checked])
+
+        self.sources = list(sources)
+        self.labels = {}
+        self.channelList.clear()
+        for s, (name, worker) in enumerate(self.sources):
+            for channelNum, channelName in enumerate(self.channelNames):
+                label = channelName if len(self.sources) == 1 else '{0} {1}'.format(name, channelName)
+                item = QtWidgets.QListWidgetItem(label)
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                item.setCheckState(Qt.Checked if label in checked else Qt.Unchecked)
+                item.setData(Qt.UserRole, (s, channelNum))
+                self.channelList.addItem(item)
+                self.labels[(s, channelNum)] = label
+
+    def selectedChannels(self):
+        # {source index: [channelNum, ...]}
+        selected = {}
+        for i in range(self.channelList.count()):
+            item = self.channelList.item(i)
+            if item.checkState() == Qt.Checked:
+                s, channelNum = item.data(Qt.UserRole)
+                selected.setdefault(s, []).append(channelNum)
+        return selected
+
+    def showEvent(self, e):
+        self.frameTimer.start()
+        QWidget.showEvent(self, e)
+
+    def hideEvent(self, e):
+        self.frameTimer.stop()
+        QWidget.hideEvent(self, e)
+
+    def refresh(self):
+        window = self.windowBox.value()
+        bins = max(1, self.plot.plotRect().width())
+        now = hostTime()
+
+        traces = []
+        for s, channels in sorted(self.selectedChannels().items()):
+            times, history = self.sources[s][1].history(channels, window)
+            if not len(times):
+                continue
+            for channelNum, values in history.items():
+                t, y = minMaxDecimate(times - now, values, bins)
+                traces.append((self.labels[(s, channelNum)], t, y))
+
+        self.plot.setTraces(traces, window)
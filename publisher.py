@@ -0,0 +1,399 @@
+'''
+acquired scans served to other local processes (dashboards, loggers, analysis)
+over a TCP or Unix-domain socket
+
+every frame is a fixed header followed by a payload (all little-endian):
+    header    MAGIC, uint8 kind, pad byte, uint16 width, uint32 channel mask,
+              uint64 firstScan, float64 timestamp, uint32 numScans, uint32 payload bytes
+    METADATA  JSON description of the data frames that follow (width, dtype, mode,
+              calibration, ... as a recording header, see recording.py)
+    DATA      numScans * width samples of the announced dtype, row-major: the
+              acquired array's bytes as they are, with no per-sample encoding
+the channel mask has bit i set when channel i was acquired; timestamp is the host
+time (time.time()) the block was published; firstScan counts scans since the last
+METADATA frame, so a subscriber sees a gap wherever frames were dropped for it
+
+each subscriber gets its own bounded queue, drained by one I/O thread: a slow
+subscriber loses frames (counted) instead of holding up acquisition or the others
+'''
+# standard imports
+import os
+import json
+import time
+import socket
+import struct
+import selectors
+import threading
+from time import perf_counter
+from collections import deque
+
+# third party imports
+import numpy as np
+
+MAGIC = b'LJSP'
+METADATA, DATA = range(2)
+
+FRAME_FORMAT = '<4sBxHIQdII'
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+
+DEFAULT_HOST = 'localhost'
+
+def parseAddress(text):
+    '''
+    socket address of e.g. '5555' or 'localhost:5555' (TCP), or a path such
+    as '/tmp/labjack.sock' (Unix-domain socket)
+    '''
+    if os.sep in text or text.endswith('.sock'):
+        return text
+    host, _, port = text.rpartition(':')
+    try:
+        return (host or DEFAULT_HOST, int(port))
+    except ValueError:
+        raise ValueError('Invalid address {}: expected [host:]port or a socket path.'.format(text))
+
+def formatAddress(address):
+    if isinstance(address, tuple):
+        return '{0}:{1}'.format(*address[:2])
+    return address
+
+def channelMask(channels):
+    # bit i set for every channel number i in channels
+    mask = 0
+    for channelNum in channels:
+        mask |= 1 << channelNum
+    return mask
+
+def packFrame(kind, payload, width=0, mask=0, firstScan=0, timestamp=0.0, numScans=0):
+    header = struct.pack(FRAME_FORMAT, MAGIC, kind, width, mask, firstScan, timestamp,
+        numScans, len(payload))
+    return header + payload
+
+class Subscriber(object):
+    '''
+    per-client state of a SamplePublisher: frames and queuedBytes are shared with
+    publish() under the publisher's lock, the rest belongs to the I/O thread
+    '''
+    def __init__(self, sock, name):
+        self.sock = sock
+        self.name = name # peer address, or a number for Unix-domain clients (they have none)
+        self.frames = deque() # (frame, time queued)
+        self.offset = 0 # bytes of frames[0] already sent
+        self.queuedBytes = 0
+        self.writing = False # registered for EVENT_WRITE
+
+        # counters
+        self.sent = 0 # frames
+        self.bytesSent = 0
+        self.dropped = 0 # frames discarded because the queue was full
+
+    def queue(self, frame, now):
+        self.frames.append((frame, now))
+        self.queuedBytes += len(frame)
+
+    def lag(self, now):
+        # how long the oldest frame not yet fully sent has been waiting
+        return now - self.frames[0][1] if self.frames else 0.0
+
+class SamplePublisher(object):
+    '''
+    serves blocks of scans to any number of subscribers at address: a
+    (host, port) tuple for TCP or a path for a Unix-domain socket
+    publish() only queues the block, so it is safe to call from the acquisition
+    loop; the socket I/O is done by a background thread
+    subscribers connecting mid-run first get the current METADATA frame
+    '''
+    maxQueued = 1000 # frames per subscriber; beyond this, frames are dropped (and counted)
+
+    def __init__(self, address):
+        self.address = address
+        self.metadata = None
+        self.metadataFrame = None
+        self.nextScan = 0
+
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.closing = False
+
+        # counters
+        self.published = 0 # frames
+        self.connections = 0
+
+    def start(self):
+        if isinstance(self.address, tuple):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            if os.path.exists(self.address):
+                os.unlink(self.address) # left behind by a publisher that died
+        try:
+            listener.bind(self.address)
+            listener.listen()
+        except OSError:
+            listener.close()
+            raise
+        listener.setblocking(False)
+        self.address = listener.getsockname() # e.g. the port picked for port 0
+        self.listener = listener
+
+        # written to by publish() to wake the I/O thread
+        self.wakeReader, self.wakeWriter = socket.socketpair()
+        self.wakeReader.setblocking(False)
+        self.wakeWriter.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(listener, selectors.EVENT_READ, 'accept')
+        self.selector.register(self.wakeReader, selectors.EVENT_READ, 'wake')
+
+        self.thread = threading.Thread(target=self.run, name='SamplePublisher', daemon=True)
+        self.thread.start()
+
+    # -------------------- CALLED FROM THE ACQUISITION THREAD --------------------
+
+    def announce(self, metadata, width, dtype):
+        '''
+        describe the data frames that follow: blocks of scans with width columns of
+        dtype, plus metadata (e.g. stream channels and calibration)
+        sent to every subscriber (never dropped) and restarts the scan count
+        '''
+        if self.closing:
+            return # closed from another thread
+        dtype = np.dtype(dtype).newbyteorder('<')
+        metadata = dict(metadata)
+        metadata.update({'width': width, 'dtype': dtype.str})
+        frame = packFrame(METADATA, json.dumps(metadata).encode('utf-8'), width,
+            timestamp=time.time())
+        now = perf_counter()
+        with self.lock:
+            self.metadata, self.metadataFrame = metadata, frame
+            self.dtype, self.width = dtype, width
+            self.nextScan = 0
+            for subscriber in self.subscribers:
+                subscriber.queue(frame, now)
+        self.wakeUp()
+
+    def publish(self, scans, mask, timestamp=None):
+        '''
+        queue a block of scans (rows of the announced width) for every subscriber
+        mask has bit i set for every channel acquired in the block (see channelMask)
+        ignored once the publisher is closing, as it can be from another thread
+        '''
+        if self.closing:
+            return
+        if self.metadata is None:
+            raise RuntimeError('announce() the data before publishing it.')
+        if timestamp is None:
+            timestamp = time.time()
+        scans = np.ascontiguousarray(scans, self.dtype).reshape(-1, self.width)
+        now = perf_counter()
+        with self.lock:
+            frame = packFrame(DATA, scans.tobytes(), self.width, mask, self.nextScan,
+                timestamp, len(scans))
+            self.nextScan += len(scans)
+            self.published += 1
+            for subscriber in self.subscribers:
+                if len(subscriber.frames) >= self.maxQueued:
+                    subscriber.dropped += 1
+                else:
+                    subscriber.queue(frame, now)
+        self.wakeUp()
+
+    def wakeUp(self):
+        try:
+            self.wakeWriter.send(b'\x00')
+        except (OSError, AttributeError):
+            pass # already awake, closed meanwhile, or not started
+
+    # -------------------- CALLED FROM ANY THREAD --------------------
+
+    def clientStats(self):
+        '''
+        [{'name', 'queued' (frames), 'queuedBytes', 'lag' (s), 'sent', 'dropped'}, ...]
+        lag is how long the oldest frame still queued for the client has waited
+        '''
+        now = perf_counter()
+        with self.lock:
+            return [{
+                'name': subscriber.name,
+                'queued': len(subscriber.frames),
+                'queuedBytes': subscriber.queuedBytes,
+                'lag': subscriber.lag(now),
+                'sent': subscriber.sent,
+                'dropped': subscriber.dropped,
+            } for subscriber in self.subscribers]
+
+    def statsMessage(self):
+        stats = self.clientStats()
+        message = 'Publishing on {0}: {1} client{2}'.format(formatAddress(self.address),
+            len(stats), '' if len(stats) == 1 else 's')
+        for client in stats:
+            message += ', {0} lag {1:.2f} s ({2} queued, {3} dropped)'.format(
+                client['name'], client['lag'], client['queued'], client['dropped'])
+        return message
+
+    def close(self):
+        self.closing = True
+        self.wakeUp()
+        if self.thread is not None:
+            self.thread.join()
+
+    # -------------------- I/O THREAD --------------------
+
+    def run(self):
+        while not self.closing:
+            for key, events in self.selector.select():
+                if key.data == 'accept':
+                    self.accept()
+                elif key.data == 'wake':
+                    try:
+                        while self.wakeReader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self.serve(key.data, events)
+            self.updateInterest()
+
+        for subscriber in list(self.subscribers):
+            self.disconnect(subscriber)
+        self.selector.close()
+        self.listener.close()
+        self.wakeReader.close()
+        self.wakeWriter.close()
+        if not isinstance(self.address, tuple):
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+    def accept(self):
+        try:
+            sock, address = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        if sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections += 1
+        name = formatAddress(address) if isinstance(address, tuple) else '#{}'.format(self.connections)
+        subscriber = Subscriber(sock, name)
+        with self.lock:
+            if self.metadataFrame is not None:
+                subscriber.queue(self.metadataFrame, perf_counter())
+            self.subscribers.append(subscriber)
+        self.selector.register(sock, selectors.EVENT_READ, subscriber)
+
+    def serve(self, subscriber, events):
+        if events & selectors.EVENT_READ:
+            # subscribers never send; readable means closed (or a protocol error)
+            try:
+                data = subscriber.sock.recv(4096)
+            except BlockingIOError:
+                data = None
+            except OSError:
+                data = b''
+            if data == b'':
+                self.disconnect(subscriber)
+                return
+        if events & selectors.EVENT_WRITE:
+            self.send(subscriber)
+
+    def send(self, subscriber):
+        while True:
+            with self.lock:
+                if not subscriber.frames:
+                    return
+                frame = subscriber.frames[0][0]
+            try:
+                n = subscriber.sock.send(memoryview(frame)[subscriber.offset:])
+            except BlockingIOError:
+                return
+            except OSError:
+                self.disconnect(subscriber)
+                return
+            subscriber.offset += n
+            subscriber.bytesSent += n
+            if subscriber.offset == len(frame):
+                with self.lock:
+                    subscriber.frames.popleft()
+                    subscriber.queuedBytes -= len(frame)
+                subscriber.offset = 0
+                subscriber.sent += 1
+
+    def updateInterest(self):
+        # only wait for a subscriber to become writable while it has frames queued
+        with self.lock:
+            subscribers = [(s, bool(s.frames)) for s in self.subscribers]
+        for subscriber, pending in subscribers:
+            if pending != subscriber.writing:
+                subscriber.writing = pending
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0)
+                self.selector.modify(subscriber.sock, events, subscriber)
+
+    def disconnect(self, subscriber):
+        with self.lock:
+            if subscriber not in self.subscribers:
+                return
+            self.subscribers.remove(subscriber)
+        self.selector.unregister(subscriber.sock)
+        subscriber.sock.close()
+
+class SampleClient(object):
+    '''
+    reads the frames of a SamplePublisher, e.g.
+        client = SampleClient(('localhost', 5555))
+        for firstScan, timestamp, mask, scans in client:
+            ...
+    metadata holds the newest METADATA frame; lost counts the scans skipped
+    because the publisher dropped frames for this client
+    '''
+    def __init__(self, address):
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.metadata = None
+        self.nextScan = None # after the first data frame
+        self.lost = 0
+
+    def recvExactly(self, n):
+        buf = bytearray(n)
+        view = memoryview(buf)
+        received = 0
+        while received < n:
+            count = self.sock.recv_into(view[received:])
+            if not count:
+                raise EOFError('The publisher closed the connection.')
+            received += count
+        return buf
+
+    def read(self):
+        '''
+        the next block of scans as (firstScan, timestamp, channel mask, scans),
+        with scans a (numScans, width) array of the announced dtype
+        '''
+        while True:
+            magic, kind, width, mask, firstScan, timestamp, numScans, size = struct.unpack(
+                FRAME_FORMAT, self.recvExactly(FRAME_SIZE))
+            if magic != MAGIC:
+                raise ValueError('Not a sample publisher stream.')
+            payload = self.recvExactly(size)
+            if kind == METADATA:
+                self.metadata = json.loads(payload.decode('utf-8'))
+                self.nextScan = None
+                continue
+            if self.nextScan is not None:
+                self.lost += firstScan - self.nextScan
+            self.nextScan = firstScan + numScans
+            scans = np.frombuffer(payload, self.metadata['dtype']).reshape(numScans, width)
+            return firstScan, timestamp, mask, scans
+
+    def __iter__(self):
+        try:
+            while True:
+                yield self.read()
+        except EOFError:
+            return
+
+    def close(self):
+        self.sock.close()
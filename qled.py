@@ -38,11 +38,11 @@ class QLED(QWidget):
     def borderRect(self):
         pixelMargin = self.dim()*(1-self.FILLFRAC)/2
         fullRect = QtCore.QRect(self.bkgUpperLeft(), QtCore.QSize(self.dim(), self.dim()))
-        return fullRect.marginsRemoved(QtCore.QMargins() + pixelMargin)
+        return fullRect.marginsRemoved(QtCore.QMargins() + round(pixelMargin))
 
     def ledRect(self, ledFrac=0.8):
         pixelMargin = self.dim()*(1-ledFrac)/2
-        return self.borderRect().marginsRemoved(QtCore.QMargins() + pixelMargin)
+        return self.borderRect().marginsRemoved(QtCore.QMargins() + round(pixelMargin))
 
     def bkgBrush(self):
         ctr = self.bkgUpperLeft() + 0.9*QtCore.QPoint(self.dim(), self.dim())
@@ -66,15 +66,36 @@ class QLED(QWidget):
         ledgrad.setColorAt(1, QtGui.QColor(*outerColor))
         return QtGui.QBrush(ledgrad)
 
-    def paintEvent(self, e):
-        painter = QtGui.QPainter(self)
+    def pixmapKey(self):
+        return 'QLED {0}x{1} {2} {3} @{4}'.format(self.width(), self.height(),
+            self.colorIdx, int(bool(self.state)), self.devicePixelRatioF())
 
+    def renderPixmap(self):
+        dpr = self.devicePixelRatioF()
+        pixmap = QtGui.QPixmap(round(self.width() * dpr), round(self.height() * dpr))
+        pixmap.setDevicePixelRatio(dpr)
+        pixmap.fill(Qt.transparent)
+
+        painter = QtGui.QPainter(pixmap)
         painter.setPen(Qt.NoPen)
         painter.setBrush(self.bkgBrush())
         painter.drawEllipse(self.borderRect())
         painter.setBrush(self.ledBrush())
         painter.drawEllipse(self.ledRect())
         painter.end()
+        return pixmap
+
+    def paintEvent(self, e):
+        # each look (size, color, state) is drawn once into the shared QPixmapCache, then blitted
+        key = self.pixmapKey()
+        pixmap = QtGui.QPixmapCache.find(key)
+        if pixmap is None:
+            pixmap = self.renderPixmap()
+            QtGui.QPixmapCache.insert(key, pixmap)
+
+        painter = QtGui.QPainter(self)
+        painter.drawPixmap(0, 0, pixmap)
+        painter.end()
 
     @property
     def state(self):
@@ -6,6 +6,8 @@ from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QCheckBox
 
 class QSwitch(QCheckBox):
+    Nsteps = 10 # animation frames per switch
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # self.setSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Preferred)
@@ -18,6 +20,7 @@ class QSwitch(QCheckBox):
         self.marginPx = 2
 
         self.frac = float(self.isChecked())
+        self.shape = None # (outerRect, cocenters, outerRadius), recomputed on resize
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.timerFcn)
 
@@ -58,21 +61,35 @@ class QSwitch(QCheckBox):
         # print(dims)
         return dims
 
-    def outerRect(self):
-        rect = QtCore.QRect(0, 0, *self.dims())
+    def computeShape(self):
+        dims = self.dims()
+        rect = QtCore.QRect(0, 0, *dims)
         rect.moveCenter(self.centerPoint())
-        return rect
-
-    def cocenters(self):
-        c = self.outerRect().center()
-        r = self.outerRadius()
+        c = rect.center()
+        r = int(min(dims)/2)
         if self.vertical:
-            return (c + QtCore.QPoint(0, r), c - QtCore.QPoint(0, r))
+            ctrs = (c + QtCore.QPoint(0, r), c - QtCore.QPoint(0, r))
         else:
-            return (c - QtCore.QPoint(r, 0), c + QtCore.QPoint(r, 0))
+            ctrs = (c - QtCore.QPoint(r, 0), c + QtCore.QPoint(r, 0))
+        return rect, ctrs, r
+
+    def resizeEvent(self, event):
+        self.shape = None
+        super().resizeEvent(event)
+
+    def getShape(self):
+        if self.shape is None:
+            self.shape = self.computeShape()
+        return self.shape
+
+    def outerRect(self):
+        return self.getShape()[0]
+
+    def cocenters(self):
+        return self.getShape()[1]
 
     def outerRadius(self):
-        return int(min(self.dims())/2)
+        return self.getShape()[2]
 
     def buttonPos(self):
         # frac = float(self.isChecked())
@@ -94,17 +111,36 @@ class QSwitch(QCheckBox):
         rect.moveCenter(c)
         return rect
 
+    def pixmapKey(self):
+        frame = round(self.frac * self.Nsteps)
+        return 'QSwitch {0}x{1} {2} {3} {4} @{5}'.format(self.width(), self.height(),
+            int(self.isChecked()), frame, int(self.vertical), self.devicePixelRatioF())
+
     def paintEvent(self, event):
-        # super().paintEvent(event)
-        # center = self.rect().center()
-        # print(self.dims())
+        # each look (size, state, animation frame) is drawn once into the shared QPixmapCache, then blitted
+        key = self.pixmapKey()
+        pixmap = QtGui.QPixmapCache.find(key)
+        if pixmap is None:
+            pixmap = self.renderPixmap()
+            QtGui.QPixmapCache.insert(key, pixmap)
+
+        painter = QtGui.QPainter(self)
+        painter.drawPixmap(0, 0, pixmap)
+        painter.end()
+
+    def renderPixmap(self):
+        dpr = self.devicePixelRatioF()
+        pixmap = QtGui.QPixmap(round(self.width() * dpr), round(self.height() * dpr))
+        pixmap.setDevicePixelRatio(dpr)
+        pixmap.fill(Qt.transparent)
 
         bkgColor = QtGui.QColor(0, 150, 200) if self.isChecked() else QtGui.QColor(200, 200, 200)
         buttonColor = QtGui.QColor(230, 230, 230)
         text = 'I' if self.isChecked() else 'O'
         textColor = QtGui.QColor(230, 230, 230) if self.isChecked() else QtGui.QColor(100, 100, 100)
 
-        painter = QtGui.QPainter(self)
+        painter = QtGui.QPainter(pixmap)
+        painter.setFont(self.font())
         painter.setBrush(bkgColor)
 
         penWidth = int(self.outerRadius()/8)
@@ -134,13 +170,13 @@ class QSwitch(QCheckBox):
         painter.drawText(self.textRect(), Qt.AlignCenter, text)
 
         painter.end()
+        return pixmap
 
     def click(self):
         self.setupTimer()
         self.timer.start(10)
 
     def setupTimer(self):
-        self.Nsteps = 10
         self.stepNumber = 0
         self.start = self.frac
         self.stop = 1.0 - self.frac
@@ -151,6 +187,7 @@ class QSwitch(QCheckBox):
         self.update()
         self.stepNumber += 1
         if self.stepNumber >= self.Nsteps:
+            self.frac = self.stop # no rounding drift across switches
             self.timer.stop()
 
 
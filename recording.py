@@ -0,0 +1,258 @@
+'''
+append-only binary recordings of acquired scans
+
+layout (all little-endian):
+    header    MAGIC, uint32 length, JSON metadata (width, dtype, plus whatever the
+              recorder was given: channels, calibration, rates, ...)
+    chunks    CHUNK_MAGIC, uint32 numScans, uint64 firstScan, float64 t0, float64 t1,
+              then numScans * width samples of dtype (row-major, one row per scan)
+              t0/t1 are the host times (time.time()) of the chunk's first/last block
+    footer    one INDEX_DTYPE record per chunk, then INDEX_MAGIC, uint64 index offset,
+              uint64 chunk count
+
+a recording without a footer (e.g. the process died) is still readable: its
+chunks are found by walking the chunk headers
+'''
+# standard imports
+import json
+import queue
+import struct
+import threading
+import time
+
+# third party imports
+import numpy as np
+
+MAGIC = b'LJREC\x00\x01\x00'
+CHUNK_MAGIC = b'CHNK'
+INDEX_MAGIC = b'LJINDEX\x00'
+
+HEADER_FORMAT = '<8sI'
+CHUNK_FORMAT = '<4sIQdd'
+TRAILER_FORMAT = '<8sQQ'
+CHUNK_SIZE = struct.calcsize(CHUNK_FORMAT)
+TRAILER_SIZE = struct.calcsize(TRAILER_FORMAT)
+
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('firstScan', '<u8'), ('numScans', '<u4'),
+    ('t0', '<f8'), ('t1', '<f8')])
+
+class RecordingError(Exception):
+    pass
+
+class Recorder(object):
+    '''
+    writes blocks of scans to a recording from a background thread
+    write() only queues the block, so it is safe to call from the acquisition loop;
+    blocks are gathered into chunks of about chunkScans scans (or chunkSeconds of data,
+    whichever comes first) and written with large buffered writes
+    '''
+    chunkScans = 65536
+    chunkSeconds = 1.0
+    bufferBytes = 4 * 2**20
+    maxQueued = 1000 # blocks; beyond this, blocks are dropped (and counted) rather than blocking
+
+    def __init__(self, path, width, dtype, metadata=None):
+        self.path = path
+        self.width = width
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.metadata = dict(metadata or {})
+        self.metadata.update({'width': width, 'dtype': self.dtype.str, 'created': time.time()})
+
+        self.blocks = queue.Queue(self.maxQueued)
+        self.index = []
+        self.scansWritten = 0
+        self.bytesWritten = 0
+        self.dropped = 0 # blocks discarded because the writer fell behind
+        self.thread = None
+
+    def start(self):
+        self.file = open(self.path, 'wb', buffering=self.bufferBytes)
+        header = json.dumps(self.metadata).encode('utf-8')
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, len(header)) + header)
+
+        self.thread = threading.Thread(target=self.run, name='Recorder', daemon=True)
+        self.thread.start()
+
+    def write(self, scans, timestamp=None):
+        '''
+        queue a block of scans (rows of width samples) acquired at timestamp (default now)
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        try:
+            self.blocks.put_nowait((np.asarray(scans, dtype=self.dtype).reshape(-1, self.width), timestamp))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        '''
+        write everything still queued plus the index, and close the file
+        '''
+        if self.thread is None:
+            return
+        self.blocks.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        pending = []
+        pendingScans = 0
+        chunkStart = None
+
+        while True:
+            try:
+                item = self.blocks.get(timeout=self.chunkSeconds)
+            except queue.Empty:
+                item = False
+
+            if item:
+                scans, timestamp = item
+                if chunkStart is None:
+                    chunkStart = time.monotonic()
+                pending.append((scans, timestamp))
+                pendingScans += len(scans)
+
+            due = chunkStart is not None and time.monotonic() - chunkStart >= self.chunkSeconds
+            if pending and (item is None or pendingScans >= self.chunkScans or due):
+                self.writeChunk(pending)
+                pending = []
+                pendingScans = 0
+                chunkStart = None
+
+            if item is None:
+                break
+
+        self.writeIndex()
+        self.file.close()
+
+    def writeChunk(self, blocks):
+        scans = np.concatenate([b for b, _ in blocks]) if len(blocks) > 1 else blocks[0][0]
+        t0, t1 = blocks[0][1], blocks[-1][1]
+
+        offset = self.file.tell()
+        self.file.write(struct.pack(CHUNK_FORMAT, CHUNK_MAGIC, len(scans), self.scansWritten, t0, t1))
+        self.file.write(np.ascontiguousarray(scans).tobytes())
+
+        self.index.append((offset, self.scansWritten, len(scans), t0, t1))
+        self.scansWritten += len(scans)
+        self.bytesWritten = self.file.tell()
+
+    def writeIndex(self):
+        index = np.array(self.index, dtype=INDEX_DTYPE)
+        offset = self.file.tell()
+        self.file.write(index.tobytes())
+        self.file.write(struct.pack(TRAILER_FORMAT, INDEX_MAGIC, offset, len(index)))
+
+class Recording(object):
+    '''
+    read access to a recording: metadata, the chunk index, and scans by
+    scan number or host time range, reading only the chunks involved
+    with mmap, chunks are returned as read-only views of the memory-mapped file,
+    so opening is instant and only the pages actually read are loaded
+    '''
+    def __init__(self, path, mmap=False):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = None
+
+        magic, length = struct.unpack(HEADER_FORMAT, self.file.read(struct.calcsize(HEADER_FORMAT)))
+        if magic != MAGIC:
+            raise RecordingError('{} is not a recording.'.format(path))
+        self.metadata = json.loads(self.file.read(length).decode('utf-8'))
+        self.dataStart = self.file.tell()
+
+        self.width = self.metadata['width']
+        self.dtype = np.dtype(self.metadata['dtype'])
+        self.index = self.readIndex()
+
+        if mmap:
+            self.map = np.memmap(self.file, dtype=np.uint8, mode='r')
+
+    def close(self):
+        self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        if not len(self.index):
+            return 0
+        return int(self.index['firstScan'][-1] + self.index['numScans'][-1])
+
+    def readIndex(self):
+        self.file.seek(0, 2)
+        size = self.file.tell()
+        if size - self.dataStart >= TRAILER_SIZE:
+            self.file.seek(size - TRAILER_SIZE)
+            magic, offset, count = struct.unpack(TRAILER_FORMAT, self.file.read(TRAILER_SIZE))
+            if magic == INDEX_MAGIC:
+                self.dataEnd = offset
+                self.file.seek(offset)
+                return np.frombuffer(self.file.read(count * INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)
+        return self.rebuildIndex(size)
+
+    def rebuildIndex(self, size):
+        # no footer: walk the chunk headers, ignoring a truncated final chunk
+        index = []
+        offset = self.dataStart
+        rowBytes = self.width * self.dtype.itemsize
+        while offset + CHUNK_SIZE <= size:
+            self.file.seek(offset)
+            magic, numScans, firstScan, t0, t1 = struct.unpack(CHUNK_FORMAT, self.file.read(CHUNK_SIZE))
+            end = offset + CHUNK_SIZE + numScans * rowBytes
+            if magic != CHUNK_MAGIC or end > size:
+                break
+            index.append((offset, firstScan, numScans, t0, t1))
+            offset = end
+        self.dataEnd = offset
+        return np.array(index, dtype=INDEX_DTYPE)
+
+    def readChunk(self, k):
+        entry = self.index[k]
+        start = int(entry['offset']) + CHUNK_SIZE
+        count = int(entry['numScans']) * self.width
+        if self.map is not None:
+            data = self.map[start:start + count * self.dtype.itemsize].view(self.dtype)
+        else:
+            self.file.seek(start)
+            data = np.fromfile(self.file, dtype=self.dtype, count=count)
+        return data.reshape(-1, self.width)
+
+    def read(self, firstScan, numScans):
+        '''
+        scans [firstScan, firstScan + numScans), clipped to what was recorded
+        '''
+        stop = min(firstScan + numScans, len(self))
+        if stop <= firstScan:
+            return np.zeros((0, self.width), dtype=self.dtype)
+
+        starts = self.index['firstScan']
+        first = int(np.searchsorted(starts, firstScan, side='right')) - 1
+        last = int(np.searchsorted(starts, stop, side='left'))
+        blocks = []
+        for k in range(first, last):
+            # slice before concatenating, so only the requested scans are copied
+            start = int(starts[k])
+            blocks.append(self.readChunk(k)[max(firstScan - start, 0):stop - start])
+        return np.concatenate(blocks)
+
+    def chunksBetween(self, t0, t1):
+        # indices of chunks whose host time span overlaps [t0, t1]
+        first = int(np.searchsorted(self.index['t1'], t0, side='left'))
+        last = int(np.searchsorted(self.index['t0'], t1, side='right'))
+        return range(first, last)
+
+    def readTimeRange(self, t0, t1):
+        '''
+        (firstScan, scans) for every chunk overlapping host times [t0, t1]
+        (chunk resolution; use scan times from the metadata to trim further)
+        '''
+        chunks = self.chunksBetween(t0, t1)
+        if not len(chunks):
+            return 0, np.zeros((0, self.width), dtype=self.dtype)
+        firstScan = int(self.index['firstScan'][chunks[0]])
+        return firstScan, np.concatenate([self.readChunk(k) for k in chunks])
@@ -0,0 +1,202 @@
+'''
+replay of recordings (see recording.py) through a virtual, read-only U3
+'''
+# standard imports
+import time
+import weakref
+from time import perf_counter
+
+# third party imports
+import numpy as np
+
+from recording import Recording, RecordingError
+from labjack import MyU3, NUM_CHANNELS
+
+class ReplayDevice(MyU3):
+    '''
+    plays a recording back through the same surface as an open MyU3, so it can be
+    handed to LabjackApp, AcquisitionWorker and StreamReader in place of a device
+        - polling (scanInputs) returns the recorded inputs at the current playback time
+        - streaming (streamData) yields the recorded scans as playback time passes them
+    playback runs at speed times real time, wrapping around at the end with loop
+    the recording is memory-mapped, so only the scans being played are ever read
+    the channel configuration is the recorded one; writes are ignored
+    '''
+    blockInterval = 0.01 # s, wall time between stream blocks
+    isReplay = True
+
+    def __init__(self, path, speed=1.0, loop=True):
+        self.recording = Recording(path, mmap=True)
+        if not len(self.recording):
+            raise RecordingError('{} contains no scans.'.format(path))
+
+        metadata = self.recording.metadata
+        self.mode = metadata['mode']
+        if self.mode not in ('stream', 'poll'):
+            raise RecordingError('{0} is not a recording of scans (it records {1}).'.format(path, self.mode))
+        self.loop = loop
+
+        self.properties = dict(metadata.get('device', {}))
+        self.properties['Replay'] = path
+        self.isHV = self.properties.get('DeviceName', 'U3-HV').endswith('HV')
+
+        io = metadata['io']
+        self.analogBits = io['FIOAnalog'] | io['EIOAnalog'] << 8
+        self.dirBits = io['FIODirection'] | io['EIODirection'] << 8 | io['CIODirection'] << 16
+        self.stateBits = io['FIOState'] | io['EIOState'] << 8 | io['CIOState'] << 16
+        self.pendingWrites = {}
+
+        self.handle = None
+        self.serial = None
+        self.ledState = False
+        self.streamConfiged = False
+        self.streamStarted = False
+
+        if self.mode == 'stream':
+            self.scanFrequency = metadata['scanFrequency']
+            self.channels = metadata['streamChannels']
+            self.states = [tuple(state) for state in metadata['states']]
+            self.calibration = dict(zip(self.channels, zip(metadata['slopes'], metadata['offsets'])))
+            self.duration = len(self.recording) / float(self.scanFrequency)
+        else:
+            # poll rows are (time, channel values...); the time each chunk starts locates a row
+            self.scanFrequency = None
+            self.chunkTimes = np.array([self.recording.readChunk(k)[0, 0]
+                for k in range(len(self.recording.index))])
+            lastTime = self.recording.read(len(self.recording) - 1, 1)[0, 0]
+            self.duration = lastTime - self.chunkTimes[0]
+
+        # playback time = origin + (perf_counter() - clock) * speed
+        self.timebase = (perf_counter(), 0.0, speed)
+
+        self.instances.append(weakref.ref(self))
+
+    # -------------------- DEVICE OPEN/CLOSE METHODS --------------------
+
+    def open(self):
+        pass
+
+    def close(self):
+        if self.is_open():
+            self.streamStarted = False
+            self.recording.close()
+            self.recording = None
+
+    def is_open(self):
+        return self.recording is not None
+
+    # -------------------- PLAYBACK --------------------
+
+    def setSpeed(self, speed):
+        # continue from the current position at the new speed
+        clock, origin, oldSpeed = self.timebase
+        now = perf_counter()
+        self.timebase = (now, origin + (now - clock) * oldSpeed, speed)
+
+    def playbackTime(self, wrap=True):
+        '''
+        seconds into the recording now playing
+        without wrap, keeps counting across loops (for continuous stream positions)
+        '''
+        clock, origin, speed = self.timebase
+        t = origin + (perf_counter() - clock) * speed
+        if not self.loop:
+            return min(t, self.duration)
+        if wrap and self.duration > 0:
+            return t % self.duration
+        return t
+
+    def readScans(self, start, stop):
+        # scans [start, stop) of the recording repeated end to end
+        total = len(self.recording)
+        blocks = []
+        while start < stop:
+            first = start % total
+            count = min(stop - start, total - first)
+            blocks.append(self.recording.read(first, count))
+            start += count
+        return np.concatenate(blocks)
+
+    def pollRowAt(self, t):
+        t += self.chunkTimes[0]
+        k = max(int(np.searchsorted(self.chunkTimes, t, side='right')) - 1, 0)
+        chunk = self.recording.readChunk(k)
+        i = max(int(np.searchsorted(chunk[:, 0], t, side='right')) - 1, 0)
+        return chunk[i]
+
+    # -------------------- DEVICE SURFACE --------------------
+
+    def toggleLED(self):
+        self.ledState = not self.ledState
+
+    def resync(self):
+        return []
+
+    def _queue_write(self, channelNum, field, value):
+        self.alert('Replays are read-only; change to channel {} ignored.'.format(channelNum))
+
+    def getCalibratedSlopeOffset(self, isLowVoltage=True, isSingleEnded=True, isSpecialSetting=False, channelNumber=0):
+        return self.calibration[channelNumber]
+
+    def binaryToCalibratedAnalogVoltage(self, bits, isLowVoltage=True, isSingleEnded=True, isSpecialSetting=False, channelNumber=0):
+        slope, offset = self.calibration[channelNumber]
+        return slope * bits + offset
+
+    def compileScan(self, states=None, writes=()):
+        return None
+
+    def scanInputs(self, packets=None):
+        '''
+        inputs dict (as MyU3.scanInputs) recorded at the current playback time
+        '''
+        t = self.playbackTime()
+        if self.mode == 'stream':
+            k = min(int(t * self.scanFrequency), len(self.recording) - 1)
+            return self.decodeScan(self.channels, self.recording.read(k, 1)[0], self.states)
+
+        row = self.pollRowAt(t)
+        inputs = {}
+        for channelNum in range(NUM_CHANNELS):
+            val = row[channelNum + 1]
+            if val == val:
+                inputs[channelNum] = float(val) if (self.analogBits >> channelNum) & 1 else bool(val)
+        return inputs
+
+    # -------------------- STREAM COMMANDS --------------------
+
+    def configStream(self, scanFrequency, states=None):
+        if self.mode != 'stream':
+            raise RecordingError('Polled recordings can only be replayed by polling.')
+        if scanFrequency != self.scanFrequency:
+            self.alert('Replaying at the recorded {} Hz.'.format(self.scanFrequency))
+        self.streamConfiged = True
+        return list(self.channels)
+
+    def streamStart(self):
+        self.streamPosition = int(self.playbackTime(wrap=False) * self.scanFrequency)
+        self.streamStarted = True
+
+    def streamStop(self):
+        self.streamStarted = False
+
+    def streamData(self, convert=False):
+        '''
+        blocks of recorded scans paced by the playback clock, like the device's
+        streamData(convert=False) but with result holding the scans themselves
+        yields None while there is nothing new (e.g. at the end without loop)
+        '''
+        while self.streamStarted:
+            time.sleep(self.blockInterval)
+            stop = int(self.playbackTime(wrap=False) * self.scanFrequency)
+            if not self.loop:
+                stop = min(stop, len(self.recording))
+            if stop <= self.streamPosition:
+                yield None
+                continue
+
+            scans = self.readScans(self.streamPosition, stop)
+            self.streamPosition = stop
+            yield dict(numPackets=1, result=scans, errors=0, missed=0, firstPacket=0)
+
+    def streamSamples(self, result):
+        return np.asarray(result, dtype=np.uint16).ravel()
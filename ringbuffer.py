@@ -0,0 +1,70 @@
+# standard imports
+import threading
+
+# third party imports
+import numpy as np
+
+class RingBuffer(object):
+    '''
+    fixed-capacity buffer of rows (e.g. one row per scan, one column per channel)
+        - write() appends rows, overwriting the oldest ones once full
+        - latest() returns the most recent rows (for display)
+        - readNew() returns every row written since its last call (for consumers
+          that must see all data); rows overwritten before being read are counted
+          in overflows
+    safe to write from one thread while reading from another
+    '''
+    def __init__(self, capacity, width, dtype=np.float64):
+        self.capacity = int(capacity)
+        self.width = width
+        self.data = np.zeros((self.capacity, width), dtype=dtype)
+
+        self.written = 0 # total rows ever written
+        self.readPosition = 0 # total rows consumed by readNew
+        self.overflows = 0 # rows lost before readNew reached them
+
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def write(self, rows):
+        rows = np.asarray(rows, dtype=self.data.dtype).reshape(-1, self.width)
+        n = len(rows)
+        with self.lock:
+            if n > self.capacity:
+                rows = rows[-self.capacity:]
+            start = (self.written + n - len(rows)) % self.capacity
+            first = min(len(rows), self.capacity - start)
+            self.data[start:start+first] = rows[:first]
+            self.data[:len(rows)-first] = rows[first:]
+            self.written += n
+
+    def _rows(self, start, stop, columns=None):
+        # copy of rows with absolute indices [start, stop), which must still be in the buffer
+        idx = np.arange(start, stop) % self.capacity
+        if columns is None:
+            return self.data[idx]
+        return self.data[np.ix_(idx, columns)]
+
+    def latest(self, n=1, columns=None):
+        return self.latestIndexed(n, columns)[1]
+
+    def latestIndexed(self, n=1, columns=None):
+        '''
+        (absolute index of the first row returned, the newest n rows)
+        optionally restricted to a list of columns, which avoids copying the rest
+        '''
+        with self.lock:
+            n = min(n, len(self))
+            return self.written - n, self._rows(self.written - n, self.written, columns)
+
+    def readNew(self):
+        with self.lock:
+            oldest = self.written - len(self)
+            if self.readPosition < oldest:
+                self.overflows += oldest - self.readPosition
+                self.readPosition = oldest
+            rows = self._rows(self.readPosition, self.written)
+            self.readPosition = self.written
+            return rows
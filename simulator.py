@@ -0,0 +1,262 @@
+'''
+simulated U3 for running and measuring the application without hardware
+'''
+# standard imports
+import math
+import time
+from time import perf_counter
+
+# third party imports
+import numpy as np
+from LabJackPython import LabJackException, MAX_USB_PACKET_LENGTH
+
+from labjack import MyU3, STREAM_FIO_EIO, STREAM_CIO
+
+# representative U3-HV calibration constants
+CALDATA = {
+    'lvSESlope': 3.7231e-05, 'lvSEOffset': 0.0,
+    'lvDiffSlope': 7.4463e-05, 'lvDiffOffset': -2.44,
+    'vRefAtCAl': 2.44,
+    'hvAIN0Slope': 3.14e-04, 'hvAIN1Slope': 3.14e-04, 'hvAIN2Slope': 3.14e-04, 'hvAIN3Slope': 3.14e-04,
+    'hvAIN0Offset': -10.3, 'hvAIN1Offset': -10.3, 'hvAIN2Offset': -10.3, 'hvAIN3Offset': -10.3,
+}
+
+MAX_STREAM_RATE = 50000 # samples/s, all channels together
+STREAM_BUFFER_SAMPLES = 984 # device-side buffer; older samples are lost once it fills
+
+class LatencyModel(object):
+    '''
+    time taken by a simulated transaction: a fixed USB round trip, plus a
+    per-byte transfer time, plus the conversion time of each AIN it contains
+    defaults are in the range measured for a U3 on a full-speed USB port
+    '''
+    def __init__(self, roundTrip=0.0006, perByte=0.0, perAIN=0.00012):
+        self.roundTrip = roundTrip
+        self.perByte = perByte
+        self.perAIN = perAIN
+
+    def feedback(self, sendLen, readLen, numAIN):
+        return self.roundTrip + self.perByte * (sendLen + readLen) + self.perAIN * numAIN
+
+    def control(self):
+        # configU3, configIO, stream control
+        return self.roundTrip
+
+class SimulatedU3(MyU3):
+    '''
+    MyU3 with the USB transport replaced by a model of the device
+        - getFeedback, configIO, configU3 and the stream calls are answered from
+          simulated registers, with the same packet-size limits as the driver
+        - each transaction sleeps for the time given by latency (a LatencyModel)
+        - inputs follow deterministic functions of time (or scan number when
+          streaming): AINn is a sine of (n + 1) / 2 Hz, and digital inputs count
+          in binary at 2 Hz (channel i is bit i % 8)
+    transactions counts device round trips
+    '''
+    firstSerial = 320000001
+
+    def __init__(self, isHV=True, serialNumber=firstSerial, latency=None):
+        self.simulatedHV = isHV
+        self.latency = latency if latency is not None else LatencyModel()
+        self.transactions = 0
+        self.opened = False
+        self.clock = perf_counter()
+
+        # device registers: bitfields over channel number
+        self.fixedAnalog = 0x0f if isHV else 0 # AIN0-3 of a U3-HV are analog only
+        self.deviceAnalog = self.fixedAnalog
+        self.deviceDir = 0
+        self.deviceState = 0xfffff # inputs float high
+        self.deviceLED = True
+
+        MyU3.__init__(self, serial=serialNumber)
+
+    # -------------------- DEVICE OPEN/CLOSE METHODS --------------------
+
+    def check_connected(self):
+        pass
+
+    def open(self):
+        if not self.is_open():
+            self.opened = True
+
+    def close(self):
+        self.opened = False
+
+    def is_open(self):
+        return self.opened
+
+    # -------------------- SIMULATED SIGNALS --------------------
+
+    def now(self):
+        return perf_counter() - self.clock
+
+    @staticmethod
+    def analogCode(channelNum, t):
+        # raw 16-bit code, mid-scale +/- 40%
+        return 32768 + 26214 * np.sin(math.pi * (channelNum + 1) * t)
+
+    @staticmethod
+    def inputBits(t):
+        count = int(t * 2) & 0xff
+        return count | count << 8 | (count & 0x0f) << 16
+
+    def portBits(self, t):
+        # outputs read back their latch, inputs their (simulated) external level
+        return (self.deviceState & self.deviceDir) | (self.inputBits(t) & ~self.deviceDir)
+
+    def wait(self, seconds):
+        self.transactions += 1
+        if seconds > 0:
+            time.sleep(seconds)
+
+    # -------------------- TRANSPORT --------------------
+
+    def getCalibrationData(self):
+        self.calData = dict(CALDATA)
+        return self.calData
+
+    def configU3(self, **kwargs):
+        self.wait(self.latency.control())
+        return {
+            'DeviceName': 'U3-HV' if self.simulatedHV else 'U3-LV',
+            'SerialNumber': self.serial,
+            'ProductID': 3,
+            'FirmwareVersion': '1.46',
+            'HardwareVersion': '1.30',
+            'LocalID': 1,
+            'FIOAnalog': self.deviceAnalog & 0xff,
+            'EIOAnalog': (self.deviceAnalog >> 8) & 0xff,
+        }
+
+    def configIO(self, FIOAnalog=None, EIOAnalog=None, **kwargs):
+        self.wait(self.latency.control())
+        if FIOAnalog is not None:
+            self.deviceAnalog = (self.deviceAnalog & ~0xff) | FIOAnalog | self.fixedAnalog
+        if EIOAnalog is not None:
+            self.deviceAnalog = (self.deviceAnalog & ~0xff00) | EIOAnalog << 8
+        return {'FIOAnalog': self.deviceAnalog & 0xff, 'EIOAnalog': (self.deviceAnalog >> 8) & 0xff}
+
+    def getFeedback(self, *commandlist):
+        sendLen, readLen = self._packet_lengths(commandlist)
+        if sendLen > MAX_USB_PACKET_LENGTH:
+            raise LabJackException('ERROR: The Feedback command you are attempting to send is bigger than 64 bytes ( %s bytes ).' % sendLen)
+        if readLen > MAX_USB_PACKET_LENGTH:
+            raise LabJackException('ERROR: The Feedback command you are attempting to send would yield a response that is greater than 64 bytes ( %s bytes ).' % readLen)
+
+        t = self.now()
+        results = []
+        numAIN = 0
+        for cmd in commandlist:
+            code, args = cmd.cmdBytes[0], cmd.cmdBytes[1:]
+            if code == 1: # AIN
+                numAIN += 1
+                value = int(self.analogCode(args[0] & 0x1f, t))
+                response = [value & 0xff, value >> 8]
+            elif code == 9: # LED
+                self.deviceLED = bool(args[0])
+                response = []
+            elif code in (10, 12): # BitStateRead, BitDirRead
+                bits = self.portBits(t) if code == 10 else self.deviceDir
+                response = [(bits >> args[0]) & 1]
+            elif code in (11, 13): # BitStateWrite, BitDirWrite
+                bit, value = args[0] & 0x1f, args[0] >> 7
+                if code == 11:
+                    self.deviceState = self.set_bit(self.deviceState, bit, value)
+                else:
+                    self.deviceDir = self.set_bit(self.deviceDir, bit, value)
+                response = []
+            elif code in (26, 28): # PortStateRead, PortDirRead
+                bits = self.portBits(t) if code == 26 else self.deviceDir
+                response = list(self.port_bytes(bits))
+            elif code in (27, 29): # PortStateWrite, PortDirWrite
+                mask = self.port_bits(dict(zip(['FIO', 'EIO', 'CIO'], args[0:3])))
+                value = self.port_bits(dict(zip(['FIO', 'EIO', 'CIO'], args[3:6])))
+                if code == 27:
+                    self.deviceState = (self.deviceState & ~mask) | (value & mask)
+                else:
+                    self.deviceDir = (self.deviceDir & ~mask) | (value & mask)
+                response = []
+            else:
+                raise LabJackException('Feedback command {} is not simulated.'.format(cmd))
+            results.append(cmd.handle(response) if cmd.readLen else None)
+
+        self.wait(self.latency.feedback(sendLen, readLen, numAIN))
+        return results
+
+    # -------------------- STREAM --------------------
+
+    def streamConfig(self, NumChannels=1, SamplesPerPacket=25, PChannels=[30], NChannels=[31], ScanFrequency=None, **kwargs):
+        if len(PChannels) != NumChannels:
+            raise LabJackException("Length of PChannels didn't match NumChannels")
+        if ScanFrequency * NumChannels > MAX_STREAM_RATE:
+            raise LabJackException('Stream rate {} samples/s exceeds the maximum of {}.'.format(
+                ScanFrequency * NumChannels, MAX_STREAM_RATE))
+        self.wait(self.latency.control())
+
+        self.streamChannelNumbers = list(PChannels)
+        self.streamNegChannels = list(NChannels)
+        self.streamSamplesPerPacket = SamplesPerPacket
+        self.streamScanFrequency = ScanFrequency
+        self.packetsPerRequest = min(48, max(1, int(ScanFrequency * NumChannels / SamplesPerPacket)))
+        self.streamConfiged = True
+
+    def streamStart(self):
+        if not self.streamConfiged:
+            raise LabJackException('Stream must be configured before starting.')
+        self.wait(self.latency.control())
+        self.streamClock = perf_counter()
+        self.streamSample = 0 # next sample the device will send
+        self.streamStarted = True
+
+    def streamStop(self):
+        self.wait(self.latency.control())
+        self.streamStarted = False
+
+    def streamSampleCodes(self, first, count):
+        # codes for samples [first, first + count) of the stream, in acquisition order
+        channels = np.array(self.streamChannelNumbers)
+        index = np.arange(first, first + count)
+        channelOf = channels[index % len(channels)]
+        t = (index // len(channels)) / float(self.streamScanFrequency)
+
+        codes = np.empty(count, dtype='<u2')
+        for channel in set(channels.tolist()):
+            mask = channelOf == channel
+            if channel == STREAM_FIO_EIO:
+                codes[mask] = [self.portBits(s) & 0xffff for s in t[mask]]
+            elif channel == STREAM_CIO:
+                codes[mask] = [(self.portBits(s) >> 16) & 0x0f for s in t[mask]]
+            else:
+                codes[mask] = self.analogCode(channel, t[mask])
+        return codes
+
+    def streamData(self, convert=False):
+        '''
+        raw blocks as from the driver's streamData(convert=False): packetsPerRequest
+        packets of SamplesPerPacket samples, each framed by a 12-byte header and
+        2 trailing bytes, released as the scan clock produces them
+        '''
+        samplesPerPacket = self.streamSamplesPerPacket
+        blockSamples = samplesPerPacket * self.packetsPerRequest
+        sampleRate = self.streamScanFrequency * len(self.streamChannelNumbers)
+
+        while self.streamStarted:
+            produced = int((perf_counter() - self.streamClock) * sampleRate)
+            if produced - self.streamSample < blockSamples:
+                time.sleep(max((self.streamSample + blockSamples - produced) / sampleRate, 0))
+                produced = int((perf_counter() - self.streamClock) * sampleRate)
+
+            # the device buffer holds a limited backlog; anything older is lost
+            missed = max(0, produced - self.streamSample - blockSamples - STREAM_BUFFER_SAMPLES)
+            missed -= missed % samplesPerPacket
+            self.streamSample += missed
+
+            codes = self.streamSampleCodes(self.streamSample, blockSamples)
+            self.streamSample += blockSamples
+            self.transactions += 1
+
+            packets = np.zeros((self.packetsPerRequest, 14 + 2 * samplesPerPacket), dtype=np.uint8)
+            packets[:, 12:-2] = codes.view(np.uint8).reshape(self.packetsPerRequest, -1)
+            yield dict(numPackets=self.packetsPerRequest, result=packets.tobytes(),
+                errors=0, missed=missed, firstPacket=0)
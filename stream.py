@@ -0,0 +1,169 @@
+# standard imports
+from time import perf_counter
+
+# third party imports
+import numpy as np
+
+from ringbuffer import RingBuffer
+from calibration import Calibration
+from channels import STREAM_FIO_EIO, STREAM_CIO, acquiredStates
+
+class StreamReader(object):
+    '''
+    hardware-timed acquisition of every input channel of a MyU3
+    raw 16-bit codes are kept in a RingBuffer, one row per scan and one column
+    per stream channel (see MyU3.streamChannelList)
+    inputs limits acquisition to those channel numbers (default: every input)
+    '''
+    def __init__(self, myu3instance, scanFrequency=1000, bufferSeconds=10, inputs=None):
+        self.myu3instance = myu3instance
+        self.scanFrequency = scanFrequency
+        self.bufferSeconds = bufferSeconds
+        self.inputs = inputs
+
+        self.running = False
+        self.buffer = None
+
+        # counters
+        self.packets = 0 # USB packets received
+        self.errors = 0 # packets flagged with an error by the device
+        self.missed = 0 # samples the device dropped because its buffer overflowed
+
+    def start(self):
+        self.states = self.myu3instance.getIOstates()
+        if self.inputs is not None:
+            self.states = acquiredStates(self.states, self.inputs)
+        self.channels = self.myu3instance.configStream(self.scanFrequency, self.states)
+        self.calibration = Calibration(self.myu3instance, self.channels)
+
+        capacity = max(1, int(self.scanFrequency * self.bufferSeconds))
+        self.buffer = RingBuffer(capacity, len(self.channels), np.uint16)
+        self.leftover = np.zeros(0, dtype=np.uint16) # a partial scan, starting at a scan boundary
+        self.sampleIndex = 0 # of the next sample streamed, counting the missed ones
+        self.nextScan = 0 # index of the scan after the last one read, counting the missed ones
+
+        self.myu3instance.streamStart()
+        self.startTime = perf_counter() # host time of the first scan
+        self.blocks = self.myu3instance.streamData(convert=False)
+        self.running = True
+
+    def stop(self):
+        # the read loop notices on its next block and stops the stream itself
+        self.running = False
+
+    def readBlock(self):
+        '''
+        read the next block from the device into the buffer (blocks on USB)
+        returns the complete scans added (raw codes, one row per scan)
+        '''
+        block = next(self.blocks)
+        if block is None:
+            return self.buffer.data[:0]
+        return self.addBlock(block)
+
+    def stopStream(self):
+        self.running = False
+        self.blocks.close()
+        if self.myu3instance.is_open():
+            self.myu3instance.streamStop()
+
+    def run(self):
+        '''
+        read stream blocks into the buffer until stop() is called
+        (blocks, so call from a worker thread after start())
+        '''
+        try:
+            while self.running:
+                self.readBlock()
+        finally:
+            self.stopStream()
+
+    def addBlock(self, block):
+        self.packets += block['numPackets']
+        self.errors += block['errors']
+        self.missed += block['missed']
+
+        # packets need not end on a scan boundary, so carry partial scans over
+        samples = self.myu3instance.streamSamples(block['result'])
+        numChannels = len(self.channels)
+        if block['missed']:
+            # the partial scan lost its end, and this block may start mid-scan
+            self.leftover = self.leftover[:0]
+            self.sampleIndex += block['missed']
+        skip = 0 if len(self.leftover) else min(-self.sampleIndex % numChannels, len(samples))
+        self.sampleIndex += len(samples)
+        samples = samples[skip:]
+        if len(self.leftover):
+            samples = np.concatenate((self.leftover, samples))
+        numScans = len(samples) // numChannels
+        self.leftover = samples[numScans*numChannels:]
+
+        scans = samples[:numScans*numChannels].reshape(numScans, numChannels)
+        self.nextScan = (self.sampleIndex - len(self.leftover)) // numChannels
+        self.buffer.write(scans)
+        return scans
+
+    @property
+    def overflows(self):
+        # scans overwritten in the ring buffer before they were read
+        return self.buffer.overflows if self.buffer is not None else 0
+
+    def metadata(self):
+        # description of the buffered columns, e.g. for a recording header
+        return {
+            'mode': 'stream',
+            'scanFrequency': self.scanFrequency,
+            'streamChannels': self.channels,
+            'slopes': self.calibration.slopes.tolist(),
+            'offsets': self.calibration.offsets.tolist(),
+            'states': self.states,
+        }
+
+    def latestVolts(self, n):
+        '''
+        the newest n scans (or fewer, if not yet acquired) converted to volts
+        digital port columns hold the raw port word
+        '''
+        return self.calibration.toVolts(self.buffer.latest(n))
+
+    def channelHistory(self, channels, n):
+        '''
+        the newest n scans as (times, {channelNum: values}) for each of channels
+        that is being acquired: analog in volts, digital as 0/1
+        times are in seconds since the stream started
+        '''
+        columns = []
+        for channelNum in channels:
+            if channelNum in self.channels:
+                columns.append(self.channels.index(channelNum))
+            elif not self.states[channelNum][1]:
+                port = STREAM_FIO_EIO if channelNum < 16 else STREAM_CIO
+                columns.append(self.channels.index(port))
+            else:
+                columns.append(None) # an output, so not streamed
+
+        used = sorted(set([k for k in columns if k is not None]))
+        first, codes = self.buffer.latestIndexed(n, used)
+        times = (first + np.arange(len(codes))) / float(self.scanFrequency)
+
+        history = {}
+        for channelNum, k in zip(channels, columns):
+            if k is None:
+                continue
+            col = codes[:, used.index(k)]
+            if self.calibration.isAnalog[k]:
+                history[channelNum] = col * self.calibration.slopes[k] + self.calibration.offsets[k]
+            else:
+                history[channelNum] = ((col >> (channelNum % 16)) & 1).astype(float)
+
+        return times, history
+
+    def latestInputs(self):
+        '''
+        inputs dict (as MyU3.scanInputs) from the newest scan read since the last call
+        returns an empty dict if no new scan has arrived
+        '''
+        scans = self.buffer.readNew()
+        if not len(scans):
+            return {}
+        return self.myu3instance.decodeScan(self.channels, scans[-1], self.states)
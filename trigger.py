@@ -0,0 +1,294 @@
+'''
+triggered capture: acquired blocks are kept in a pre-trigger ring buffer and
+checked against a trigger; when it fires, preScans scans before the trigger
+and postScans from it on are saved as a recording (which replays in the GUI)
+
+triggers are written like 'FIO4 rising', 'AIN0 falling 1.5', 'AIN2 > 0.8 & EIO1 high'
+or 'CIO0 either | AIN1 rising 2.5':
+    - FIOn, EIOn, CIOn rising|falling|either: an edge on that digital input
+    - FIOn, EIOn, CIOn high|low: while that digital input is at that level
+    - AINn rising|falling|either LEVEL: the analog input crossing LEVEL (volts)
+    - AINn > LEVEL, AINn < LEVEL: while the analog input is above/below LEVEL
+    - A & B: at a scan where both hold; A | B: where either does (& binds first)
+      each side of a | needs an edge; levels only qualify it
+every condition is evaluated over a whole block at once, with the last scan of
+the previous block carried over so edges between blocks are not missed
+'''
+# standard imports
+import os
+import queue
+import threading
+import time
+
+# third party imports
+import numpy as np
+
+from ringbuffer import RingBuffer
+from recording import Recorder
+from channels import STREAM_FIO_EIO, STREAM_CIO
+
+DIGITAL_PORTS = {'FIO': 0, 'EIO': 8, 'CIO': 16}
+EDGES = ('rising', 'falling', 'either')
+LEVELS = {'high': True, 'low': False, '>': True, '<': False}
+
+class Condition(object):
+    '''
+    one term of a trigger: an edge (kind in EDGES) or a level (kind in LEVELS)
+    of channelNum, with level in volts for analog inputs
+    '''
+    def __init__(self, text, channelNum, isAnalog, kind, level=None):
+        self.text = text
+        self.channelNum = channelNum
+        self.isAnalog = isAnalog
+        self.kind = kind
+        self.level = level
+
+    def evaluate(self, values):
+        '''
+        values: the channel over the block, preceded by the scan before it
+        returns a boolean array, True at each scan of the block where the condition holds
+        '''
+        if self.isAnalog:
+            state = values >= self.level # NaN (not acquired) compares False
+        else:
+            state = values
+        prev, cur = state[:-1], state[1:]
+        if self.kind == 'rising':
+            return ~prev & cur
+        elif self.kind == 'falling':
+            return prev & ~cur
+        elif self.kind == 'either':
+            return prev != cur
+        return cur if LEVELS[self.kind] else ~cur
+
+class Trigger(object):
+    '''
+    any of several groups of conditions, each firing where all its conditions hold
+    '''
+    def __init__(self, text, groups):
+        self.text = text
+        self.groups = groups
+
+    def conditions(self):
+        return [condition for group in self.groups for condition in group]
+
+    def evaluate(self, columns, scans, previous):
+        '''
+        boolean array, True at each scan of scans (a block as read from columns)
+        where the trigger fires; previous is the scan before the block (or None)
+        '''
+        extended = scans if previous is None else np.concatenate((previous[None], scans))
+        values = {}
+        fired = np.zeros(len(scans), dtype=bool)
+        for group in self.groups:
+            holds = np.ones(len(scans), dtype=bool)
+            for condition in group:
+                key = (condition.channelNum, condition.isAnalog)
+                if key not in values:
+                    values[key] = columns.values(extended, *key)
+                    if previous is None: # no scan before the first: repeat it (no edge)
+                        values[key] = np.concatenate((values[key][:1], values[key]))
+                holds &= condition.evaluate(values[key])
+            fired |= holds
+        return fired
+
+def parseCondition(text):
+    words = text.split()
+    if len(words) not in (2, 3):
+        raise ValueError('Invalid trigger condition {}.'.format(text))
+    name, kind = words[0].upper(), words[1].lower()
+    port, number = name[:3], name[3:]
+    if not number.isdigit():
+        raise ValueError('Unknown channel {}.'.format(words[0]))
+    number = int(number)
+
+    if port == 'AIN':
+        if number >= 16 or kind not in EDGES + ('>', '<') or len(words) != 3:
+            raise ValueError("Invalid trigger condition {}: expected e.g. 'AIN0 rising 1.5' or 'AIN0 > 1.5'.".format(text))
+        return Condition(text, number, True, kind, float(words[2]))
+    if port in DIGITAL_PORTS:
+        if number >= (4 if port == 'CIO' else 8) or kind not in EDGES + ('high', 'low') or len(words) != 2:
+            raise ValueError("Invalid trigger condition {}: expected e.g. 'FIO4 rising' or 'FIO4 high'.".format(text))
+        return Condition(text, DIGITAL_PORTS[port] + number, False, kind)
+    raise ValueError('Unknown channel {}.'.format(words[0]))
+
+def parseTrigger(text):
+    '''
+    Trigger of a description like 'AIN0 rising 1.5 & FIO4 high | CIO1 falling'
+    (see the module docstring); raises ValueError if it is not one
+    '''
+    groups = []
+    for group in text.split('|'):
+        conditions = [parseCondition(term.strip()) for term in group.split('&')]
+        if not any(condition.kind in EDGES for condition in conditions):
+            # levels only qualify an edge; alone they would hold at every scan
+            raise ValueError('{} has no edge to trigger on.'.format(group.strip()))
+        groups.append(conditions)
+    return Trigger(text.strip(), groups)
+
+class StreamColumns(object):
+    '''
+    channel values in blocks of raw stream codes (one column per stream channel)
+    '''
+    def __init__(self, channels, calibration):
+        self.channels = list(channels)
+        self.calibration = calibration
+
+    def check(self, trigger):
+        # raise ValueError if the stream does not acquire a trigger channel as needed
+        for condition in trigger.conditions():
+            self.column(condition.channelNum, condition.isAnalog)
+
+    def column(self, channelNum, isAnalog):
+        if isAnalog:
+            stream = channelNum
+        else:
+            stream = STREAM_FIO_EIO if channelNum < 16 else STREAM_CIO
+        if stream not in self.channels:
+            raise ValueError('Channel {0} is not streamed as {1} input.'.format(
+                channelNum, 'an analog' if isAnalog else 'a digital'))
+        return self.channels.index(stream)
+
+    def values(self, scans, channelNum, isAnalog):
+        k = self.column(channelNum, isAnalog)
+        if isAnalog:
+            return scans[:, k] * self.calibration.slopes[k] + self.calibration.offsets[k]
+        return ((scans[:, k] >> (channelNum % 16)) & 1).astype(bool)
+
+class PollColumns(object):
+    '''
+    channel values in blocks of poll rows (a time column, then one per channel,
+    NaN where a channel was not acquired)
+    '''
+    def check(self, trigger):
+        pass # any channel can be polled; until it is, its conditions never hold
+
+    def values(self, rows, channelNum, isAnalog):
+        col = rows[:, channelNum + 1]
+        return col if isAnalog else col > 0.5
+
+class TriggeredCapture(object):
+    '''
+    checks every acquired block (write()) against trigger and saves preScans scans
+    before each firing scan plus postScans scans from it on, as a recording in
+    directory (columns as a Recorder with width, dtype and metadata)
+    with continuous, the trigger re-arms after each capture; otherwise it stops
+    after the first; triggers firing while a capture is being completed are ignored
+    captures are saved by a background thread, so write() never waits on the disk
+    raises ValueError unless preScans >= 0 and postScans >= 1 (the firing scan)
+    '''
+    def __init__(self, trigger, columns, width, dtype, metadata, directory,
+            preScans=1000, postScans=1000, continuous=True):
+        self.trigger = trigger
+        self.columns = columns
+        self.width = width
+        self.dtype = np.dtype(dtype)
+        self.metadata = dict(metadata)
+        self.directory = directory
+        self.preScans = preScans
+        self.postScans = postScans
+        self.continuous = continuous
+        if preScans < 0 or postScans < 1:
+            # a capture must include its firing scan, or the trigger would fire on it again
+            raise ValueError('A capture needs at least 1 scan after the trigger and no negative scans before it.')
+
+        columns.check(trigger)
+        self.history = RingBuffer(max(1, preScans), width, self.dtype)
+        self.previous = None # the last scan written, for edges across blocks
+        self.pending = None # (pre-trigger scans, post-trigger blocks so far, scans still needed, time)
+        self.armed = True
+
+        # counters
+        self.triggers = 0 # firings that started a capture
+        self.saved = 0 # captures written to disk
+        self.paths = []
+
+        self.saves = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='TriggeredCapture', daemon=True)
+        self.thread.start()
+
+    def write(self, scans):
+        '''
+        check a block of scans (rows of width samples) and capture around each trigger
+        '''
+        scans = np.asarray(scans, dtype=self.dtype).reshape(-1, self.width)
+        if not len(scans):
+            return
+        fired = self.trigger.evaluate(self.columns, scans, self.previous) if self.armed else None
+
+        start = 0
+        while start < len(scans):
+            if self.pending is not None:
+                start = self.collect(scans, start)
+                continue
+            if not self.armed:
+                break
+            hits = np.flatnonzero(fired[start:])
+            if not len(hits):
+                break
+            k = start + hits[0]
+            self.triggers += 1
+            fromBlock = scans[max(0, k - self.preScans):k]
+            fromHistory = self.history.latest(self.preScans - len(fromBlock)) if self.preScans else scans[:0]
+            self.pending = (np.concatenate((fromHistory, fromBlock)), [], self.postScans, time.time())
+            start = k
+
+        self.history.write(scans)
+        self.previous = scans[-1].copy()
+
+    def collect(self, scans, start):
+        # post-trigger scans from start on; returns where the capture ended
+        pre, post, needed, detected = self.pending
+        block = scans[start:start + needed]
+        post.append(block)
+        needed -= len(block)
+        if needed:
+            self.pending = (pre, post, needed, detected)
+            return len(scans)
+
+        self.pending = None
+        self.armed = self.continuous
+        self.saves.put((pre, np.concatenate(post), detected))
+        return start + len(block)
+
+    def stop(self):
+        '''
+        save the capture in progress (shortened) and everything queued, then stop
+        '''
+        if self.pending is not None:
+            pre, post, needed, detected = self.pending
+            self.pending = None
+            self.saves.put((pre, np.concatenate(post) if post else pre[:0], detected))
+        self.saves.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            item = self.saves.get()
+            if item is None:
+                break
+            try:
+                self.save(*item)
+            except OSError as e:
+                print('Unable to save capture: {}'.format(e))
+
+    def save(self, pre, post, detected):
+        name = time.strftime('capture-%Y%m%d-%H%M%S', time.localtime(detected))
+        path = os.path.join(self.directory, '{0}-{1:03d}.ljr'.format(name, self.saved + 1))
+        metadata = dict(self.metadata)
+        metadata['trigger'] = {'condition': self.trigger.text, 'preScans': len(pre),
+            'postScans': len(post), 'time': detected}
+        recorder = Recorder(path, self.width, self.dtype, metadata)
+        recorder.start()
+        recorder.write(np.concatenate((pre, post)), detected)
+        recorder.close()
+        self.paths.append(path)
+        self.saved += 1
+
+    def statsMessage(self):
+        if self.pending is not None:
+            state = 'capturing'
+        else:
+            state = 'armed' if self.armed else 'done'
+        return 'Capture ({0}): {1}, {2} triggers, {3} saved'.format(self.trigger.text, state,
+            self.triggers, self.saved)
@@ -0,0 +1,52 @@
+'''
+Qt Designer forms compiled to Python once and reused, instead of parsing and
+compiling the .ui XML at every start as uic.loadUiType does
+'''
+# standard imports
+import os
+import importlib.util
+
+# third party imports
+from PyQt5 import QtWidgets
+
+CACHE_DIR = '__pycache__' # next to the .ui file
+
+def cachedForm(uifile):
+    directory, name = os.path.split(os.path.abspath(uifile))
+    return os.path.join(directory, CACHE_DIR, 'ui_{}.py'.format(os.path.splitext(name)[0]))
+
+def compileForm(uifile, pyfile):
+    '''
+    write the form class of uifile to pyfile, with the names of its form and
+    base classes (as uic.loadUiType finds them) at the end
+    '''
+    from PyQt5.uic import compiler # only needed when a form changes
+    os.makedirs(os.path.dirname(pyfile), exist_ok=True)
+    temp = '{0}.{1}.tmp'.format(pyfile, os.getpid())
+    with open(temp, 'w') as f:
+        winfo = compiler.UICompiler().compileUi(uifile, f, False, '_rc', '.')
+        f.write('\nUICLASS = {0!r}\nBASECLASS = {1!r}\n'.format(winfo['uiclass'], winfo['baseclass']))
+    os.replace(temp, pyfile) # other processes never see a half-written form
+
+def loadUiType(uifile):
+    '''
+    (form class, base class) of uifile, as uic.loadUiType
+    compiled on first use and again whenever uifile is newer than the compiled form
+    '''
+    pyfile = cachedForm(uifile)
+    try:
+        if not os.path.exists(pyfile) or os.path.getmtime(pyfile) < os.path.getmtime(uifile):
+            compileForm(uifile, pyfile)
+    except OSError as e: # e.g. read-only install
+        print('Unable to cache {0}: {1}'.format(uifile, e))
+        from PyQt5 import uic
+        return uic.loadUiType(uifile)
+
+    name = os.path.splitext(os.path.basename(pyfile))[0]
+    spec = importlib.util.spec_from_file_location(name, pyfile)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    # the base class is a custom class imported by the form, or a Qt widget
+    base = getattr(module, module.BASECLASS, None) or getattr(QtWidgets, module.BASECLASS)
+    return getattr(module, module.UICLASS), base